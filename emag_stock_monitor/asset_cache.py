@@ -0,0 +1,250 @@
+"""静态资源的本地磁盘缓存"""
+
+from __future__ import annotations
+
+from asyncio import to_thread
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional, Union
+
+    from playwright.async_api import BrowserContext, Route
+
+
+CACHE_HOSTS = ('emag.ro', 's13emagst.akamaized.net')
+"""缓存哪些域名（及其子域名）的静态资源"""
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+_DROP_HEADERS = frozenset(
+    ('content-encoding', 'content-length', 'transfer-encoding', 'set-cookie', 'date', 'age')
+)
+"""不保存的响应头（body 保存的是解压后的内容；cookie 不应在 context 之间共享）"""
+
+
+def _write_temp(path: Path, data: bytes) -> Path:
+    """把 `data` 写入 `path` 同目录下的临时文件（保证能原子地改名为 `path`），返回临时文件路径"""
+    with NamedTemporaryFile(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp', delete=False) as f:
+        f.write(data)
+    return Path(f.name)
+
+
+class AssetCache:
+    """
+    静态资源（JS、CSS、字体）的磁盘缓存
+
+    ---
+
+    * `directory`: 缓存目录，可在多个 context、多次运行之间共用
+    * `max_bytes`: 缓存总大小上限，超过后按最近访问时间淘汰（LRU）
+    * `resource_types`: 缓存的资源类型
+    * `hosts`: 缓存的域名（包含其子域名）
+
+    ---
+
+    * 缓存键为请求方法 + 完整链接，eMAG 的静态资源链接带版本号，内容变化时链接也会变
+    * 只缓存 200 的 GET 响应，`Cache-Control` 为 `no-store` / `private` / `no-cache` 的不缓存，
+    带 `max-age` 的到期后重新请求
+    * 需要在 `RequestFilter.attach` 之前 `attach`：后注册的路由先执行，过滤器放行（`fallback`）后才轮到缓存
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        max_bytes: int = 512 * 1024 * 1024,
+        resource_types: Iterable[str] = ('script', 'stylesheet', 'font'),
+        hosts: Iterable[str] = CACHE_HOSTS,
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._resource_types = frozenset(resource_types)
+        self._hosts = tuple(hosts)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(self.directory.joinpath('index.db'), check_same_thread=False)
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, url TEXT NOT NULL, size INTEGER NOT NULL, '
+            'expires REAL, last_access REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);'
+        )
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        """从缓存返回的字节数"""
+
+    def is_cacheable_request(self, method: str, url: str, resource_type: str) -> bool:
+        if method != 'GET' or resource_type not in self._resource_types:
+            return False
+        host = urlsplit(url).hostname or ''
+        return any(host == h or host.endswith('.' + h) for h in self._hosts)
+
+    @staticmethod
+    def cache_key(method: str, url: str) -> str:
+        return sha256(f'{method} {url}'.encode()).hexdigest()
+
+    @staticmethod
+    def expires_at(headers: dict[str, str], now: float) -> Optional[float]:
+        """根据 `Cache-Control` 计算过期时间，不可缓存时抛出 `ValueError`，不过期时返回 `None`"""
+        cache_control = headers.get('cache-control', '').lower()
+        if any(d in cache_control for d in ('no-store', 'private', 'no-cache')):
+            raise ValueError(f'不可缓存 Cache-Control: {cache_control}')
+        if 'immutable' in cache_control:
+            return None
+        match = _MAX_AGE.search(cache_control)
+        if match is not None:
+            return now + int(match[1])
+        # 没有缓存策略的带版本号资源视为不过期
+        return None
+
+    def _paths(self, key: str) -> tuple[Path, Path]:
+        base = self.directory.joinpath(key[:2], key)
+        return base.with_suffix('.body'), base.with_suffix('.json')
+
+    def _load(self, key: str) -> Optional[tuple[dict[str, Any], bytes]]:
+        now = time()
+        body_path, meta_path = self._paths(key)
+        # 在锁内读文件：同一 key 的写入、淘汰都持有锁，读到的 body 与 meta 总是同一份
+        with self._lock:
+            row = self._conn.execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] is not None and row[0] < now:
+                self._delete(key)
+                self._conn.commit()
+                return None
+            try:
+                meta = json.loads(meta_path.read_text(encoding='utf-8'))
+                body = body_path.read_bytes()
+            except (OSError, ValueError):
+                self._delete(key)
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        return meta, body
+
+    def _store(
+        self, key: str, url: str, status: int, headers: dict[str, str], body: bytes, expires: Optional[float]
+    ) -> None:
+        body_path, meta_path = self._paths(key)
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        # 先在锁外写临时文件，再在锁内改名并更新索引，避免并发的淘汰或同一 key 的写入看到写了一半的文件
+        meta = json.dumps({'url': url, 'status': status, 'headers': headers}, ensure_ascii=False).encode()
+        temp_paths: list[Path] = list()
+        try:
+            temp_paths.append(_write_temp(body_path, body))
+            temp_paths.append(_write_temp(meta_path, meta))
+            with self._lock:
+                os.replace(temp_paths[0], body_path)
+                os.replace(temp_paths[1], meta_path)
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO entries (key, url, size, expires, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (key, url, len(body), expires, time()),
+                )
+                self._conn.commit()
+                self._evict()
+        finally:
+            for path in temp_paths:
+                path.unlink(missing_ok=True)
+
+    def _delete(self, key: str) -> None:
+        """删除一条缓存（需持有 `_lock`）"""
+        self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        for path in self._paths(key):
+            path.unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """超过大小上限时按最近访问时间淘汰到上限的 90%（需持有 `_lock`）"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+            if total <= target:
+                break
+            self._delete(key)
+            total -= size
+            evicted += 1
+        self._conn.commit()
+        self.evictions += evicted
+        logger.debug('静态资源缓存淘汰了 {} 个文件，剩余 {} 字节', evicted, total)
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    async def attach(self, context: BrowserContext) -> None:
+        """给 `context` 注册路由"""
+        await context.route('**/*', self._handle)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        if not self.is_cacheable_request(request.method, request.url, request.resource_type):
+            await route.fallback()
+            return
+
+        key = self.cache_key(request.method, request.url)
+        cached = await to_thread(self._load, key)
+        if cached is not None:
+            meta, body = cached
+            self.hits += 1
+            self.bytes_served += len(body)
+            metrics.count('asset_cache', result='hit')
+            await route.fulfill(status=meta['status'], headers=meta['headers'], body=body)
+            return
+
+        self.misses += 1
+        metrics.count('asset_cache', result='miss')
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except PlaywrightError as pe:
+            logger.debug('静态资源缓存请求 "{}" 时出错，交给浏览器处理\n{}', request.url, pe)
+            await route.fallback()
+            return
+
+        if response.status == 200:
+            headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS}
+            try:
+                expires = self.expires_at({k.lower(): v for k, v in headers.items()}, time())
+            except ValueError:
+                pass
+            else:
+                await to_thread(self._store, key, request.url, response.status, headers, body, expires)
+                self.stores += 1
+        await route.fulfill(response=response, body=body)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'bytes_served': self.bytes_served,
+            'size': self.size,
+        }
+
+    def close(self) -> None:
+        self._conn.close()
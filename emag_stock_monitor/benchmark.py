@@ -0,0 +1,428 @@
+"""
+离线基准测试
+
+---
+
+用本地替身服务器（`StandinServer` + `SyntheticCatalog`）模拟产品列表页、购物车页和购物车接口，
+无头浏览器跑完整的处理流程，统计各阶段耗时、每个产品的 Playwright 调用次数和每分钟处理的产品数。
+结果追加到 JSONL 文件，每次运行都与同样配置的上一次结果比较
+
+```shell
+python -m emag_stock_monitor.benchmark --pages 3 --latency 0.05 --mode click
+```
+
+`--fixtures` 指定保存下来的页面目录时，优先使用其中的产品列表页（仓库中有 `tests/fixtures/pages/jocuri-societate/p1.html`），
+购物车仍由模拟类目按加购结果生成
+
+```shell
+python -m emag_stock_monitor.benchmark --fixtures emag_stock_monitor/tests/fixtures/pages --categories jocuri-societate --pages 1
+```
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from datetime import datetime
+from functools import wraps
+import json
+from pathlib import Path
+from statistics import median
+import subprocess
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+
+if TYPE_CHECKING:
+    from typing import Any, Literal, Optional, Sequence, Union
+
+
+DEFAULT_RESULTS_PATH = Path('benchmarks/results.jsonl')
+"""基准测试结果的默认保存路径"""
+
+
+class BenchmarkConfig:
+    """
+    基准测试配置
+
+    ---
+
+    * `categories` / `pages`: 处理的类目和每个类目的页数
+    * `products_per_page` / `promovat_per_page`: 每页的普通产品数和 Promovat 产品数
+    * `latency`: 替身服务器每个请求的延迟（秒）
+    * `dialog`: 加购后是否弹出加购弹窗
+    * `reuse_dialog`: 加购弹窗是否预先渲染好并重复使用（关闭时只隐藏）
+    * `add_cart_mode`: 加购方式，见 `handle_list_page`
+    * `contexts` / `carts_per_page`: 见 `ContextPool`
+    * `cart_api_timeout`: 见 `CartSession` 的 `api_timeout`，为 0 时只解析购物车页的 DOM
+    * `headless`: 是否无头
+    * `fixtures_dir`: 保存下来的页面所在目录，见 `StandinServer`；有对应页面时不使用生成的产品列表页
+    * `browser_kwargs`: 传给 `BrowserManager` 的其他参数（如 `executable_path`）
+    """
+
+    def __init__(
+        self,
+        categories: Sequence[str] = ('bench-a',),
+        pages: int = 2,
+        products_per_page: int = 60,
+        promovat_per_page: int = 4,
+        latency: float = 0.0,
+        dialog: bool = True,
+        reuse_dialog: bool = False,
+        add_cart_mode: Literal['click', 'api'] = 'click',
+        contexts: int = 1,
+        carts_per_page: int = 1,
+        cart_api_timeout: int = 0,
+        headless: bool = True,
+        fixtures_dir: Optional[Union[str, Path]] = None,
+        **browser_kwargs: Any,
+    ) -> None:
+        self.categories = list(categories)
+        self.pages = pages
+        self.products_per_page = products_per_page
+        self.promovat_per_page = promovat_per_page
+        self.latency = latency
+        self.dialog = dialog
+        self.reuse_dialog = reuse_dialog
+        self.add_cart_mode: Literal['click', 'api'] = add_cart_mode
+        self.contexts = contexts
+        self.carts_per_page = carts_per_page
+        self.cart_api_timeout = cart_api_timeout
+        self.headless = headless
+        self.fixtures_dir = str(fixtures_dir) if fixtures_dir is not None else None
+        self.browser_kwargs = browser_kwargs
+
+    def as_dict(self) -> dict[str, Any]:
+        """参与比较的配置（不含浏览器参数）"""
+        config = {
+            'categories': self.categories,
+            'pages': self.pages,
+            'products_per_page': self.products_per_page,
+            'promovat_per_page': self.promovat_per_page,
+            'latency': self.latency,
+            'dialog': self.dialog,
+            'add_cart_mode': self.add_cart_mode,
+            'contexts': self.contexts,
+            'carts_per_page': self.carts_per_page,
+            'headless': self.headless,
+        }
+        # 只在不是默认值时加上，与之前的结果保持可比
+        if self.reuse_dialog:
+            config['reuse_dialog'] = True
+        if self.cart_api_timeout > 0:
+            config['cart_api_timeout'] = self.cart_api_timeout
+        if self.fixtures_dir is not None:
+            config['fixtures_dir'] = self.fixtures_dir
+        return config
+
+
+class StageTimer:
+    """
+    给模块或类上的协程函数计时
+
+    ---
+
+    `patch` 会替换 `owner` 上的 `name`，`restore` 时换回；调用方在调用时才从模块中查找函数，所以不需要修改业务代码
+    """
+
+    def __init__(self) -> None:
+        self.durations: defaultdict[str, list[float]] = defaultdict(list)
+        self._patched: list[tuple[Any, str, Any]] = list()
+
+    def patch(self, owner: Any, name: str, stage: str) -> None:
+        original = getattr(owner, name)
+
+        @wraps(original)
+        async def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.durations[stage].append(perf_counter() - start)
+
+        setattr(owner, name, timed)
+        self._patched.append((owner, name, original))
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched.clear()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        result: dict[str, dict[str, float]] = dict()
+        for stage, durations in self.durations.items():
+            ordered = sorted(durations)
+            result[stage] = {
+                'count': len(ordered),
+                'total': round(sum(ordered), 4),
+                'mean': round(sum(ordered) / len(ordered), 4),
+                'p50': round(median(ordered), 4),
+                'p95': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 4),
+            }
+        return result
+
+
+class RoundTripCounter:
+    """
+    统计 Playwright 客户端与驱动之间的请求次数（按协议方法分类）
+
+    ---
+
+    依赖 Playwright 的内部实现（`Channel._inner_send`），版本不兼容时 `available` 为 `False`
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter[str] = Counter()
+        self.available = False
+        self._original: Any = None
+
+    def start(self) -> None:
+        try:
+            from playwright._impl._connection import Channel
+        except ImportError:
+            logger.warning('无法统计 Playwright 调用次数：找不到 Channel')
+            return
+        original = getattr(Channel, '_inner_send', None)
+        if original is None:
+            logger.warning('无法统计 Playwright 调用次数：Channel 没有 _inner_send')
+            return
+        counts = self.counts
+
+        @wraps(original)
+        async def counted(channel, method, *args, **kwargs):
+            counts[method] += 1
+            return await original(channel, method, *args, **kwargs)
+
+        Channel._inner_send = counted  # type: ignore
+        self._original = original
+        self.available = True
+
+    def stop(self) -> None:
+        if self._original is not None:
+            from playwright._impl._connection import Channel
+
+            Channel._inner_send = self._original  # type: ignore
+            self._original = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+def _patch_stages(timer: StageTimer) -> None:
+    from emag_stock_monitor import context_pool
+    from emag_stock_monitor.page_handlers import cart_page, cart_pipeline, list_page
+
+    timer.patch(context_pool.ContextPool, 'crawl_list_page', 'list_page_total')
+    timer.patch(context_pool, 'wait_page_load', 'wait_page_load')
+    timer.patch(context_pool, 'handle_list_page', 'handle_list_page')
+    timer.patch(list_page, 'extract_products', 'extract_products')
+    timer.patch(list_page, 'extract_add_cart_forms', 'extract_add_cart_forms')
+    timer.patch(list_page, 'add_to_cart_by_api', 'add_to_cart_by_api')
+    timer.patch(cart_pipeline, 'handle_cart', 'handle_cart')
+    timer.patch(cart_page.CartSession, '_refresh', 'cart_refresh')
+    timer.patch(cart_page, 'parse_qty', 'parse_qty_dom')
+    timer.patch(cart_page, 'clear_cart', 'clear_cart')
+
+
+def current_version() -> str:
+    """当前代码的版本（git 提交），不在 git 仓库中时为 `unknown`"""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def run_benchmark(config: BenchmarkConfig) -> dict[str, Any]:
+    """按 `config` 跑一次基准测试，返回结果"""
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from emag_stock_monitor.browser_util import PageGuard, RequestFilter
+    from emag_stock_monitor.context_pool import ContextPool
+    from emag_stock_monitor.page_handlers.cart_page import get_cart_session
+    from emag_stock_monitor.page_handlers.list_page_http import parse_list_page
+    from emag_stock_monitor.standin_catalog import SyntheticCatalog
+    from emag_stock_monitor.standin_server import StandinServer
+    from emag_stock_monitor.urls import build_list_page_url
+
+    catalog = SyntheticCatalog(
+        products_per_page=config.products_per_page,
+        promovat_per_page=config.promovat_per_page,
+        pages=config.pages,
+        dialog=config.dialog,
+        reuse_dialog=config.reuse_dialog,
+    )
+    timer = StageTimer()
+    round_trips = RoundTripCounter()
+
+    with StandinServer(fixtures_dir=config.fixtures_dir, catalog=catalog, latency=config.latency) as server:
+        urls = list()
+        expected_products = 0
+        for category in config.categories:
+            for page in range(1, config.pages + 1):
+                url = build_list_page_url(category, page, base_url=server.base_url)
+                urls.append(url)
+                # 保存的页面产品数不固定，按实际提供的页面计算
+                html = server.list_page_html(category, page)
+                if html is not None:
+                    expected_products += len(parse_list_page(html.decode('utf-8'), url))
+        async with BrowserManager(headless=config.headless, **config.browser_kwargs) as bm:
+            async with ContextPool(
+                bm,
+                size=config.contexts,
+                page_guard=PageGuard(),
+                request_filter=RequestFilter(cart_url=server.cart_url),
+                add_cart_mode=config.add_cart_mode,
+                carts_per_page=config.carts_per_page,
+            ) as pool:
+                for context in pool.contexts:
+                    get_cart_session(
+                        context,
+                        api_timeout=config.cart_api_timeout,
+                        cart_url=server.cart_url,
+                        api_routes=server.cart_api_routes,
+                    )
+
+                _patch_stages(timer)
+                round_trips.start()
+                start = perf_counter()
+                try:
+                    results = await pool.crawl(urls)
+                finally:
+                    wall_time = perf_counter() - start
+                    round_trips.stop()
+                    timer.restore()
+
+    products = [p for r in results for p in r.products]
+    correct = sum(1 for p in products if p.qty == catalog.expected_qty(p.pnk))
+    return {
+        'version': current_version(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': config.as_dict(),
+        'wall_time': round(wall_time, 3),
+        'pages': len(results),
+        'products': len(products),
+        'expected_products': expected_products,
+        'correct_qty': correct,
+        'products_per_minute': round(len(products) / wall_time * 60, 2) if wall_time > 0 else 0.0,
+        'round_trips': round_trips.total if round_trips.available else None,
+        'round_trips_per_product': (
+            round(round_trips.total / len(products), 2) if round_trips.available and products else None
+        ),
+        'round_trips_by_method': dict(round_trips.counts.most_common(15)),
+        'stages': timer.summary(),
+    }
+
+
+def save_result(result: dict[str, Any], path: Union[str, Path] = DEFAULT_RESULTS_PATH) -> None:
+    """把结果追加到 JSONL 文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('a', encoding='utf-8') as f:
+        f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+def load_results(path: Union[str, Path] = DEFAULT_RESULTS_PATH) -> list[dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return list()
+    with path.open('r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(current: dict[str, Any], previous: dict[str, Any]) -> dict[str, Optional[float]]:
+    """比较两次结果，返回主要指标的变化比例（正数为变大）"""
+
+    def change(key: str) -> Optional[float]:
+        a, b = previous.get(key), current.get(key)
+        if not a or b is None:
+            return None
+        return round((b - a) / a, 4)
+
+    result = {k: change(k) for k in ('products_per_minute', 'wall_time', 'round_trips_per_product')}
+    for stage, stats in current.get('stages', dict()).items():
+        prev_stats = previous.get('stages', dict()).get(stage)
+        if prev_stats and prev_stats['mean'] > 0:
+            result[f'stages.{stage}.mean'] = round(
+                (stats['mean'] - prev_stats['mean']) / prev_stats['mean'], 4
+            )
+    return result
+
+
+def find_previous(current: dict[str, Any], results: list[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """找到配置相同的上一次结果"""
+    for r in reversed(results):
+        if r.get('config') == current['config']:
+            return r
+    return None
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    import asyncio
+
+    parser = ArgumentParser(description='离线基准测试')
+    parser.add_argument('--categories', nargs='+', default=['bench-a'])
+    parser.add_argument('--pages', type=int, default=2)
+    parser.add_argument('--products', type=int, default=60, help='每页的普通产品数')
+    parser.add_argument('--promovat', type=int, default=4, help='每页的 Promovat 产品数')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟（秒）')
+    parser.add_argument('--no-dialog', action='store_true', help='加购后不弹出加购弹窗')
+    parser.add_argument('--reuse-dialog', action='store_true', help='加购弹窗预先渲染好并重复使用')
+    parser.add_argument('--mode', choices=('click', 'api'), default='click', help='加购方式')
+    parser.add_argument('--contexts', type=int, default=1)
+    parser.add_argument('--carts-per-page', type=int, default=1)
+    parser.add_argument(
+        '--cart-api-timeout', type=int, default=0, help='从购物车接口读取最大可加购数的等待时间（毫秒）'
+    )
+    parser.add_argument('--headed', action='store_true', help='显示浏览器窗口')
+    parser.add_argument('--fixtures', default=None, help='保存下来的页面所在目录')
+    parser.add_argument('--executable-path', default=None, help='浏览器可执行文件路径')
+    parser.add_argument('--output', default=str(DEFAULT_RESULTS_PATH), help='结果保存路径（JSONL）')
+    args = parser.parse_args(argv)
+
+    browser_kwargs = dict()
+    if args.executable_path is not None:
+        browser_kwargs['executable_path'] = args.executable_path
+    config = BenchmarkConfig(
+        categories=args.categories,
+        pages=args.pages,
+        products_per_page=args.products,
+        promovat_per_page=args.promovat,
+        latency=args.latency,
+        dialog=not args.no_dialog,
+        reuse_dialog=args.reuse_dialog,
+        add_cart_mode=args.mode,
+        contexts=args.contexts,
+        carts_per_page=args.carts_per_page,
+        cart_api_timeout=args.cart_api_timeout,
+        headless=not args.headed,
+        fixtures_dir=args.fixtures,
+        **browser_kwargs,
+    )
+
+    previous = find_previous({'config': config.as_dict()}, load_results(args.output))
+    result = asyncio.run(run_benchmark(config))
+    save_result(result, args.output)
+
+    logger.info(
+        f'{result["products"]}/{result["expected_products"]} 个产品（最大可加购数正确 {result["correct_qty"]} 个），'
+        f'耗时 {result["wall_time"]} 秒，每分钟 {result["products_per_minute"]} 个产品，'
+        f'每个产品 {result["round_trips_per_product"]} 次 Playwright 调用'
+    )
+    for stage, stats in result['stages'].items():
+        logger.info(f'{stage:<24} {stats}')
+    if previous is not None:
+        logger.info(
+            f'与 {previous["version"]}（{previous["timestamp"]}）相比 {compare_results(result, previous)}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,175 @@
 
 from __future__ import annotations
 
+from collections import Counter
+from pathlib import Path
 from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
 
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.utils.file_util import read_file
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
 from emag_stock_monitor.regexps import cart_page_track_routes
+from emag_stock_monitor.urls import CART_PAGE_URL
 
 if TYPE_CHECKING:
-    from playwright.async_api import BrowserContext
+    from typing import Any, Iterable, Optional
+
+    from playwright.async_api import BrowserContext, Page, Request, Route
+
+
+JS_DIR = Path(__file__).resolve().parent.parent.joinpath('js')
+"""初始化脚本所在目录"""
+
+
+TRACK_ROUTES: tuple[str, ...] = (
+    *cart_page_track_routes.keys(),
+    'www.googletagmanager.com',
+    'www.google-analytics.com',
+    'googleads.g.doubleclick.net',
+    'connect.facebook.net',
+)
+"""埋点、广告请求（`域名` 或 `域名/路径前缀`，域名同时匹配其子域名）"""
 
 
 async def block_emag_track(context: BrowserContext):
     """屏蔽 eMAG 的页面埋点"""
-    for k, v in cart_page_track_routes.items():
-        await context.route(v, lambda r: r.abort())
+    await RequestFilter(list_page_resource_types=(), cart_page_resource_types=()).attach(context)
+
+
+class RequestFilter:
+    """
+    请求过滤器
+
+    ---
+
+    * `track_routes`: 要屏蔽的埋点、广告请求，见 `TRACK_ROUTES`
+    * `list_page_resource_types`: 产品列表页上要屏蔽的资源类型，可加上 `stylesheet`
+    * `cart_page_resource_types`: 购物车页上要屏蔽的资源类型（购物车页需要判断元素是否可见，默认不屏蔽样式表）
+    * `cart_url`: 购物车页链接（前缀），用本地替身服务器时传入替身服务器的购物车页链接
+
+    ---
+
+    整个 context 只注册一个路由，按 `域名 -> 路径前缀` 的索引判断是否屏蔽，
+    不再对每个请求依次尝试每条正则；请求所在页面是购物车页还是产品列表页按其 frame 的链接区分，
+    导航请求发出时 frame 还是上一个页面，所以按请求本身的链接区分
+    """
+
+    def __init__(
+        self,
+        track_routes: Iterable[str] = TRACK_ROUTES,
+        list_page_resource_types: Iterable[str] = ('image', 'media', 'font'),
+        cart_page_resource_types: Iterable[str] = ('image', 'media', 'font'),
+        cart_url: str = CART_PAGE_URL,
+    ) -> None:
+        self._host_paths: dict[str, list[str]] = dict()
+        for r in track_routes:
+            host, _, path = r.partition('/')
+            self._host_paths.setdefault(host, list()).append('/' + path)
+        self._list_page_resource_types = frozenset(list_page_resource_types)
+        self._cart_page_resource_types = frozenset(cart_page_resource_types)
+        self.cart_url = cart_url
+
+        self.blocked: Counter[str] = Counter()
+        """屏蔽的请求数（按原因：埋点域名或资源类型）"""
+        self.blocked_by_type: Counter[str] = Counter()
+        """屏蔽的请求数（按资源类型）"""
+        self.passed = 0
+        """放行的请求数"""
+
+    def match_track(self, url: str) -> Optional[str]:
+        """判断链接是否为埋点、广告请求，是则返回匹配到的规则"""
+        split_result = urlsplit(url)
+        host = split_result.hostname or ''
+        path = split_result.path or '/'
+        # 依次尝试 a.b.c、b.c、c
+        while True:
+            prefixes = self._host_paths.get(host)
+            if prefixes is not None:
+                for prefix in prefixes:
+                    if path.startswith(prefix):
+                        return host + prefix.rstrip('/')
+            if '.' not in host:
+                return None
+            host = host.split('.', 1)[1]
+
+    def match(self, url: str, resource_type: str, is_cart_page: bool = False) -> Optional[str]:
+        """判断请求是否要屏蔽，是则返回原因"""
+        resource_types = self._cart_page_resource_types if is_cart_page else self._list_page_resource_types
+        if resource_type in resource_types:
+            return resource_type
+        return self.match_track(url)
+
+    async def attach(self, context: BrowserContext) -> None:
+        """给 `context` 注册路由"""
+        await context.route('**/*', self._handle)
+
+    def is_cart_page_request(self, request: Request) -> bool:
+        """请求是否属于购物车页"""
+        try:
+            page_url = request.url if request.is_navigation_request() else request.frame.url
+        except PlaywrightError:
+            return False
+        return page_url.startswith(self.cart_url)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        is_cart_page = self.is_cart_page_request(request)
+        reason = self.match(request.url, request.resource_type, is_cart_page)
+        if reason is None:
+            self.passed += 1
+            await route.fallback()
+        else:
+            self.blocked[reason] += 1
+            self.blocked_by_type[request.resource_type] += 1
+            await route.abort()
+
+    @property
+    def blocked_requests(self) -> int:
+        return self.blocked.total()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            'blocked_requests': self.blocked_requests,
+            'passed_requests': self.passed,
+            'blocked': dict(self.blocked),
+            'blocked_by_type': dict(self.blocked_by_type),
+        }
+
+
+class PageGuard:
+    """
+    页面守卫
+
+    ---
+
+    通过 `js/page-guard.js` 在页面内用 MutationObserver 自动关闭加购弹窗、去除遮罩、隐藏 cookie 提示，
+    每处理一次就通过 `expose_binding` 通知 Python，并按类型计数：
+
+    * `cart-dialog`: 加购弹窗
+    * `overlay`: 页面遮罩
+    * `cookie-banner`: cookie 提示
+    """
+
+    BINDING_NAME = 'emagGuardReport'
+
+    def __init__(self) -> None:
+        self.counts: Counter[str] = Counter()
+        self._script: str = read_file(JS_DIR.joinpath('page-guard.js'), mode='str', async_mode=False)  # type: ignore
+
+    async def install(self, context: BrowserContext) -> None:
+        """给 `context` 中之后打开的所有页面装上守卫"""
+        await context.expose_binding(self.BINDING_NAME, self._on_report)
+        await context.add_init_script(self._script)
+
+    def _on_report(self, source: dict, kind: str) -> None:
+        self.counts[kind] += 1
+        metrics.count('page_guard', kind=kind)
+        logger.debug('页面守卫处理了 {}', kind)
+
+
+async def is_page_guard_installed(page: Page) -> bool:
+    """页面是否已装上守卫"""
+    return await page.evaluate('() => window.__emagPageGuard === true')
@@ -0,0 +1,159 @@
+"""验证码检测与熔断"""
+
+from __future__ import annotations
+
+from asyncio import Event, create_task, sleep
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.xpaths import CAPTCHA_BODY
+
+if TYPE_CHECKING:
+    from asyncio import Task
+    from typing import Callable, Optional
+
+    from playwright.async_api import BrowserContext, Page, Response
+
+
+def is_captcha_response(url: str, status: int) -> bool:
+    """
+    根据响应判断是否遇到验证码
+
+    ---
+
+    * eMAG 返回 511
+    * Cloudflare 验证返回 401
+    """
+    if status not in (511, 401):
+        return False
+    host = urlsplit(url).hostname or ''
+    if status == 511:
+        return host == 'emag.ro' or host.endswith('.emag.ro')
+    return host == 'challenges.cloudflare.com'
+
+
+class CircuitBreaker:
+    """
+    验证码熔断器
+
+    ---
+
+    * `base_delay`: 第一次熔断后暂停的秒数，连续熔断时翻倍
+    * `max_delay`: 暂停秒数上限
+    * `max_trips`: 连续熔断次数上限，超过后不再恢复，`wait` 会抛出最后一次的 `CaptchaError`
+    * `on_trip`: 熔断时的回调（如发出提醒）
+
+    ---
+
+    任意 worker / context 检测到验证码时调用 `trip`，所有 worker 在下一次 `wait` 时暂停，
+    退避一段时间后自动恢复；恢复后处理成功时调用 `record_success` 清零连续熔断次数
+    """
+
+    def __init__(
+        self,
+        base_delay: float = 60,
+        max_delay: float = 30 * 60,
+        max_trips: int = 5,
+        on_trip: Optional[Callable[[CaptchaError], None]] = None,
+    ) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_trips = max_trips
+        self._on_trip = on_trip
+        self._closed = Event()
+        self._closed.set()
+        self._resume_task: Optional[Task[None]] = None
+        self.trips = 0
+        """累计熔断次数"""
+        self.consecutive_trips = 0
+        """连续熔断次数"""
+        self.last_error: Optional[CaptchaError] = None
+        self.exhausted = False
+        """连续熔断次数超过上限，不再恢复"""
+
+    @property
+    def is_open(self) -> bool:
+        """是否处于暂停状态"""
+        return not self._closed.is_set()
+
+    def trip(self, error: CaptchaError) -> None:
+        """熔断（已处于暂停状态时只记录错误）"""
+        self.last_error = error
+        if self.is_open:
+            return
+
+        self.trips += 1
+        self.consecutive_trips += 1
+        metrics.count('captcha_trips')
+        self._closed.clear()
+        if self._on_trip is not None:
+            self._on_trip(error)
+
+        if self.consecutive_trips > self.max_trips:
+            self.exhausted = True
+            logger.critical(f'连续 {self.consecutive_trips} 次遇到验证码，停止爬取\n{error}')
+            # 唤醒所有等待中的 worker，让它们在 wait 中抛出异常
+            self._closed.set()
+            return
+
+        delay = min(self.base_delay * 2 ** (self.consecutive_trips - 1), self.max_delay)
+        logger.error(
+            f'遇到验证码，所有 worker 暂停 {delay:.0f} 秒（连续第 {self.consecutive_trips} 次）\n{error}'
+        )
+        self._resume_task = create_task(self._resume_later(delay))
+
+    async def _resume_later(self, delay: float) -> None:
+        await sleep(delay)
+        logger.info('验证码暂停结束，恢复爬取')
+        self._closed.set()
+
+    def record_success(self) -> None:
+        """恢复后处理成功，清零连续熔断次数"""
+        if not self.is_open:
+            self.consecutive_trips = 0
+
+    async def wait(self) -> None:
+        """暂停中则等待恢复；不再恢复时抛出最后一次的 `CaptchaError`"""
+        await self._closed.wait()
+        if self.exhausted and self.last_error is not None:
+            raise self.last_error
+
+
+class CaptchaDetector:
+    """
+    验证码检测
+
+    ---
+
+    * 监听 context 的所有响应，状态码为验证码时熔断（`is_captcha_response`）
+    * `check_page` 检查页面是否为验证码页（`/html/body[contains(@class,"captcha")]`）
+
+    ---
+
+    响应回调里抛出的异常没人接得住，所以回调只负责熔断，由 `check_page` / `check_tripped` 在 worker 中抛出 `CaptchaError`
+    """
+
+    def __init__(self, breaker: CircuitBreaker) -> None:
+        self.breaker = breaker
+
+    def attach(self, context: BrowserContext) -> None:
+        context.on('response', self._on_response)
+
+    def _on_response(self, response: Response) -> None:
+        if is_captcha_response(response.url, response.status):
+            self.breaker.trip(CaptchaError(response.url, response.status, '响应状态码为验证码'))
+
+    async def check_page(self, page: Page) -> None:
+        """页面是验证码页时熔断并抛出 `CaptchaError`"""
+        if await page.locator(f'xpath={CAPTCHA_BODY}').count() > 0:
+            error = CaptchaError(page.url, 200, '页面是验证码页')
+            self.breaker.trip(error)
+            raise error
+
+    def check_tripped(self, trips_before: int) -> None:
+        """从记下 `trips_before` 以来发生过熔断时抛出 `CaptchaError`（期间的结果不可信）"""
+        if self.breaker.trips != trips_before and self.breaker.last_error is not None:
+            raise self.breaker.last_error
@@ -0,0 +1,277 @@
+"""浏览器环境池"""
+
+from __future__ import annotations
+
+from asyncio import Lock, Queue, Semaphore, gather
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.browser_util import block_emag_track
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.page_handlers.cart_page import get_cart_session
+from emag_stock_monitor.page_handlers.list_page import handle_list_page, wait_page_load
+from emag_stock_monitor.retry import navigation_policy
+
+if TYPE_CHECKING:
+    from typing import Any, AsyncIterator, Iterable, Literal, Optional, Sequence, Union
+
+    from playwright.async_api import BrowserContext
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from emag_stock_monitor.asset_cache import AssetCache
+    from emag_stock_monitor.browser_util import PageGuard, RequestFilter
+    from emag_stock_monitor.captcha import CaptchaDetector
+    from emag_stock_monitor.models import Product
+    from emag_stock_monitor.qty_cache import QtyCache
+    from emag_stock_monitor.retry import HostRateLimiter
+
+
+class ListPageResult:
+    """
+    一个产品列表页的处理结果
+
+    ---
+
+    * `url`: 产品列表页链接
+    * `context_index`: 处理该页面的 context 在池中的序号
+    * `products`: 带最大可加购数的产品
+    """
+
+    def __init__(self, url: str, context_index: int, products: list[Product]) -> None:
+        self.url = url
+        self.context_index = context_index
+        self.products = products
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(url="{self.url}", context_index={self.context_index}, products={len(self.products)})'
+
+
+class ContextPool:
+    """
+    BrowserContext 池
+
+    ---
+
+    * `browser_manager`: 用来创建 context 的 `BrowserManager`
+    * `size`: context 数量，即同时处理的产品列表页数量上限
+    * `init_scripts`: 添加到每个 context 的初始化脚本
+    * `page_guard`: 装到每个 context 上的页面守卫（自动关闭加购弹窗等）
+    * `request_filter`: 装到每个 context 上的请求过滤器，不指定时只屏蔽埋点
+    * `asset_cache`: 所有 context 共用的静态资源缓存（过滤器放行的请求才会经过缓存）
+    * `rate_limiter`: 装到每个 context 上的按域名限速器，根据响应的 429 / 511 自动降速；
+    打开产品列表页、购物车页和接口加购前取令牌，页面内的点击不限速
+    * `captcha_detector`: 装到每个 context 上的验证码检测，熔断时暂停处理新页面，处理期间发生熔断的页面抛出 `CaptchaError`；
+    同时有 `rate_limiter` 时把熔断器交给它，处理中的页面在下一次请求或点击前也会暂停
+    * `add_cart_mode`: 加购方式，见 `handle_list_page`
+    * `carts_per_page`: 每个产品列表页占用的 context（购物车）数，大于 1 时分批加购与统计交替进行（仅 `api` 模式）
+    * `qty_cache`: 所有 context 共用的最大可加购数缓存，见 `handle_list_page`
+    * `storage_state_dir`: 保存各 context 的 storage state（cookie、同意 cookie 横幅等）的目录，
+    启动时从 `context-{序号}.json` 恢复，关闭时写回；每个 context 各存一份，保证购物车互不共享
+    * `context_kwargs`: 传给 `BrowserManager.new_context` 的参数
+
+    ---
+
+    每个 context 有各自的 cookie（即各自的购物车）和各自的加购锁，同一时间每个 context 只处理一个产品列表页
+    """
+
+    def __init__(
+        self,
+        browser_manager: BrowserManager,
+        size: int = 2,
+        init_scripts: Sequence[str] = (),
+        page_guard: Optional[PageGuard] = None,
+        request_filter: Optional[RequestFilter] = None,
+        asset_cache: Optional[AssetCache] = None,
+        rate_limiter: Optional[HostRateLimiter] = None,
+        captcha_detector: Optional[CaptchaDetector] = None,
+        add_cart_mode: Literal['click', 'api'] = 'click',
+        carts_per_page: int = 1,
+        qty_cache: Optional[QtyCache] = None,
+        storage_state_dir: Optional[Union[str, Path]] = None,
+        **context_kwargs: Any,
+    ) -> None:
+        if size < 1:
+            raise ValueError('size 需为正整数')
+        if not 1 <= carts_per_page <= size:
+            raise ValueError('carts_per_page 需在 1 ~ size 之间')
+        self._browser_manager = browser_manager
+        self.size = size
+        self._init_scripts = tuple(init_scripts)
+        self.page_guard = page_guard
+        self.request_filter = request_filter
+        self.asset_cache = asset_cache
+        self.rate_limiter = rate_limiter
+        self.captcha_detector = captcha_detector
+        if rate_limiter is not None and captcha_detector is not None and rate_limiter.breaker is None:
+            rate_limiter.breaker = captcha_detector.breaker
+        self.add_cart_mode: Literal['click', 'api'] = add_cart_mode
+        self.carts_per_page = carts_per_page
+        self.qty_cache = qty_cache
+        self.storage_state_dir = Path(storage_state_dir) if storage_state_dir is not None else None
+        self._context_kwargs = context_kwargs
+        self._contexts: list[BrowserContext] = list()
+        self._idle: Queue[int] = Queue()
+        self._acquire_lock = Lock()
+
+    @property
+    def contexts(self) -> list[BrowserContext]:
+        return self._contexts
+
+    async def start(self) -> None:
+        """创建所有 context"""
+        logger.info(f'创建 {self.size} 个 context...')
+        for i in range(self.size):
+            context_kwargs = dict(self._context_kwargs)
+            state_path = self._storage_state_path(i)
+            if state_path is not None and state_path.is_file():
+                logger.debug('context #{} 从 "{}" 恢复 storage state', i, state_path)
+                context_kwargs['storage_state'] = str(state_path)
+            context = await self._browser_manager.new_context(**context_kwargs)
+            # 后注册的路由先执行，缓存需在过滤器之前注册
+            if self.asset_cache is not None:
+                await self.asset_cache.attach(context)
+            if self.request_filter is not None:
+                await self.request_filter.attach(context)
+            else:
+                await block_emag_track(context)
+            if self.page_guard is not None:
+                await self.page_guard.install(context)
+            if self.rate_limiter is not None:
+                self.rate_limiter.attach(context)
+            if self.captcha_detector is not None:
+                self.captcha_detector.attach(context)
+            for script in self._init_scripts:
+                await context.add_init_script(script)
+            self._contexts.append(context)
+            self._idle.put_nowait(i)
+
+    def _storage_state_path(self, index: int) -> Optional[Path]:
+        if self.storage_state_dir is None:
+            return None
+        return self.storage_state_dir.joinpath(f'context-{index}.json')
+
+    async def save_storage_state(self) -> None:
+        """把各 context 的 storage state 写入 `storage_state_dir`"""
+        if self.storage_state_dir is None:
+            return
+        self.storage_state_dir.mkdir(parents=True, exist_ok=True)
+        for i, context in enumerate(self._contexts):
+            await context.storage_state(path=self._storage_state_path(i))
+        logger.debug(
+            '已保存 {} 个 context 的 storage state 至 "{}"', len(self._contexts), self.storage_state_dir
+        )
+
+    async def close(self) -> None:
+        """关闭所有 context（关闭前保存 storage state）"""
+        await self.save_storage_state()
+        for context in self._contexts:
+            await get_cart_session(context).close()
+            await context.close()
+        self._contexts.clear()
+
+    async def __aenter__(self) -> ContextPool:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    @asynccontextmanager
+    async def acquire(self, count: int = 1) -> AsyncIterator[list[tuple[int, BrowserContext]]]:
+        """取出 `count` 个空闲的 context，用完后放回"""
+        indexes: list[int] = list()
+        try:
+            # 一次取齐，避免多个任务各取到一部分后互相等待
+            async with self._acquire_lock:
+                for _ in range(count):
+                    indexes.append(await self._idle.get())
+            yield [(i, self._contexts[i]) for i in indexes]
+        finally:
+            for i in indexes:
+                self._idle.put_nowait(i)
+
+    async def crawl_list_page(self, url: str) -> ListPageResult:
+        """用空闲的 context 处理一个产品列表页"""
+        async with self.acquire(self.carts_per_page) as acquired:
+            (index, context), extra = acquired[0], acquired[1:]
+            with metrics.tags(context=index), metrics.span('list_page'):
+                detector = self.captcha_detector
+                if detector is not None:
+                    await detector.breaker.wait()
+                    trips_before = detector.breaker.trips
+                logger.info(f'context #{index} 开始处理 "{url}"')
+                page = await context.new_page()
+                try:
+                    with metrics.span('page_load'):
+                        await navigation_policy.call(
+                            'page_load', lambda: page.goto(url), url=url, limiter=self.rate_limiter
+                        )
+                    if detector is not None:
+                        await detector.check_page(page)
+                    with metrics.span('wait_page_load'):
+                        load = await wait_page_load(page)
+                    if not load:
+                        # 没加载完整时刷新重试一次，仍不完整就按已加载的产品继续，但要留下记录
+                        metrics.count('partial_page_loads')
+                        logger.warning(
+                            f'context #{index} "{url}" 只加载出 {load.card_count}/{load.expect_count} 个产品，刷新后重试'
+                        )
+                        with metrics.span('page_load', retry=True):
+                            await navigation_policy.call(
+                                'page_load', lambda: page.reload(), url=url, limiter=self.rate_limiter
+                            )
+                        if detector is not None:
+                            await detector.check_page(page)
+                        with metrics.span('wait_page_load', retry=True):
+                            load = await wait_page_load(page)
+                        if not load:
+                            metrics.count('partial_page_loads', retried=True)
+                            logger.error(
+                                f'context #{index} "{url}" 刷新后仍只加载出 {load.card_count}/{load.expect_count} 个产品，'
+                                '按已加载的产品继续'
+                            )
+                    products = await handle_list_page(
+                        page,
+                        add_cart_mode=self.add_cart_mode,
+                        extra_contexts=[c for _, c in extra],
+                        qty_cache=self.qty_cache,
+                    )
+                finally:
+                    if not page.is_closed():
+                        await page.close()
+                if detector is not None:
+                    detector.check_tripped(trips_before)
+                    detector.breaker.record_success()
+                metrics.count('products', len(products))
+                logger.info(f'context #{index} 处理完 "{url}"，得到 {len(products)} 个产品')
+                return ListPageResult(url=url, context_index=index, products=products)
+
+    async def crawl(self, urls: Iterable[str], concurrency: Optional[int] = None) -> list[ListPageResult]:
+        """
+        并发处理多个产品列表页
+
+        ---
+
+        * `concurrency`: 同时处理的页面数上限，默认（也最多）为 context 数量能同时支撑的页面数
+        """
+        max_concurrency = self.size // self.carts_per_page
+        if concurrency is None:
+            concurrency = max_concurrency
+        elif concurrency < 1:
+            raise ValueError('concurrency 需为正整数')
+        semaphore = Semaphore(min(concurrency, max_concurrency))
+
+        async def run(url: str) -> ListPageResult:
+            async with semaphore:
+                return await self.crawl_list_page(url)
+
+        urls = list(urls)
+        results: list[ListPageResult] = list()
+        for url, r in zip(urls, await gather(*(run(u) for u in urls), return_exceptions=True)):
+            if isinstance(r, BaseException):
+                logger.error(f'处理 "{url}" 时出错\n{r!r}')
+            else:
+                results.append(r)
+        return results
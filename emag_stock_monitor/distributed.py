@@ -0,0 +1,504 @@
+"""多进程 / 多机分片爬取"""
+
+from __future__ import annotations
+
+from asyncio import create_task, gather, get_running_loop, run, sleep, to_thread
+from collections import deque
+from inspect import isawaitable
+import multiprocessing
+from multiprocessing.managers import BaseManager
+import os
+from queue import Empty, Queue
+from socket import gethostname
+from threading import Condition, Event
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.context_pool import ListPageResult
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.models import Product
+from emag_stock_monitor.qty_cache import QtyCache
+from emag_stock_monitor.scheduler import CategoryJobs, Job
+from emag_stock_monitor.urls import BASE_URL
+
+if TYPE_CHECKING:
+    from multiprocessing.process import BaseProcess
+    from pathlib import Path
+    from typing import Any, Awaitable, Callable, Iterable, Optional, Union
+
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from emag_stock_monitor.context_pool import ContextPool
+
+    _PoolFactory = Callable[[BrowserManager], ContextPool]
+    _OnResult = Callable[[Job, ListPageResult], Union[Awaitable[None], None]]
+    _Row = tuple[str, str, int, bool, Optional[int], Optional[int]]
+
+
+_POLL_INTERVAL = 1.0
+"""从队列取消息的超时秒数（超时后检查停止条件和过期的租约）"""
+
+
+class JobBoard:
+    """
+    任务队列与租约（由队列服务进程持有，方法线程安全）
+
+    ---
+
+    * `lease_timeout`: 租约的秒数，worker 在这段时间内没有续约（心跳）时租约过期
+
+    ---
+
+    worker 用 `claim` 领取任务时在同一次调用里登记租约，领取后进程退出、网络断开都不会让任务丢失；
+    处理期间 worker 定时 `heartbeat` 续约，协调进程定时 `expire` 收回过期的租约再决定是否放回队列
+    """
+
+    def __init__(self, lease_timeout: float = 120) -> None:
+        self.lease_timeout = lease_timeout
+        self._queue: deque[dict[str, Any]] = deque()
+        # 任务 key -> (worker, 过期时间, 任务)
+        self._leases: dict[str, tuple[str, float, dict[str, Any]]] = dict()
+        self._cond = Condition()
+
+    @staticmethod
+    def _key(job: dict[str, Any]) -> str:
+        return Job.from_dict(job).key
+
+    def put(self, job: dict[str, Any]) -> None:
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify()
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[dict[str, Any]]:
+        """领取一个任务并登记租约，`timeout` 秒内没有任务时返回 `None`"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._queue) > 0, timeout=timeout):
+                return None
+            job = self._queue.popleft()
+            self._leases[self._key(job)] = (worker_id, monotonic() + self.lease_timeout, job)
+            return job
+
+    def heartbeat(self, worker_id: str, keys: list[str]) -> None:
+        """为 `worker_id` 手上的任务续约"""
+        deadline = monotonic() + self.lease_timeout
+        with self._cond:
+            for key in keys:
+                lease = self._leases.get(key)
+                if lease is not None and lease[0] == worker_id:
+                    self._leases[key] = (worker_id, deadline, lease[2])
+
+    def release(self, key: str, worker_id: str) -> bool:
+        """结束 `worker_id` 对任务的租约，租约已过期（或不属于它）时返回 `False`"""
+        with self._cond:
+            lease = self._leases.get(key)
+            if lease is None or lease[0] != worker_id:
+                return False
+            del self._leases[key]
+            return True
+
+    def expire(self, worker_id: Optional[str] = None) -> list[tuple[str, str]]:
+        """
+        收回过期的租约，返回 `(任务 key, worker)`（任务不会自动放回队列）
+
+        ---
+
+        * `worker_id`: 指定时不论是否过期，收回该 worker 的所有租约（如本机 worker 进程已退出）
+        """
+        now = monotonic()
+        with self._cond:
+            expired = [
+                (key, w)
+                for key, (w, deadline, _) in self._leases.items()
+                if (w == worker_id if worker_id is not None else deadline < now)
+            ]
+            for key, _ in expired:
+                del self._leases[key]
+        return expired
+
+    def discard(self, key: str) -> None:
+        """从队列中删除任务（过期后放回的任务又被原 worker 完成时）"""
+        with self._cond:
+            self._queue = deque(j for j in self._queue if self._key(j) != key)
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {'queued': len(self._queue), 'leased': len(self._leases)}
+
+
+_board: Optional[JobBoard] = None
+_results: Queue[dict[str, Any]] = Queue()
+_stopped = Event()
+_settings: dict[str, Any] = dict()
+_qty_cache: Optional[QtyCache] = None
+
+
+def _get_board() -> JobBoard:
+    if _board is None:
+        raise LookupError('队列服务没有初始化')
+    return _board
+
+
+def _get_results() -> Queue[dict[str, Any]]:
+    return _results
+
+
+def _get_stopped() -> Event:
+    return _stopped
+
+
+def _get_settings() -> dict[str, Any]:
+    return _settings
+
+
+def _get_qty_cache() -> QtyCache:
+    if _qty_cache is None:
+        raise LookupError('协调进程没有启用最大可加购数缓存')
+    return _qty_cache
+
+
+def _init_server(lease_timeout: float, qty_cache_kwargs: Optional[dict[str, Any]]) -> None:
+    """在队列服务进程中创建共用的对象"""
+    global _board, _qty_cache
+    _board = JobBoard(lease_timeout)
+    if qty_cache_kwargs is not None:
+        _qty_cache = QtyCache(**qty_cache_kwargs)
+    _settings['lease_timeout'] = lease_timeout
+    _settings['qty_cache'] = _qty_cache is not None
+
+
+class QueueManager(BaseManager):
+    """协调进程与 worker 共用的任务队列（含租约）和结果队列"""
+
+
+QueueManager.register('board', callable=_get_board)
+QueueManager.register('results', callable=_get_results)
+QueueManager.register('stopped', callable=_get_stopped)
+QueueManager.register('settings', callable=_get_settings)
+QueueManager.register('qty_cache', callable=_get_qty_cache)
+
+
+def _product_row(p: Product) -> _Row:
+    return (p.pnk, p.source_url, p.rank, p.top_favorite, p.review_count, p.qty)
+
+
+class Coordinator(CategoryJobs):
+    """
+    分片爬取的协调进程
+
+    ---
+
+    * `checkpoint_path`: 检查点文件路径，与 `CrawlScheduler` 的格式相同
+    * `max_attempts`: 每个任务最多尝试次数，超过后标记为 `failed`
+    * `on_result`: 每完成一个任务时的回调（可以是协程函数），传入的产品已去重
+    * `address`: 队列服务的地址，默认只监听本机的随机端口；要让其他机器的 worker 连接时改成对外的地址
+    * `authkey`: 队列服务的密钥，worker 需使用相同的密钥
+    * `lease_timeout`: 任务租约的秒数，worker 超过这个时间没有心跳时任务放回队列（见 `JobBoard`）
+    * `qty_cache_kwargs`: 传给 `QtyCache` 的参数，指定时由队列服务持有一份缓存，所有 worker 共用（见 `handle_list_page`），
+    结束时写回 `path`
+
+    ---
+
+    1. `add_categories` 把类目按页数展开成任务
+    2. `run` 启动队列服务，把任务放进任务队列，再启动 `processes` 个本机 worker 进程；
+    其他机器可用 `run_worker` 连接同一个地址领取任务
+    3. worker 逐个返回结果，协调进程按 `(pnk, source_url)` 去重后交给 `on_result`，写入检查点；
+    worker 随心跳定时（以及退出时）发回期间的指标，协调进程汇总到本进程的 `metrics`（带 `worker` 标签）
+    4. 失败的任务重新放回队列；遇到验证码的任务不计入失败次数；
+    租约过期（worker 卡死、断开）或本机 worker 进程退出时任务计一次失败并放回队列
+    """
+
+    def __init__(
+        self,
+        checkpoint_path: Union[str, Path],
+        max_attempts: int = 3,
+        on_result: Optional[_OnResult] = None,
+        address: tuple[str, int] = ('127.0.0.1', 0),
+        authkey: bytes = b'emag-stock-monitor',
+        lease_timeout: float = 120,
+        qty_cache_kwargs: Optional[dict[str, Any]] = None,
+    ) -> None:
+        super().__init__(checkpoint_path)
+        self.max_attempts = max_attempts
+        self._on_result = on_result
+        self.address = address
+        self.authkey = authkey
+        self.lease_timeout = lease_timeout
+        self.qty_cache_kwargs = qty_cache_kwargs
+        self._seen: set[tuple[str, str]] = set()
+        self.duplicates = 0
+        """去重时丢弃的产品数"""
+
+    def _dedupe(self, rows: Iterable[_Row]) -> list[Product]:
+        products: list[Product] = list()
+        for row in rows:
+            key = (row[0], row[1])
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(key)
+            # worker 中已校验过
+            products.append(Product._trusted(*row))
+        return products
+
+    async def _fail(self, board: JobBoard, job: Job, worker_id: str, error: str) -> bool:
+        """任务失败一次，未超过次数时放回队列，返回任务是否就此结束"""
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            job.status = 'failed'
+            logger.error(f'worker {worker_id} 处理 {job} 失败，不再重试\n{error}')
+            return True
+        metrics.count('retries', stage='job')
+        logger.warning(f'worker {worker_id} 处理 {job} 失败，稍后重试\n{error}')
+        await to_thread(board.put, job.as_dict())
+        return False
+
+    async def run(
+        self,
+        pool_factory: _PoolFactory,
+        browser_kwargs: Optional[dict[str, Any]] = None,
+        processes: int = 2,
+        base_url: str = BASE_URL,
+    ) -> list[ListPageResult]:
+        """
+        启动队列服务和 `processes` 个本机 worker，处理所有未完成的任务
+
+        ---
+
+        * `pool_factory`: 在 worker 进程中用 `BrowserManager` 创建 `ContextPool` 的函数（需为模块级函数）
+        * `browser_kwargs`: 传给 worker 进程中 `BrowserManager` 的参数
+        * `processes`: 本机 worker 进程数，为 0 时只等待其他机器的 worker
+        * `base_url`: 产品列表页的站点根链接
+        """
+        pending = sorted(
+            (j for j in self._jobs.values() if j.status != 'done' and j.attempts < self.max_attempts),
+            key=lambda j: -j.priority,
+        )
+        for job in pending:
+            job.status = 'pending'
+        self._checkpoint.save(self._jobs.values())
+        logger.info(f'共 {len(self._jobs)} 个任务，待处理 {len(pending)} 个')
+
+        manager = QueueManager(address=self.address, authkey=self.authkey)
+        manager.start(initializer=_init_server, initargs=(self.lease_timeout, self.qty_cache_kwargs))
+        address = manager.address
+        logger.info(f'队列服务地址 {address}')
+        board: JobBoard = manager.board()  # type: ignore[attr-defined]
+        results_queue = manager.results()  # type: ignore[attr-defined]
+        stopped = manager.stopped()  # type: ignore[attr-defined]
+        for job in pending:
+            board.put(job.as_dict())
+
+        spawn = multiprocessing.get_context('spawn')
+        workers: dict[str, BaseProcess] = dict()
+        for i in range(processes):
+            worker_id = f'{gethostname()}-{i}'
+            process = spawn.Process(
+                target=run_worker,
+                args=(address, self.authkey, pool_factory, browser_kwargs, worker_id, base_url),
+                name=f'emag-worker-{i}',
+            )
+            process.start()
+            workers[worker_id] = process
+
+        results: list[ListPageResult] = list()
+        # 已收回租约的本机 worker
+        exited: set[str] = set()
+        remaining = len(pending)
+        loop = get_running_loop()
+        next_expire = loop.time() + _POLL_INTERVAL
+        try:
+            while remaining > 0:
+                try:
+                    message: Optional[dict[str, Any]] = await to_thread(
+                        results_queue.get, True, _POLL_INTERVAL
+                    )
+                except Empty:
+                    message = None
+
+                if message is None or loop.time() >= next_expire:
+                    next_expire = loop.time() + _POLL_INTERVAL
+                    expired = await to_thread(board.expire)
+                    for worker_id, process in workers.items():
+                        if process.exitcode is not None and worker_id not in exited:
+                            exited.add(worker_id)
+                            expired.extend(await to_thread(board.expire, worker_id))
+                    for key, worker_id in expired:
+                        job = self._jobs[key]
+                        if job.status != 'pending':
+                            continue
+                        metrics.count('lease_expirations')
+                        if await self._fail(board, job, worker_id, f'任务 "{key}" 的租约已过期'):
+                            remaining -= 1
+                    if len(expired) > 0:
+                        self._checkpoint.save(self._jobs.values())
+                    if processes > 0 and len(exited) == len(workers):
+                        logger.error(f'所有本机 worker 已退出，剩余 {remaining} 个任务未完成')
+                        break
+                    if message is None:
+                        continue
+
+                kind, worker_id = message['type'], message['worker']
+                if 'metrics' in message:
+                    metrics.merge(message['metrics'], worker=worker_id)
+                if kind == 'exit':
+                    logger.info(f'worker {worker_id} 退出')
+                    continue
+                if kind == 'metrics':
+                    continue
+
+                job = self._jobs[message['job']]
+                held = await to_thread(board.release, job.key, worker_id)
+                if job.status != 'pending':
+                    logger.debug('忽略 worker {} 对已结束的 {} 的结果', worker_id, job)
+                    continue
+
+                if kind == 'done':
+                    if not held:
+                        # 租约过期后放回队列的那一份不用再处理
+                        await to_thread(board.discard, job.key)
+                    job.status = 'done'
+                    remaining -= 1
+                    products = self._dedupe(message['rows'])
+                    result = ListPageResult(
+                        url=message['url'], context_index=message['context_index'], products=products
+                    )
+                    results.append(result)
+                    logger.info(f'worker {worker_id} 完成 {job}，去重后 {len(products)} 个产品')
+                    if self._on_result is not None:
+                        r = self._on_result(job, result)
+                        if isawaitable(r):
+                            await r
+                elif not held:
+                    # 租约过期时已经计过失败并放回队列
+                    logger.debug('worker {} 的 {} 租约已过期，忽略其 {} 结果', worker_id, job, kind)
+                    continue
+                elif kind == 'captcha':
+                    metrics.count('captcha', category=job.category)
+                    logger.warning(
+                        f'worker {worker_id} 处理 {job} 时遇到验证码，放回队列\n{message["error"]}'
+                    )
+                    await to_thread(board.put, job.as_dict())
+                elif await self._fail(board, job, worker_id, message['error']):
+                    remaining -= 1
+                self._checkpoint.save(self._jobs.values())
+        finally:
+            stopped.set()
+            for process in workers.values():
+                await to_thread(process.join)
+            # worker 退出前发出的最后一批指标
+            while True:
+                try:
+                    message = results_queue.get_nowait()
+                except Empty:
+                    break
+                if 'metrics' in message:
+                    metrics.merge(message['metrics'], worker=message['worker'])
+            self._checkpoint.save(self._jobs.values())
+            if self.qty_cache_kwargs is not None:
+                qty_cache = manager.qty_cache()  # type: ignore[attr-defined]
+                qty_cache.save()
+                logger.info(f'最大可加购数缓存统计 {qty_cache.stats()}')
+            manager.shutdown()
+
+        metrics.count('duplicate_products', self.duplicates)
+        logger.info(
+            f'本次完成 {len(results)} 个任务，剩余 {remaining} 个未完成，去重丢弃 {self.duplicates} 个重复产品'
+        )
+        return results
+
+
+def run_worker(
+    address: tuple[str, int],
+    authkey: bytes,
+    pool_factory: _PoolFactory,
+    browser_kwargs: Optional[dict[str, Any]] = None,
+    worker_id: Optional[str] = None,
+    base_url: str = BASE_URL,
+) -> None:
+    """
+    连接协调进程的队列服务并处理任务，直到协调进程结束
+
+    ---
+
+    本机 worker 由 `Coordinator.run` 启动；其他机器上直接调用即可加入同一次爬取
+    """
+    worker_id = worker_id if worker_id is not None else f'{gethostname()}-{os.getpid()}'
+    run(_worker_main(address, authkey, pool_factory, browser_kwargs or dict(), worker_id, base_url))
+
+
+async def _worker_main(
+    address: tuple[str, int],
+    authkey: bytes,
+    pool_factory: _PoolFactory,
+    browser_kwargs: dict[str, Any],
+    worker_id: str,
+    base_url: str,
+) -> None:
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    board = manager.board()  # type: ignore[attr-defined]
+    results_queue = manager.results()  # type: ignore[attr-defined]
+    stopped = manager.stopped()  # type: ignore[attr-defined]
+    settings = manager.settings()  # type: ignore[attr-defined]
+    logger.info(f'worker {worker_id} 已连接 {address}')
+
+    # 本 worker 手上的任务，心跳时为它们续约
+    claimed: set[str] = set()
+
+    async def heartbeat() -> None:
+        interval = settings.get('lease_timeout') / 3
+        while not await to_thread(stopped.is_set):
+            await sleep(interval)
+            if len(claimed) > 0:
+                await to_thread(board.heartbeat, worker_id, list(claimed))
+            # 指标只在这里和退出时导出：各任务并发处理，按任务导出会带上其他任务的增量
+            data = metrics.export(clear=True)
+            if len(data['counters']) > 0 or len(data['histograms']) > 0:
+                await to_thread(results_queue.put, {'type': 'metrics', 'worker': worker_id, 'metrics': data})
+
+    async with BrowserManager(**browser_kwargs) as bm:
+        async with pool_factory(bm) as pool:
+            if pool.qty_cache is None and settings.get('qty_cache'):
+                pool.qty_cache = manager.qty_cache()  # type: ignore[attr-defined]
+
+            async def loop() -> None:
+                while not await to_thread(stopped.is_set):
+                    job_dict = await to_thread(board.claim, worker_id, _POLL_INTERVAL)
+                    if job_dict is None:
+                        continue
+                    job = Job.from_dict(job_dict)
+                    claimed.add(job.key)
+                    message: dict[str, Any] = {'worker': worker_id, 'job': job.key}
+                    url = job.url(base_url)
+                    try:
+                        with metrics.tags(category=job.category, page=job.page):
+                            result = await pool.crawl_list_page(url)
+                    except CaptchaError as ce:
+                        message.update(type='captcha', error=str(ce))
+                    except Exception as e:
+                        message.update(type='failed', error=repr(e))
+                    else:
+                        message.update(
+                            type='done',
+                            url=result.url,
+                            context_index=result.context_index,
+                            rows=[_product_row(p) for p in result.products],
+                        )
+                    # 结果放进队列后再停止续约，由协调进程收回租约
+                    await to_thread(results_queue.put, message)
+                    claimed.discard(job.key)
+                    if message['type'] == 'captcha' and pool.captcha_detector is not None:
+                        # 本进程的熔断器恢复后再领取新任务，不再恢复时抛出异常结束 worker
+                        await pool.captcha_detector.breaker.wait()
+
+            heartbeat_task = create_task(heartbeat())
+            try:
+                await gather(*(loop() for _ in range(pool.size // pool.carts_per_page)))
+            finally:
+                heartbeat_task.cancel()
+
+    results_queue.put({'type': 'exit', 'worker': worker_id, 'metrics': metrics.export(clear=True)})
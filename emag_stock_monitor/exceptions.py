@@ -14,6 +14,21 @@ class GotoCartPageError(Exception):
     """打开购物车页失败时抛出的异常"""
 
 
+class ClearCartError(Exception):
+    """清空购物车失败时抛出的异常"""
+
+
+class FetchListPageError(Exception):
+    """不使用浏览器请求产品列表页失败时抛出的异常"""
+
+    def __init__(self, url: str, status: int) -> None:
+        self.url = url
+        self.status = status
+
+    def __str__(self) -> str:
+        return f'{self.__class__.__name__}: {{url="{self.url}", status={self.status}}}'
+
+
 class CaptchaError(Exception):
     """遇到验证码时抛出的异常"""
 
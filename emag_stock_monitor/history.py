@@ -0,0 +1,301 @@
+"""历史库存数据与销量分析"""
+
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.sinks import FIELDNAMES, ResultSink
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional, Union
+
+    from pandas import DataFrame
+
+    from emag_stock_monitor.models import Product
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    pnk TEXT NOT NULL,
+    source_url TEXT NOT NULL,
+    ts REAL NOT NULL,
+    rank INTEGER NOT NULL,
+    top_favorite INTEGER NOT NULL,
+    review_count INTEGER,
+    qty INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_pnk_ts ON snapshots (pnk, ts);
+CREATE INDEX IF NOT EXISTS idx_snapshots_ts ON snapshots (ts);
+
+CREATE TABLE IF NOT EXISTS velocity (
+    pnk TEXT PRIMARY KEY,
+    ts REAL NOT NULL,
+    qty INTEGER,
+    first_ts REAL NOT NULL,
+    depletion INTEGER NOT NULL DEFAULT 0,
+    restock INTEGER NOT NULL DEFAULT 0,
+    velocity REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_velocity_velocity ON velocity (velocity DESC);
+'''
+"""
+* `snapshots`: 每次爬取的原始快照
+* `velocity`: 每个 pnk 的最新库存与累计消耗，每次写入快照时增量更新，用来直接回答「卖得最快的前 N 个」
+"""
+
+
+class HistoryStore:
+    """
+    历史库存数据（SQLite）
+
+    ---
+
+    * `path`: 数据库文件路径
+
+    ---
+
+    `velocity` 表中的 `depletion` 为累计消耗（只累计库存下降，补货不抵扣），`restock` 为累计补货，
+    `velocity` 为 `depletion / 首次到最新一次快照的小时数`，与 `compute_velocity` 的结果一致
+
+    连接会在 `HistorySink` 的写入线程和事件循环中使用，所有访问都持有 `_lock`
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def ingest(self, products: Iterable[Product], ts: Optional[float] = None) -> int:
+        """写入一批产品的快照，返回写入条数"""
+        ts = ts if ts is not None else time()
+        return self.ingest_rows([{**{k: getattr(p, k) for k in FIELDNAMES}, 'ts': ts} for p in products])
+
+    def ingest_rows(self, rows: list[dict[str, Any]]) -> int:
+        """写入快照（每行包含 `FIELDNAMES` 与 `ts`），并增量更新 `velocity` 表"""
+        if len(rows) == 0:
+            return 0
+
+        # 一批中可能有同一 pnk 多个时刻的快照（`HistorySink` 缓冲了多次 push），按 (pnk, ts) 排序后逐对累计；
+        # 同一 pnk 在同一时刻出现在多个页面时只算一次，取最小的 qty（与 `compute_velocity` 相同）
+        series: dict[str, dict[float, int]] = dict()
+        for r in rows:
+            if r['qty'] is None:
+                continue
+            points = series.setdefault(r['pnk'], dict())
+            points[r['ts']] = min(points.get(r['ts'], r['qty']), r['qty'])
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO snapshots (pnk, source_url, ts, rank, top_favorite, review_count, qty) '
+                'VALUES (:pnk, :source_url, :ts, :rank, :top_favorite, :review_count, :qty)',
+                rows,
+            )
+            self._update_velocity({pnk: sorted(points.items()) for pnk, points in series.items()})
+        return len(rows)
+
+    def _update_velocity(self, series: dict[str, list[tuple[float, int]]]) -> None:
+        """把每个 pnk 按时间排好序的 `(ts, qty)` 累计到 `velocity` 表（需持有 `_lock`）"""
+        pnks = list(series)
+        previous: dict[str, tuple[float, Optional[int], float, int, int]] = dict()
+        # SQLite 变量数有上限，分块查询
+        for i in range(0, len(pnks), 500):
+            chunk = pnks[i : i + 500]
+            for pnk, ts, qty, first_ts, depletion, restock in self._conn.execute(
+                'SELECT pnk, ts, qty, first_ts, depletion, restock FROM velocity '
+                f'WHERE pnk IN ({",".join("?" * len(chunk))})',
+                chunk,
+            ):
+                previous[pnk] = (ts, qty, first_ts, depletion, restock)
+
+        updates = list()
+        for pnk, points in series.items():
+            if pnk in previous:
+                last_ts, last_qty, first_ts, depletion, restock = previous[pnk]
+            else:
+                (last_ts, last_qty), points = points[0], points[1:]
+                first_ts, depletion, restock = last_ts, 0, 0
+            changed = pnk not in previous
+            for ts, qty in points:
+                # 早于已记录的最新快照的数据无法再插入序列中，忽略
+                if ts <= last_ts:
+                    continue
+                if last_qty is not None:
+                    if qty < last_qty:
+                        depletion += last_qty - qty
+                    else:
+                        restock += qty - last_qty
+                last_ts, last_qty = ts, qty
+                changed = True
+            if not changed:
+                continue
+            hours = (last_ts - first_ts) / 3600
+            velocity = depletion / hours if hours > 0 else 0.0
+            updates.append((pnk, last_ts, last_qty, first_ts, depletion, restock, velocity))
+
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO velocity (pnk, ts, qty, first_ts, depletion, restock, velocity) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            updates,
+        )
+
+    def top_velocity(self, n: int = 100) -> DataFrame:
+        """消耗速度（件/小时）最快的 `n` 个 pnk，直接走 `velocity` 表的索引，不读取历史快照"""
+        from pandas import read_sql_query
+
+        with self._lock:
+            return read_sql_query(
+                'SELECT pnk, qty, ts, first_ts, depletion, restock, velocity FROM velocity '
+                'ORDER BY velocity DESC LIMIT ?',
+                self._conn,
+                params=(n,),
+            )
+
+    def velocity_of(self, pnks: Iterable[str]) -> dict[str, tuple[Optional[int], float]]:
+        """读取 `pnks` 的最新库存与消耗速度，返回 pnk -> `(qty, velocity)`（走 `velocity` 表的主键）"""
+        pnks = list(pnks)
+        result: dict[str, tuple[Optional[int], float]] = dict()
+        with self._lock:
+            for i in range(0, len(pnks), 500):
+                chunk = pnks[i : i + 500]
+                for pnk, qty, velocity in self._conn.execute(
+                    f'SELECT pnk, qty, velocity FROM velocity WHERE pnk IN ({",".join("?" * len(chunk))})',
+                    chunk,
+                ):
+                    result[pnk] = (qty, velocity)
+        return result
+
+    def load(
+        self,
+        pnks: Optional[Iterable[str]] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> DataFrame:
+        """按 pnk、时间范围读取快照（走 `(pnk, ts)` / `ts` 索引）"""
+        from pandas import concat, read_sql_query
+
+        conditions: list[str] = list()
+        params: list[Any] = list()
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+
+        columns = 'pnk, source_url, ts, rank, top_favorite, review_count, qty'
+        if pnks is None:
+            where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+            with self._lock:
+                return read_sql_query(f'SELECT {columns} FROM snapshots{where}', self._conn, params=params)
+
+        pnks = list(pnks)
+        frames = list()
+        with self._lock:
+            for i in range(0, len(pnks), 500):
+                chunk = pnks[i : i + 500]
+                where = ' AND '.join([f'pnk IN ({",".join("?" * len(chunk))})', *conditions])
+                frames.append(
+                    read_sql_query(
+                        f'SELECT {columns} FROM snapshots WHERE {where}', self._conn, params=[*chunk, *params]
+                    )
+                )
+            if len(frames) == 0:
+                return read_sql_query(f'SELECT {columns} FROM snapshots WHERE 0', self._conn)
+        return concat(frames, ignore_index=True)
+
+
+class HistorySink(ResultSink):
+    """把爬取结果流式写入 `HistoryStore`（时间戳取 `push` 的时刻）"""
+
+    def __init__(self, store: HistoryStore, buffer_size: int = 500) -> None:
+        super().__init__(buffer_size=buffer_size)
+        self.store = store
+
+    def _rows(self, products: Iterable[Product]) -> list[dict[str, Any]]:
+        ts = time()
+        return [{**row, 'ts': ts} for row in super()._rows(products)]
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        self.store.ingest_rows(rows)
+
+
+def compute_velocity(snapshots: DataFrame) -> DataFrame:
+    """
+    按 pnk 计算库存消耗与销售速度（向量化）
+
+    ---
+
+    * `snapshots`: 至少包含 `pnk`、`ts`（秒）、`qty` 列，如 `HistoryStore.load()` 的结果
+
+    ---
+
+    返回每个 pnk 一行：
+    * `first_ts` / `last_ts`: 首次、最新一次快照时间
+    * `last_qty`: 最新库存
+    * `depletion`: 累计消耗（只累计库存下降）
+    * `restock`: 累计补货
+    * `velocity`: 平均销售速度（件/小时）
+    * `snapshots`: 快照次数
+    """
+    from pandas import to_numeric
+
+    df = snapshots[['pnk', 'ts', 'qty']].dropna(subset=['qty'])
+    # 同一 pnk 同一时刻出现在多个页面时只算一次
+    df = df.groupby(['pnk', 'ts'], sort=True, as_index=False)['qty'].min()
+    df['qty'] = to_numeric(df['qty'])
+
+    delta = df.groupby('pnk', sort=False)['qty'].diff()
+    df['depletion'] = (-delta).clip(lower=0).fillna(0)
+    df['restock'] = delta.clip(lower=0).fillna(0)
+
+    result = df.groupby('pnk', sort=False).agg(
+        first_ts=('ts', 'first'),
+        last_ts=('ts', 'last'),
+        last_qty=('qty', 'last'),
+        depletion=('depletion', 'sum'),
+        restock=('restock', 'sum'),
+        snapshots=('ts', 'size'),
+    )
+    hours = (result['last_ts'] - result['first_ts']) / 3600
+    result['velocity'] = (result['depletion'] / hours.where(hours > 0)).fillna(0)
+    return result.sort_values('velocity', ascending=False)
+
+
+def compute_rank_movement(snapshots: DataFrame) -> DataFrame:
+    """
+    按 `(pnk, source_url)` 计算排名与评论数变化（向量化）
+
+    ---
+
+    返回每个 `(pnk, source_url)` 一行：
+    * `first_rank` / `last_rank`: 首次、最新一次排名
+    * `rank_change`: 排名上升的位数（正数为上升）
+    * `review_growth`: 评论数增加量
+    """
+    df = snapshots.sort_values('ts', kind='stable')
+    result = df.groupby(['pnk', 'source_url'], sort=False).agg(
+        first_rank=('rank', 'first'),
+        last_rank=('rank', 'last'),
+        first_review_count=('review_count', 'first'),
+        last_review_count=('review_count', 'last'),
+    )
+    result['rank_change'] = result['first_rank'] - result['last_rank']
+    result['review_growth'] = result['last_review_count'] - result['first_review_count']
+    return result.sort_values('rank_change', ascending=False)
+
+
+def log_top_velocity(store: HistoryStore, n: int = 20) -> None:
+    """在日志中输出卖得最快的前 `n` 个产品"""
+    df = store.top_velocity(n)
+    logger.info(f'卖得最快的前 {n} 个产品\n{df.to_string(index=False)}')
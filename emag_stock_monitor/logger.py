@@ -1,16 +1,123 @@
 """日志"""
 
+import atexit
+from datetime import datetime
+import json
+import os
 from sys import stderr
+from typing import Optional, TextIO
 
 from loguru import logger
 
+LOG_MODE = os.environ.get('EMAG_LOG_MODE', 'dev')
+"""日志模式，`dev` 为彩色文本（同步输出），`prod` 为 JSON 行（后台线程输出）"""
 
-logger.remove()
-logger.add(
-    stderr,
-    format=(
-        '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
-        '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
-        '<level>{message}</level>'
-    ),
+LOG_LEVEL = os.environ.get('EMAG_LOG_LEVEL', 'DEBUG')
+"""最低输出的日志等级"""
+
+LOG_FILE = os.environ.get('EMAG_LOG_FILE')
+"""`prod` 模式下写入的文件，不指定时写到 stderr"""
+
+_DEV_FORMAT = (
+    '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
+    '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
+    '<level>{message}</level>'
 )
+
+
+_log_file: Optional[TextIO] = None
+"""`prod` 模式下打开的日志文件"""
+
+_shutdown_registered = False
+
+
+class JsonSink:
+    """
+    把日志写成 JSON 行
+
+    ---
+
+    * `stream`: 写入的流（需有 `write` / `flush`）
+
+    ---
+
+    每行包含时间、等级、位置、消息，以及 `run`、`context`、`category`、`page` 等 `extra` 字段；
+    配合 `enqueue=True` 使用时，序列化和写入都在 loguru 的后台线程中完成，不占用事件循环
+    """
+
+    def __init__(self, stream) -> None:
+        self.stream = stream
+
+    def write(self, message) -> None:
+        record = message.record
+        data = {
+            'ts': record['time'].isoformat(),
+            'level': record['level'].name,
+            'logger': record['name'],
+            'function': record['function'],
+            'line': record['line'],
+            'message': record['message'],
+            **record['extra'],
+        }
+        if record['exception'] is not None:
+            data['exception'] = str(message).rstrip('\n')
+        self.stream.write(json.dumps(data, ensure_ascii=False, default=str) + '\n')
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def _shutdown() -> None:
+    """移除所有输出（会等后台线程写完队列中的日志），再关闭打开的日志文件"""
+    global _log_file
+    logger.remove()
+    if _log_file is not None:
+        _log_file.close()
+        _log_file = None
+
+
+def configure_logging(mode: str = LOG_MODE, level: str = LOG_LEVEL, path=LOG_FILE, run_id=None) -> None:
+    """
+    配置日志输出
+
+    ---
+
+    * `mode`: `dev` 为彩色文本，`prod` 为 JSON 行，默认取环境变量 `EMAG_LOG_MODE`
+    * `level`: 最低输出的日志等级，默认取环境变量 `EMAG_LOG_LEVEL`
+    * `path`: `prod` 模式下写入的文件，默认取环境变量 `EMAG_LOG_FILE`，为空时写到 stderr
+    * `run_id`: 本次运行的标识，写入每条日志的 `run` 字段，默认为启动时间加进程号
+
+    ---
+
+    低于 `level` 的日志在 loguru 内部直接跳过；热点路径上的日志用 `{}` 占位参数或 `opt(lazy=True)`，
+    被跳过时不会格式化消息
+    """
+    if mode not in ('dev', 'prod'):
+        raise ValueError(f'未知的日志模式 "{mode}"')
+    if run_id is None:
+        run_id = f'{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}'
+
+    global _log_file, _shutdown_registered
+    # 重复配置时先关掉上一次的输出和文件
+    _shutdown()
+    logger.configure(extra={'run': run_id})
+    if mode == 'dev':
+        logger.add(stderr, level=level, format=_DEV_FORMAT)
+        return
+
+    if path:
+        _log_file = open(path, 'a', encoding='utf-8', buffering=1)
+    logger.add(
+        JsonSink(_log_file if _log_file is not None else stderr),
+        level=level,
+        format='{message}',
+        enqueue=True,
+        catch=True,
+    )
+    # 退出前等后台线程写完队列中的日志，只注册一次
+    if not _shutdown_registered:
+        atexit.register(_shutdown)
+        _shutdown_registered = True
+
+
+configure_logging()
@@ -0,0 +1,292 @@
+"""各阶段耗时与计数"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter, time
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+
+if TYPE_CHECKING:
+    from typing import Any, Iterator, Optional, Union
+
+    _Labels = tuple[tuple[str, str], ...]
+
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""耗时直方图的桶（秒）"""
+
+_current_tags: ContextVar[dict[str, str]] = ContextVar('emag_metrics_tags', default=dict())
+"""当前任务的标签（category、page、context 等），随 `create_task` 传给子任务"""
+
+
+class _Histogram:
+    __slots__ = ('count', 'sum', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        i = bisect_left(BUCKETS, value)
+        if i < len(self.buckets):
+            self.buckets[i] += 1
+
+
+class Metrics:
+    """
+    耗时（span）与计数（counter）
+
+    ---
+
+    * `prefix`: 导出为 Prometheus 格式时指标名的前缀
+    * `max_trace_events`: 最多保留的 trace 事件数，超过后不再记录 trace（统计不受影响）
+
+    ---
+
+    ```python
+    with metrics.tags(category='jocuri-societate', page=2):
+        with metrics.span('page_load'):
+            await page.goto(url)
+        metrics.count('retries', stage='add_to_cart')
+    ```
+
+    标签由 `tags` 设置在当前任务上，之后创建的子任务会继承；`span` / `count` 的关键字参数为额外标签
+    """
+
+    def __init__(self, prefix: str = 'emag', max_trace_events: int = 200_000) -> None:
+        self.prefix = prefix
+        self.max_trace_events = max_trace_events
+        self._counters: dict[tuple[str, _Labels], float] = dict()
+        self._histograms: dict[tuple[str, _Labels], _Histogram] = dict()
+        self._trace: list[dict[str, Any]] = list()
+        self._origin = perf_counter()
+        self._started_at = time()
+        self._lock = Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._trace.clear()
+            self._origin = perf_counter()
+            self._started_at = time()
+
+    @staticmethod
+    def _labels(extra: dict[str, Any]) -> _Labels:
+        merged = {**_current_tags.get(), **{k: str(v) for k, v in extra.items()}}
+        return tuple(sorted(merged.items()))
+
+    @contextmanager
+    def tags(self, **tags: Any) -> Iterator[None]:
+        """在当前任务（及之后创建的子任务）上附加标签，同时作为日志的 `extra` 字段"""
+        str_tags = {k: str(v) for k, v in tags.items()}
+        token = _current_tags.set({**_current_tags.get(), **str_tags})
+        try:
+            with logger.contextualize(**str_tags):
+                yield
+        finally:
+            _current_tags.reset(token)
+
+    def count(self, name: str, value: float = 1, **tags: Any) -> None:
+        """计数"""
+        key = (name, self._labels(tags))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, start: Optional[float] = None, **tags: Any) -> None:
+        """记录一次耗时（`start` 为 `perf_counter()` 的值，用于 trace）"""
+        labels = self._labels(tags)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = _Histogram()
+            histogram.observe(seconds)
+            if len(self._trace) < self.max_trace_events:
+                begin = (start if start is not None else perf_counter() - seconds) - self._origin
+                self._trace.append({'name': name, 'ts': begin, 'dur': seconds, 'tags': dict(labels)})
+
+    @contextmanager
+    def span(self, name: str, **tags: Any) -> Iterator[dict[str, Any]]:
+        """
+        记录代码块的耗时
+
+        ---
+
+        返回的字典可以在代码块内补充标签（如结果），出错时自动加上 `error` 标签
+        """
+        extra: dict[str, Any] = dict(tags)
+        start = perf_counter()
+        try:
+            yield extra
+        except BaseException as e:
+            extra.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            self.observe(name, perf_counter() - start, start=start, **extra)
+
+    def export(self, clear: bool = False) -> dict[str, list]:
+        """
+        导出计数和耗时统计（可 pickle、可 JSON 序列化），用于在进程之间汇总（见 `merge`）
+
+        ---
+
+        * `clear`: 导出后清空计数和耗时统计（trace 保留），下次只导出这之后的增量
+        """
+        with self._lock:
+            data: dict[str, list] = {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, list(labels), h.count, h.sum, list(h.buckets)]
+                    for (name, labels), h in self._histograms.items()
+                ],
+            }
+            if clear:
+                self._counters.clear()
+                self._histograms.clear()
+        return data
+
+    def merge(self, data: dict[str, list], **tags: Any) -> None:
+        """把 `export` 导出的统计加到本进程，`tags` 为附加的标签（如 `worker`）"""
+        extra = tuple((k, str(v)) for k, v in tags.items())
+
+        def key(name: str, labels: list) -> tuple[str, _Labels]:
+            return name, tuple(sorted({**dict(map(tuple, labels)), **dict(extra)}.items()))
+
+        with self._lock:
+            for name, labels, value in data.get('counters', ()):
+                k = key(name, labels)
+                self._counters[k] = self._counters.get(k, 0) + value
+            for name, labels, count, total, buckets in data.get('histograms', ()):
+                k = key(name, labels)
+                histogram = self._histograms.get(k)
+                if histogram is None:
+                    histogram = self._histograms[k] = _Histogram()
+                histogram.count += count
+                histogram.sum += total
+                histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+
+    def to_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+
+        def fmt(labels: _Labels, extra: _Labels = ()) -> str:
+            items = (*labels, *extra)
+            if len(items) == 0:
+                return ''
+            return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in items) + '}'
+
+        lines: list[str] = list()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda kv: kv[0])
+
+        seen: set[str] = set()
+        for (name, labels), value in counters:
+            metric = f'{self.prefix}_{name}_total'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{fmt(labels)} {value:g}')
+
+        for (name, labels), h in histograms:
+            metric = f'{self.prefix}_{name}_seconds'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, n in zip(BUCKETS, h.buckets):
+                cumulative += n
+                lines.append(f'{metric}_bucket{fmt(labels, (("le", f"{bound:g}"),))} {cumulative}')
+            lines.append(f'{metric}_bucket{fmt(labels, (("le", "+Inf"),))} {h.count}')
+            lines.append(f'{metric}_sum{fmt(labels)} {h.sum:.6f}')
+            lines.append(f'{metric}_count{fmt(labels)} {h.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def to_trace(self) -> dict[str, Any]:
+        """
+        导出为 Chrome trace 格式（可用 chrome://tracing 或 Perfetto 打开）
+
+        ---
+
+        每个 context 一行（`tid`），没有 context 标签的在第 0 行
+        """
+        with self._lock:
+            events = list(self._trace)
+
+        def tid(tags: dict[str, str]) -> int:
+            context = tags.get('context', '0')
+            return int(context) if context.isdigit() else 0
+
+        trace_events = [
+            {
+                'name': e['name'],
+                'ph': 'X',
+                'ts': round(e['ts'] * 1_000_000),
+                'dur': round(e['dur'] * 1_000_000),
+                'pid': os.getpid(),
+                'tid': tid(e['tags']),
+                'args': e['tags'],
+            }
+            for e in events
+        ]
+        return {'traceEvents': trace_events, 'otherData': {'started_at': self._started_at}}
+
+    def write_prometheus(self, path: Union[str, Path]) -> None:
+        """写入 Prometheus 文本文件（可交给 node_exporter 的 textfile collector）"""
+        _atomic_write(Path(path), self.to_prometheus())
+
+    def write_trace(self, path: Union[str, Path]) -> None:
+        """写入本次运行的 JSON trace"""
+        _atomic_write(Path(path), json.dumps(self.to_trace(), ensure_ascii=False))
+
+    def serve(self, port: int = 9464, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """在后台线程中提供 `/metrics`，返回服务器（用 `shutdown()` 停止）"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f'指标地址 http://{host}:{server.server_address[1]}/metrics')
+        return server
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+"""全局的指标"""
@@ -2,11 +2,16 @@
 
 from __future__ import annotations
 
+from array import array
 from typing import TYPE_CHECKING, Optional, Self, TypedDict
 
 from scraper_utils.utils.emag_util import build_product_url, validate_pnk
 
 if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Iterable, Iterator, Union
+
+    from pandas import DataFrame
 
     class _ProductTypedDict(TypedDict):
         pnk: str
@@ -37,6 +42,8 @@ class Product:
     pnk 和 source_url 都相同的会被认为是同一个产品
     """
 
+    __slots__ = ('__pnk', 'source_url', '_rank', 'top_favorite', '_review_count', '_qty', '_url')
+
     def __init__(
         self,
         pnk: str,
@@ -54,6 +61,7 @@ class Product:
         self.top_favorite = top_favorite
         self._review_count = review_count
         self.qty = qty
+        self._url: Optional[str] = None
 
     @property
     def pnk(self) -> str:
@@ -91,7 +99,10 @@ class Product:
 
     @property
     def url(self) -> str:
-        return build_product_url(pnk=self.__pnk)
+        # pnk 不可变，链接只需构建一次
+        if self._url is None:
+            self._url = build_product_url(pnk=self.__pnk)
+        return self._url
 
     def __eq__(self, other) -> bool:
         return (
@@ -118,11 +129,288 @@ class Product:
         }
 
     def __copy__(self) -> Self:
-        return self.__class__(
-            pnk=self.pnk,
-            source_url=self.source_url,
-            rank=self.rank,
-            top_favorite=self.top_favorite,
-            review_count=self.review_count,
-            qty=self.qty,
+        # 各字段已校验过，直接复制，不再重新校验
+        p = self.__class__.__new__(self.__class__)
+        p.__pnk = self.__pnk
+        p.source_url = self.source_url
+        p._rank = self._rank
+        p.top_favorite = self.top_favorite
+        p._review_count = self._review_count
+        p._qty = self._qty
+        p._url = self._url
+        return p
+
+    @classmethod
+    def _trusted(
+        cls,
+        pnk: str,
+        source_url: str,
+        rank: int,
+        top_favorite: bool,
+        review_count: Optional[int],
+        qty: Optional[int],
+    ) -> Self:
+        """用已校验过的数据创建产品，跳过校验（供 `ProductBatch` 使用）"""
+        p = cls.__new__(cls)
+        p.__pnk = pnk
+        p.source_url = source_url
+        p._rank = rank
+        p.top_favorite = top_favorite
+        p._review_count = review_count
+        p._qty = qty
+        p._url = None
+        return p
+
+
+_NA = -(2**31)
+"""整数列中表示 `None` 的值"""
+
+
+class ProductBatch:
+    """
+    按列存储的一批产品
+
+    ---
+
+    * `products`: 初始的产品
+
+    ---
+
+    `pnk` 为字符串列表，`source_url` 存为类别编码（同一个产品列表页的链接只存一份），
+    其余字段存在 `array` 中，`None` 用 `_NA` 表示；产品详情页链接只在需要时生成。
+
+    `append_raw` / `from_frame` 不做校验，写入完再用 `validate` 批量校验；
+    取出的 `Product` 与 `Product` 的比较规则一致（pnk 和 source_url 都相同即为同一个产品）
+    """
+
+    __slots__ = (
+        '_pnk',
+        '_source_url_codes',
+        '_source_urls',
+        '_source_url_index',
+        '_rank',
+        '_top_favorite',
+        '_review_count',
+        '_qty',
+    )
+
+    def __init__(self, products: Iterable[Product] = ()) -> None:
+        self._pnk: list[str] = list()
+        self._source_url_codes = array('i')
+        self._source_urls: list[str] = list()
+        self._source_url_index: dict[str, int] = dict()
+        self._rank = array('i')
+        self._top_favorite = array('b')
+        self._review_count = array('i')
+        self._qty = array('i')
+        self.extend(products)
+
+    def __len__(self) -> int:
+        return len(self._pnk)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(products={len(self)}, source_urls={len(self._source_urls)})'
+
+    def _source_url_code(self, source_url: str) -> int:
+        code = self._source_url_index.get(source_url)
+        if code is None:
+            code = self._source_url_index[source_url] = len(self._source_urls)
+            self._source_urls.append(source_url)
+        return code
+
+    def append_raw(
+        self,
+        pnk: str,
+        source_url: str,
+        rank: int,
+        top_favorite: bool = False,
+        review_count: Optional[int] = None,
+        qty: Optional[int] = None,
+    ) -> None:
+        """
+        追加一个产品（不校验）
+
+        ---
+
+        `to_frame` 返回的 `DataFrame` 还在引用 `array` 时抛出 `BufferError`，数值超出范围时抛出 `OverflowError`；
+        出错时已追加的列会撤回，各列长度保持一致
+        """
+        values = (
+            (self._source_url_codes, self._source_url_code(source_url)),
+            (self._rank, rank),
+            (self._top_favorite, top_favorite),
+            (self._review_count, _NA if review_count is None else review_count),
+            (self._qty, _NA if qty is None else qty),
+        )
+        appended: list[array] = list()
+        try:
+            for column, value in values:
+                column.append(value)
+                appended.append(column)
+        except BaseException:
+            for column in appended:
+                column.pop()
+            raise
+        self._pnk.append(pnk)
+
+    def append(self, product: Product) -> None:
+        self.append_raw(
+            product.pnk,
+            product.source_url,
+            product.rank,
+            product.top_favorite,
+            product.review_count,
+            product.qty,
+        )
+
+    def extend(self, products: Iterable[Product]) -> None:
+        for p in products:
+            self.append(p)
+
+    def __getitem__(self, index: int) -> Product:
+        review_count = self._review_count[index]
+        qty = self._qty[index]
+        return Product._trusted(
+            pnk=self._pnk[index],
+            source_url=self._source_urls[self._source_url_codes[index]],
+            rank=self._rank[index],
+            top_favorite=bool(self._top_favorite[index]),
+            review_count=None if review_count == _NA else review_count,
+            qty=None if qty == _NA else qty,
+        )
+
+    def __iter__(self) -> Iterator[Product]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __contains__(self, product: object) -> bool:
+        if not isinstance(product, Product):
+            return False
+        code = self._source_url_index.get(product.source_url)
+        if code is None:
+            return False
+        return any(pnk == product.pnk and c == code for pnk, c in zip(self._pnk, self._source_url_codes))
+
+    def keys(self) -> Iterator[tuple[str, str]]:
+        """依次返回每个产品的 `(pnk, source_url)`"""
+        for pnk, code in zip(self._pnk, self._source_url_codes):
+            yield pnk, self._source_urls[code]
+
+    def urls(self) -> Iterator[str]:
+        """依次生成每个产品的详情页链接（同一个 pnk 只构建一次）"""
+        cache: dict[str, str] = dict()
+        for pnk in self._pnk:
+            url = cache.get(pnk)
+            if url is None:
+                url = cache[pnk] = build_product_url(pnk=pnk)
+            yield url
+
+    def validate(self) -> None:
+        """批量校验所有产品，有不合规的产品时抛出 `ValueError`（列出前几个）"""
+        import numpy as np
+
+        errors: list[str] = list()
+
+        # 同一个 pnk 只校验一次
+        invalid_pnks = {pnk for pnk in set(self._pnk) if not validate_pnk(pnk=pnk)}
+        if len(invalid_pnks) > 0:
+            errors.append(f'{len(invalid_pnks)} 个 pnk 不符合 pnk 规则，如 "{next(iter(invalid_pnks))}"')
+
+        rank = np.frombuffer(self._rank, dtype=np.int32)
+        review_count = np.frombuffer(self._review_count, dtype=np.int32)
+        qty = np.frombuffer(self._qty, dtype=np.int32)
+        checks = (
+            ('rank 需为正整数', rank < 1),
+            ('review 不能为负数', (review_count < 0) & (review_count != _NA)),
+            ('qty 如不为空，则必须为正整数', (qty < 1) & (qty != _NA)),
         )
+        for message, invalid in checks:
+            indexes = np.flatnonzero(invalid)
+            if len(indexes) > 0:
+                errors.append(f'{message}，共 {len(indexes)} 个，如第 {indexes[:5].tolist()} 个')
+
+        if len(errors) > 0:
+            raise ValueError('\n'.join(errors))
+
+    def drop_duplicates(self) -> ProductBatch:
+        """按 `(pnk, source_url)` 去重（保留最后一个），返回新的一批"""
+        last: dict[tuple[str, int], int] = dict()
+        for i, key in enumerate(zip(self._pnk, self._source_url_codes)):
+            last[key] = i
+        result = self.__class__()
+        for i in sorted(last.values()):
+            p = self[i]
+            result.append_raw(p.pnk, p.source_url, p.rank, p.top_favorite, p.review_count, p.qty)
+        return result
+
+    def to_frame(self, with_url: bool = False, copy: bool = False) -> DataFrame:
+        """
+        转换成 `DataFrame`
+
+        ---
+
+        * `with_url`: 是否生成 `url` 列
+        * `copy`: 是否复制数据
+
+        ---
+
+        不复制时整数列直接引用 `array` 的内存，在返回的 `DataFrame` 被释放之前不能再往这一批追加产品
+        （会抛出 `BufferError`）；`None` 对应 pandas 的缺失值，`source_url` 为 `category` 类型
+        """
+        import numpy as np
+        from pandas import Categorical, DataFrame
+        from pandas.arrays import BooleanArray, IntegerArray
+
+        def view(values: array, dtype: type) -> np.ndarray:
+            data = np.frombuffer(values, dtype=dtype)
+            return data.copy() if copy else data
+
+        def nullable(values: array) -> IntegerArray:
+            data = view(values, np.int32)
+            return IntegerArray(data, data == _NA)
+
+        columns = {
+            'pnk': list(self._pnk) if copy else self._pnk,
+            'source_url': Categorical.from_codes(
+                view(self._source_url_codes, np.int32), categories=self._source_urls
+            ),
+            'rank': view(self._rank, np.int32),
+            'top_favorite': BooleanArray(
+                view(self._top_favorite, np.bool_), np.zeros(len(self), dtype=np.bool_)
+            ),
+            'review_count': nullable(self._review_count),
+            'qty': nullable(self._qty),
+        }
+        df = DataFrame(columns, copy=False)
+        if with_url:
+            df['url'] = list(self.urls())
+        return df
+
+    def to_parquet(self, path: Union[str, Path]) -> None:
+        """写入 Parquet 文件（需要安装 `pyarrow`（`parquet` 可选依赖）或 `fastparquet`）"""
+        self.to_frame().to_parquet(path, index=False)
+
+    @classmethod
+    def from_frame(cls, df: DataFrame) -> ProductBatch:
+        """从至少包含 `pnk`、`source_url`、`rank` 列的 `DataFrame` 创建（不校验）"""
+        n = len(df)
+
+        def column(name: str, fill: int) -> list[int]:
+            if name not in df.columns:
+                return [fill] * n
+            return df[name].astype('Int32').fillna(fill).astype('int32').tolist()
+
+        # 所有列都转换完再一起写入，转换出错时不会留下长度不一致的一批
+        batch = cls()
+        source_url_codes = array('i', (batch._source_url_code(u) for u in df['source_url'].astype(str)))
+        rank = array('i', df['rank'].astype('int32').tolist())
+        top_favorite = array('b', column('top_favorite', 0))
+        review_count = array('i', column('review_count', _NA))
+        qty = array('i', column('qty', _NA))
+        batch._pnk = df['pnk'].astype(str).tolist()
+        batch._source_url_codes = source_url_codes
+        batch._rank = rank
+        batch._top_favorite = top_favorite
+        batch._review_count = review_count
+        batch._qty = qty
+        return batch
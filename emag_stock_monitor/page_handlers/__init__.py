@@ -1 +1 @@
-"""处理页面"""
\ No newline at end of file
+"""处理页面"""
@@ -0,0 +1,237 @@
+"""通过接口加购"""
+
+from __future__ import annotations
+
+from asyncio import Semaphore, gather
+from typing import TYPE_CHECKING, TypedDict
+from urllib.parse import urlencode, urljoin
+
+from parsel import Selector
+from scraper_utils.constants.time_constant import MS1000
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.xpaths import ADD_CART_BUTTON, PRODUCT_PAGE_ADD_CART_BUTTON
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+    from playwright.async_api import APIRequestContext, Page
+
+    from emag_stock_monitor.models import Product
+    from emag_stock_monitor.retry import HostRateLimiter
+
+    class _AddCartFormTypedDict(TypedDict):
+        pnk: str
+        action: str
+        method: str
+        fields: list[tuple[str, str]]
+
+
+_EXTRACT_ADD_CART_FORMS_JS = '''
+(buttonXPath) => {
+    const buttons = document.evaluate(
+        buttonXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const forms = [];
+    for (let i = 0; i < buttons.snapshotLength; i++) {
+        const button = buttons.snapshotItem(i);
+        const form = button.form;
+        if (form === null) {
+            continue;
+        }
+        const fields = Array.from(new FormData(form), ([name, value]) => [name, String(value)]);
+        if (button.name) {
+            fields.push([button.name, button.value]);
+        }
+        forms.push({
+            pnk: button.getAttribute('data-pnk'),
+            action: form.action,
+            method: form.method,
+            fields: fields,
+        });
+    }
+    return forms;
+}
+'''
+"""在页面内一次性读取所有加购按钮所在表单的提交地址和字段"""
+
+
+class AddCartForm:
+    """
+    加购按钮所在的表单
+
+    ---
+
+    * `pnk`
+    * `action`: 提交地址（绝对链接）
+    * `method`: 提交方法
+    * `fields`: 表单字段（允许重名）
+    """
+
+    def __init__(
+        self, pnk: str, action: str, method: str = 'post', fields: Optional[list[tuple[str, str]]] = None
+    ) -> None:
+        self.pnk = pnk
+        self.action = action
+        self.method = method.upper()
+        self.fields = fields if fields is not None else list()
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(pnk="{self.pnk}", action="{self.action}", method="{self.method}")'
+
+
+async def extract_add_cart_forms(page: Page) -> dict[str, AddCartForm]:
+    """一次性提取页面上所有非 Promovat 加购按钮的表单，返回 pnk -> 表单"""
+    forms: list[_AddCartFormTypedDict] = await page.evaluate(_EXTRACT_ADD_CART_FORMS_JS, ADD_CART_BUTTON)
+    return {
+        f['pnk']: AddCartForm(
+            pnk=f['pnk'], action=f['action'], method=f['method'], fields=[(n, v) for n, v in f['fields']]
+        )
+        for f in forms
+    }
+
+
+async def extract_product_page_add_cart_form(page: Page, pnk: str) -> Optional[AddCartForm]:
+    """提取产品详情页上加购按钮的表单，找不到时返回 `None`"""
+    forms: list[_AddCartFormTypedDict] = await page.evaluate(
+        _EXTRACT_ADD_CART_FORMS_JS, PRODUCT_PAGE_ADD_CART_BUTTON
+    )
+    if len(forms) == 0:
+        return None
+    # 详情页的加购按钮不一定带 data-pnk，pnk 以调用方为准
+    f = forms[0]
+    return AddCartForm(
+        pnk=pnk, action=f['action'], method=f['method'], fields=[(n, v) for n, v in f['fields']]
+    )
+
+
+def parse_add_cart_forms(html: str, page_url: str) -> dict[str, AddCartForm]:
+    """从产品列表页 HTML 中解析所有非 Promovat 加购按钮的表单，返回 pnk -> 表单"""
+    result: dict[str, AddCartForm] = dict()
+    for button in Selector(text=html).xpath(ADD_CART_BUTTON):
+        form = button.xpath('ancestor::form[1]')
+        fields: list[tuple[str, str]] = [
+            (i.attrib['name'], i.attrib.get('value', ''))
+            for i in form.xpath('.//input[@name and not(@disabled)]')
+            if i.attrib.get('type', 'text').lower() not in ('checkbox', 'radio', 'file', 'submit')
+            or 'checked' in i.attrib
+        ]
+        if 'name' in button.attrib:
+            fields.append((button.attrib['name'], button.attrib.get('value', '')))
+        pnk = button.attrib['data-pnk']
+        result[pnk] = AddCartForm(
+            pnk=pnk,
+            action=urljoin(page_url, form.attrib.get('action', '')),
+            method=form.attrib.get('method', 'post'),
+            fields=fields,
+        )
+    return result
+
+
+_FAILED_STATUSES = ('error', 'fail', 'failed', 'failure')
+"""加购接口响应中表示失败的 `status`"""
+
+
+def _contains_value(node: Any, value: str) -> bool:
+    if isinstance(node, dict):
+        return any(_contains_value(v, value) for v in node.values())
+    if isinstance(node, list):
+        return any(_contains_value(v, value) for v in node)
+    return isinstance(node, str) and value in node
+
+
+def is_add_cart_confirmed(payload: Any, pnk: str) -> bool:
+    """
+    根据加购接口的响应判断是否加购成功
+
+    ---
+
+    1. 先检查明确的失败标志：`status` 为失败、带有非空的 `error` / `errors`、`success` 为 `false`
+    2. 再检查明确的成功标志：`status` 为 `success` / `ok`、`success` 为 `true`
+    3. 都没有时，响应中的某个值带有该 pnk 才算成功
+    """
+    if not isinstance(payload, dict):
+        return False
+    status = str(payload.get('status', '')).lower()
+    if (
+        status in _FAILED_STATUSES
+        or payload.get('error')
+        or payload.get('errors')
+        or payload.get('success') is False
+    ):
+        return False
+    if status in ('success', 'ok') or payload.get('success') is True:
+        return True
+    return _contains_value(payload, pnk)
+
+
+async def add_to_cart_by_api(
+    request: APIRequestContext,
+    products: list[Product],
+    forms: dict[str, AddCartForm],
+    concurrency: int = 8,
+    timeout: float = 10 * MS1000,
+    limiter: Optional[HostRateLimiter] = None,
+) -> list[Product]:
+    """
+    直接提交加购表单来加购产品，返回加购成功的产品
+
+    ---
+
+    * `request`: 一般为 `BrowserContext.request`，与该 context 共享 cookie，即加到该 context 的购物车里
+    * `forms`: pnk -> 加购表单
+    * `concurrency`: 同时提交的加购请求数
+    * `limiter`: 每个加购请求发出前按域名取令牌的限速器
+
+    ---
+
+    同一个 pnk 只会提交一次
+    """
+    semaphore = Semaphore(concurrency)
+
+    async def add(product: Product) -> Optional[Product]:
+        form = forms.get(product.pnk)
+        if form is None:
+            logger.error(f'找不到 "{product.pnk}" rank={product.rank} 的加购表单')
+            return None
+        async with semaphore:
+            if limiter is not None:
+                await limiter.acquire(form.action)
+            try:
+                with metrics.span('add_to_cart', mode='api'):
+                    response = await request.fetch(
+                        form.action,
+                        method=form.method,
+                        headers={
+                            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+                            'X-Requested-With': 'XMLHttpRequest',
+                        },
+                        data=urlencode(form.fields),
+                        timeout=timeout,
+                    )
+                payload = await response.json() if response.ok else None
+            except (PlaywrightError, ValueError) as e:
+                logger.error(f'通过接口加购 "{product.pnk}" rank={product.rank} 时出错\n{e}')
+                metrics.count('add_to_cart_failures', mode='api')
+                return None
+        if not is_add_cart_confirmed(payload, product.pnk):
+            metrics.count('add_to_cart_failures', mode='api')
+            logger.error(
+                f'通过接口加购 "{product.pnk}" rank={product.rank} 未确认成功 status={response.status}'
+            )
+            return None
+        logger.debug('通过接口加购 "{}" rank={} 成功', product.pnk, product.rank)
+        return product
+
+    unique_products: list[Product] = list()
+    seen_pnks: set[str] = set()
+    for p in products:
+        if p.pnk not in seen_pnks:
+            seen_pnks.add(p.pnk)
+            unique_products.append(p)
+
+    added = [p for p in await gather(*(add(p) for p in unique_products)) if p is not None]
+    logger.info(f'通过接口加购成功 {len(added)}/{len(unique_products)} 个产品')
+    return added
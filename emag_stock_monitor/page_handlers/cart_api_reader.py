@@ -0,0 +1,182 @@
+"""从购物车页的接口响应中读取最大可加购数"""
+
+from __future__ import annotations
+
+from asyncio import Event, Task, create_task, get_running_loop, wait_for
+from typing import TYPE_CHECKING
+
+from parsel import Selector
+from scraper_utils.constants.time_constant import MS1000
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.regexps import cart_page_api_routes
+
+if TYPE_CHECKING:
+    from re import Pattern
+    from typing import Any, Callable, Mapping, Optional
+
+    from playwright.async_api import Page, Response
+
+    _CartLine = tuple[list[str], Optional[str]]
+
+
+CART_QTY_ROUTES = ('cart/get-totals', 'cart/render-vendors', 'shopping/header-cart')
+"""带有购物车产品行的接口（`regexps.cart_page_api_routes` 的键）"""
+
+
+def parse_cart_lines_html(html: str) -> list[_CartLine]:
+    """从购物车产品行的 HTML 片段中解析 `(产品行内的链接, 最大可加购数)`"""
+    lines: list[_CartLine] = list()
+    for line in Selector(text=html).xpath('//div[starts-with(@class,"cart-widget cart-line")]'):
+        lines.append(
+            (
+                line.xpath('.//a/@href').getall(),
+                line.xpath('.//div[@data-phino="Qty"]/input/@max').get(),
+            )
+        )
+    return lines
+
+
+def parse_max_qty(value: Any) -> Optional[str]:
+    """校验接口中的最大可加购数，是正整数（或正整数字符串）时返回字符串，否则返回 `None`"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return str(value) if value > 0 else None
+    if isinstance(value, str) and value.isdigit() and int(value) > 0:
+        return value
+    return None
+
+
+def _parse_render_vendors(payload: Any) -> list[_CartLine]:
+    # {"status": ..., "html": "<div class=\"cart-widget cart-line\">...</div>..."}
+    html = payload.get('html') if isinstance(payload, dict) else None
+    if not isinstance(html, str):
+        return list()
+    return [(hrefs, parse_max_qty(max_qty)) for hrefs, max_qty in parse_cart_lines_html(html)]
+
+
+def _parse_header_cart(payload: Any) -> list[_CartLine]:
+    # {"status": ..., "data": {"products": [{"url": "/.../pd/{pnk}/", "quantity": ..., "max_quantity": ...}]}}
+    data = payload.get('data') if isinstance(payload, dict) else None
+    products = data.get('products') if isinstance(data, dict) else None
+    if not isinstance(products, list):
+        return list()
+    lines: list[_CartLine] = list()
+    for product in products:
+        if not isinstance(product, dict) or not isinstance(product.get('url'), str):
+            continue
+        lines.append(([product['url']], parse_max_qty(product.get('max_quantity'))))
+    return lines
+
+
+def _parse_get_totals(_: Any) -> list[_CartLine]:
+    # {"status": ..., "data": {"count": ...}}，只有总数，没有产品行
+    return list()
+
+
+CART_PAYLOAD_PARSERS: dict[str, Callable[[Any], list[_CartLine]]] = {
+    'cart/render-vendors': _parse_render_vendors,
+    'shopping/header-cart': _parse_header_cart,
+    'cart/get-totals': _parse_get_totals,
+}
+"""各购物车接口的解析函数，只读取固定路径上的字段（样例见 `tests/fixtures/recorded`）"""
+
+
+def parse_cart_payload(name: str, payload: Any) -> list[_CartLine]:
+    """
+    从购物车接口 `name` 的 JSON 中解析 `(产品行内的链接, 最大可加购数)`
+
+    ---
+
+    * `cart/render-vendors`: `html` 中的购物车产品行，按 DOM 的规则解析
+    * `shopping/header-cart`: `data.products[]` 的 `url` 和 `max_quantity`
+    * `cart/get-totals`: 没有产品行
+
+    最大可加购数不是正整数的记为 `None`；结构对不上或未知的接口返回空列表，由调用方回退到解析 DOM。
+    得到的结果与 `read_cart_qty` 的格式一致，可以直接交给 `build_pnk_qty_map`
+    """
+    parser = CART_PAYLOAD_PARSERS.get(name)
+    if parser is None:
+        return list()
+    return parser(payload)
+
+
+class CartResponseReader:
+    """
+    监听页面上购物车接口的响应，收集其中的产品行
+
+    ---
+
+    * `page`: 购物车页，需在打开或刷新之前开始监听
+    * `routes`: 要监听的接口，默认为 `CART_QTY_ROUTES`；用本地替身服务器时可传入不限域名的正则
+
+    ---
+
+    ```python
+    async with CartResponseReader(page) as reader:
+        await page.reload(wait_until='commit')
+        complete = await reader.wait(lambda lines: ...)
+    ```
+    """
+
+    def __init__(self, page: Page, routes: Optional[Mapping[str, Pattern[str]]] = None) -> None:
+        self.page = page
+        self.routes = (
+            dict(routes) if routes is not None else {k: cart_page_api_routes[k] for k in CART_QTY_ROUTES}
+        )
+        self.lines: list[_CartLine] = list()
+        self.payloads: dict[str, list[Any]] = dict()
+        self._changed = Event()
+        self._tasks: set[Task[None]] = set()
+
+    def start(self) -> None:
+        self.page.on('response', self._on_response)
+
+    def stop(self) -> None:
+        self.page.remove_listener('response', self._on_response)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def __aenter__(self) -> CartResponseReader:
+        self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.stop()
+
+    def _on_response(self, response: Response) -> None:
+        name = next((k for k, pattern in self.routes.items() if pattern.match(response.url)), None)
+        if name is None:
+            return
+        task = create_task(self._read(name, response))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read(self, name: str, response: Response) -> None:
+        try:
+            payload = await response.json()
+        except (PlaywrightError, ValueError) as e:
+            logger.debug('读取购物车接口 "{}" 的响应时出错\n{}', name, e)
+            return
+        lines = parse_cart_payload(name, payload)
+        self.payloads.setdefault(name, list()).append(payload)
+        self.lines.extend(lines)
+        logger.debug('购物车接口 "{}" 返回 {} 个产品行', name, len(lines))
+        self._changed.set()
+
+    async def wait(self, is_complete: Callable[[list[_CartLine]], bool], timeout: int = 5 * MS1000) -> bool:
+        """等待收集到的产品行满足 `is_complete`，超时返回 `False`"""
+        deadline = get_running_loop().time() + timeout / MS1000
+        while not is_complete(self.lines):
+            remaining = deadline - get_running_loop().time()
+            if remaining <= 0:
+                return False
+            self._changed.clear()
+            try:
+                await wait_for(self._changed.wait(), timeout=remaining)
+            except TimeoutError:
+                return is_complete(self.lines)
+        return True
@@ -2,50 +2,99 @@
 
 from __future__ import annotations
 
+from asyncio import Lock
 from copy import copy
-from typing import TYPE_CHECKING, Literal, Optional
+from typing import TYPE_CHECKING, Literal, Optional, TypedDict
+from weakref import WeakKeyDictionary
 
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 from scraper_utils.utils.browser_util import wait_for_selector
 from scraper_utils.constants.time_constant import MS1000
 
-from emag_stock_monitor.exceptions import GotoCartPageError
+from emag_stock_monitor.exceptions import ClearCartError, GotoCartPageError
 from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.page_handlers.cart_api_reader import CartResponseReader
+from emag_stock_monitor.retry import cart_policy, get_rate_limiter, navigation_policy
 from emag_stock_monitor.urls import CART_PAGE_URL
 
 if TYPE_CHECKING:
+    from re import Pattern
+    from typing import Any, Mapping
+
     from playwright.async_api import BrowserContext, Page
 
     from emag_stock_monitor.models import Product
+    from emag_stock_monitor.retry import RetryPolicy
+
+    class _CartLineTypedDict(TypedDict):
+        hrefs: list[str]
+        max: Optional[str]
 
 
-# TODO 需要检测验证码
-# /html/body[contains(@class,"captcha")]
-# CF 验证会有很多形式，是搞模拟点击？还是当出现验证码时暂停程序并发出提醒？
+_READ_CART_LINES_JS = '''
+() => {
+    const lines = document.evaluate(
+        '//div[starts-with(@class,"cart-widget cart-line")]',
+        document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const result = [];
+    for (let i = 0; i < lines.snapshotLength; i++) {
+        const line = lines.snapshotItem(i);
+        const qtyInput = document.evaluate(
+            './/div[@data-phino="Qty"]/input[@max]',
+            line, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue;
+        result.push({
+            hrefs: Array.from(line.querySelectorAll('a[href]'), a => a.getAttribute('href')),
+            max: qtyInput === null ? null : qtyInput.getAttribute('max'),
+        });
+    }
+    return result;
+}
+'''
+"""在页面内一次性读取购物车所有产品行的链接和最大可加购数"""
+
+_REMOVE_ALL_JS = '''
+() => {
+    const buttons = document.evaluate(
+        '//button[contains(@class,"remove-product")]',
+        document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    let clicked = 0;
+    for (let i = buttons.snapshotLength - 1; i >= 0; i--) {
+        const button = buttons.snapshotItem(i);
+        if (button.offsetParent !== null) {
+            button.click();
+            clicked++;
+        }
+    }
+    return clicked;
+}
+'''
+"""在页面内一次性点击所有可见的 Sterge 按钮，返回点击数量"""
 
 
 async def goto_cart_page(
     context: BrowserContext,
     wait_until: Literal['commit', 'domcontentloaded', 'load', 'networkidle'] = 'load',
-    retry_count: int = 3,
     timeout: Optional[int] = None,
+    policy: Optional[RetryPolicy] = None,
 ) -> Page:
-    """打开购物车页面"""
+    """打开购物车页面（`policy` 默认为 `navigation_policy`，使用 `context` 上的限速器）"""
     logger.info(f'打开购物车页...')
 
     page = await context.new_page()
-    for i in range(retry_count):
-        logger.debug(f'尝试打开购物车页 {i+1}/{retry_count}')
-        try:
-            await page.goto(CART_PAGE_URL, wait_until=wait_until, timeout=timeout)
-        except PlaywrightError as pe:
-            logger.error(f'尝试打开购物车页时出错\n{pe}')
-            continue
-        else:
-            break
-    else:
-        logger.error(f'尝试 {retry_count} 次后仍无法打开购物车页')
-        raise GotoCartPageError
+    policy = policy if policy is not None else navigation_policy
+    try:
+        await policy.call(
+            'cart_open',
+            lambda: page.goto(CART_PAGE_URL, wait_until=wait_until, timeout=timeout),
+            url=CART_PAGE_URL,
+            limiter=get_rate_limiter(context),
+        )
+    except PlaywrightError as pe:
+        raise GotoCartPageError from pe
 
     if await check_have_product(page):
         logger.debug('购物车页检测到产品')
@@ -64,13 +113,75 @@ async def check_have_product(
     return await wait_for_selector(page=page, selector='xpath=//input[@max]', timeout=timeout)
 
 
-async def clear_cart(page: Page, retry_count: int = 3) -> None:
-    """清空购物车"""
+async def check_cart_empty(page: Page, timeout: int = 10 * MS1000) -> bool:
+    """等待购物车内的产品全部消失"""
+    try:
+        await page.locator('xpath=//input[@max]').first.wait_for(state='detached', timeout=timeout)
+    except PlaywrightError:
+        return False
+    return True
+
+
+async def clear_cart(
+    page: Page, bulk: bool = True, timeout: int = 10 * MS1000, policy: Optional[RetryPolicy] = None
+) -> bool:
+    """
+    清空购物车，返回是否已清空
+
+    ---
+
+    * `bulk`: 是否在页面内一次性点击所有 Sterge 按钮，再只检查一次购物车是否为空；没清空时回退到逐个删除
+    * `timeout`: 一次性删除后等待购物车变空的时间
+    * `policy`: 没清空时的重试策略，默认为 `cart_policy`；重试前刷新购物车页（刷新前按限速器取令牌）
+    """
+    policy = policy if policy is not None else cart_policy
+    limiter = get_rate_limiter(page.context)
+    attempt = 0
+
+    async def clear_once() -> None:
+        nonlocal attempt
+        attempt += 1
+        if attempt > 1:
+            if limiter is not None:
+                await limiter.acquire(page.url)
+            await page.reload(wait_until='domcontentloaded')
+            if await check_have_product(page, timeout=timeout) is False:
+                return
+        if not await _clear_cart_once(page, bulk, timeout):
+            raise ClearCartError('购物车仍有产品')
+
+    try:
+        await policy.call('cart_clear', clear_once)
+    except (PlaywrightError, ClearCartError):
+        metrics.count('cart_clear_failures')
+        return False
+    return True
+
+
+async def _clear_cart_once(page: Page, bulk: bool, timeout: int) -> bool:
     logger.info('清空购物车...')
 
+    if bulk:
+        try:
+            clicked: int = await page.evaluate(_REMOVE_ALL_JS)
+        except PlaywrightError as pe:
+            logger.warning(f'一次性删除购物车产品时出错，改为逐个删除\n{pe}')
+        else:
+            logger.debug('一次性点击了 {} 个 Sterge 按钮', clicked)
+            if await check_cart_empty(page, timeout=timeout):
+                logger.info('购物车已清空')
+                return True
+            logger.warning('一次性删除后购物车仍有产品，改为逐个删除')
+        metrics.count('cart_clear_fallbacks')
+
+    return await clear_cart_one_by_one(page)
+
+
+async def clear_cart_one_by_one(page: Page) -> bool:
+    """逐个点击 Sterge 按钮清空购物车"""
     # 倒序遍历所有 sterge 按钮，如果是 visible 的就点击它
     sterge_button = page.locator('xpath=//button[contains(@class,"remove-product")]')
-    for i in range(await sterge_button.count(), 0, -1):
+    for i in range(await sterge_button.count() - 1, -1, -1):
         """
         1. 遍历所有的 //button[contains(@class,"remove-product")]
         2. 如果它可见就点击它
@@ -85,15 +196,127 @@ async def clear_cart(page: Page, retry_count: int = 3) -> None:
                 logger.warning(f'尝试 Sterge #{i} 时出错\n{pe}')
                 pass
             else:
-                logger.debug(f'Sterge #{i} 成功')
+                logger.debug('Sterge #{} 成功', i)
+
+    if await check_cart_empty(page, timeout=MS1000):
+        logger.info('购物车已清空')
+        return True
+    logger.error('逐个删除后购物车仍有产品')
+    return False
+
+
+async def read_cart_qty(page: Page) -> list[tuple[list[str], Optional[str]]]:
+    """一次性读取购物车所有产品行，返回 `(产品行内的链接, 最大可加购数)`"""
+    lines: list[_CartLineTypedDict] = await page.evaluate(_READ_CART_LINES_JS)
+    return [(line['hrefs'], line['max']) for line in lines]
+
+
+def build_pnk_qty_map(
+    lines: list[tuple[list[str], Optional[str]]], pnks: list[str]
+) -> dict[str, Optional[str]]:
+    """
+    将购物车产品行与 pnk 对应起来，得到 pnk -> 最大可加购数
+
+    ---
+
+    与逐个查询时的 `//a[contains(@href,"{pnk}")]` 一致：取第一个链接中包含该 pnk 的产品行，
+    该行没有最大可加购数时再看后面的产品行
+    """
+    # 先按链接的路径片段建索引，产品链接形如 /xxx/pd/{pnk}/
+    segment_index: dict[str, Optional[str]] = dict()
+    for hrefs, max_qty in lines:
+        for href in hrefs:
+            for segment in href.split('/'):
+                # 同一个 pnk 出现在多行时（如接口的多次响应）取第一个有最大可加购数的
+                if segment_index.get(segment) is None:
+                    segment_index[segment] = max_qty
+
+    result: dict[str, Optional[str]] = dict()
+    for pnk in pnks:
+        if pnk in segment_index:
+            result[pnk] = segment_index[pnk]
+            continue
+        # 索引命中不了的再按子串查找
+        for hrefs, max_qty in lines:
+            if any(pnk in href for href in hrefs):
+                result[pnk] = max_qty
+                if max_qty is not None:
+                    break
+    return result
+
 
-    logger.info('购物车已清空')
+async def parse_qty(page: Page, products: list[Product], bulk: bool = True) -> list[Product]:
+    """
+    解析购物车页的产品数据
 
+    ---
 
-async def parse_qty(page: Page, products: list[Product]) -> list[Product]:
-    """解析购物车页的产品数据"""
+    * `bulk`: 是否一次性读取整个购物车后再与 `products` 对应，出错时回退到逐个产品查询
+    """
     logger.info('解析购物车的产品数据...')
 
+    if not bulk:
+        return await parse_qty_one_by_one(page, products)
+
+    try:
+        lines = await read_cart_qty(page)
+    except PlaywrightError as pe:
+        logger.warning(f'一次性读取购物车失败，回退到逐个产品查询\n{pe}')
+        return await parse_qty_one_by_one(page, products)
+    logger.debug('一次性读取到购物车内 {} 个产品行', len(lines))
+
+    return apply_pnk_qty_map(products, build_pnk_qty_map(lines, [p.pnk for p in products]))
+
+
+def reconcile_pnk_qty(
+    api_qty: Mapping[str, Optional[str]], dom_qty: Mapping[str, Optional[str]]
+) -> dict[str, Optional[str]]:
+    """
+    核对接口与 DOM 读到的 pnk -> 最大可加购数
+
+    ---
+
+    DOM 有值时以 DOM 为准，与接口不一致时记录下来；DOM 没有值时才使用接口的值（已在解析时校验为正整数）
+    """
+    result: dict[str, Optional[str]] = dict(api_qty)
+    for pnk, qty in dom_qty.items():
+        if qty is None:
+            continue
+        if pnk in api_qty and api_qty[pnk] != qty:
+            metrics.count('cart_api_mismatches')
+            logger.warning(f'"{pnk}" 的最大可加购数接口为 {api_qty[pnk]}，购物车页为 {qty}，以购物车页为准')
+        result[pnk] = qty
+    return result
+
+
+def apply_pnk_qty_map(products: list[Product], pnk_qty: dict[str, Optional[str]]) -> list[Product]:
+    """按 pnk -> 最大可加购数设置产品的 `qty`，返回取到最大可加购数的产品（副本）"""
+    result: list[Product] = list()
+    missing: list[Product] = list()
+    for i in products:
+        p = copy(i)
+        if p.pnk not in pnk_qty or pnk_qty[p.pnk] is None:
+            missing.append(p)
+            continue
+        try:
+            p.qty = int(pnk_qty[p.pnk])  # type: ignore
+        except ValueError as ve:
+            logger.error(f'尝试将 "{p.pnk}" rank={p.rank} 的最大可加购数解析成整数时出错\n{ve}')
+        else:
+            result.append(p)
+            logger.debug('成功获取到 "{}" rank={} 的最大可加购数 {}', p.pnk, p.rank, p.qty)
+
+    if len(missing) > 0:
+        logger.error(
+            f'购物车中找不到 {len(missing)} 个产品的最大可加购数 '
+            + ', '.join(f'"{p.pnk}" rank={p.rank}' for p in missing)
+        )
+
+    return result
+
+
+async def parse_qty_one_by_one(page: Page, products: list[Product]) -> list[Product]:
+    """逐个产品查询购物车页的最大可加购数"""
     result: list[Product] = list()
 
     for i in products:
@@ -116,13 +339,145 @@ async def parse_qty(page: Page, products: list[Product]) -> list[Product]:
             logger.error(f'尝试将 "{p.pnk}" rank={p.rank} 的最大可加购数解析成整数时出错\n{ve}')
         else:
             result.append(p)
-            logger.debug(f'成功获取到 "{p.pnk}" rank={p.rank} 的最大可加购数 {p.qty}')
+            logger.debug('成功获取到 "{}" rank={} 的最大可加购数 {}', p.pnk, p.rank, p.qty)
 
     return result
 
 
+class CartSession:
+    """
+    常驻的购物车页
+
+    ---
+
+    * `context`: 购物车所属的 context
+    * `ready_timeout`: 刷新后等待购物车出现产品的时间
+    * `api_timeout`: 从接口响应中读取最大可加购数的等待时间，为 0（默认）时不监听接口，直接解析 DOM
+    * `verify_api`: 接口数据到齐时是否仍解析 DOM 并与之核对（见 `reconcile_pnk_qty`），用于对照真实流量检查接口的数据结构
+    * `cart_url`: 购物车页链接
+    * `api_routes`: 监听的购物车接口，见 `CartResponseReader`
+
+    ---
+
+    第一次使用时打开购物车页，之后每批只刷新这个页面，不再新开页面、等待 `networkidle`；
+    `api_timeout` 大于 0 时刷新时监听购物车接口的响应，所需产品的最大可加购数都到齐时直接采用，不再等待页面渲染，
+    没到齐时回退到解析 DOM。接口的数据结构还没有与真实流量核对过，所以默认关闭。同一时间只有一批在读取该购物车
+    """
+
+    def __init__(
+        self,
+        context: BrowserContext,
+        ready_timeout: int = 10 * MS1000,
+        api_timeout: int = 0,
+        verify_api: bool = False,
+        cart_url: str = CART_PAGE_URL,
+        api_routes: Optional[Mapping[str, Pattern[str]]] = None,
+    ) -> None:
+        self.context = context
+        self.ready_timeout = ready_timeout
+        self.api_timeout = api_timeout
+        self.verify_api = verify_api
+        self.cart_url = cart_url
+        self.api_routes = api_routes
+        self._page: Optional[Page] = None
+        self._lock = Lock()
+
+    async def _refresh(self, page: Page) -> None:
+        """按 `navigation_policy` 和 context 上的限速器打开或刷新购物车页（只等到响应开始返回）"""
+
+        async def refresh() -> None:
+            if page.url == self.cart_url:
+                await page.reload(wait_until='commit')
+            else:
+                await page.goto(self.cart_url, wait_until='commit')
+
+        try:
+            await navigation_policy.call(
+                'cart_open', refresh, url=self.cart_url, limiter=get_rate_limiter(self.context)
+            )
+        except PlaywrightError as pe:
+            raise GotoCartPageError from pe
+
+    async def handle(self, products: list[Product], need_clear_cart: bool) -> list[Product]:
+        """刷新购物车页，解析产品数据，按需清空购物车"""
+        if len(products) == 0:
+            # 这一批一个都没加购成功，购物车里没有要读的，也没有要清空的
+            logger.debug('这一批没有加购成功的产品，跳过购物车')
+            return list()
+        async with self._lock:
+            if self._page is None or self._page.is_closed():
+                logger.info('打开常驻的购物车页...')
+                self._page = await self.context.new_page()
+            page = self._page
+            pnks = [p.pnk for p in products]
+
+            def is_complete(lines: list[tuple[list[str], Optional[str]]]) -> bool:
+                pnk_qty = build_pnk_qty_map(lines, pnks)
+                return all(pnk_qty.get(pnk) is not None for pnk in pnks)
+
+            api_pnk_qty: Optional[dict[str, Optional[str]]] = None
+            if self.api_timeout > 0:
+                async with CartResponseReader(page, routes=self.api_routes) as reader:
+                    with metrics.span('cart_open'):
+                        await self._refresh(page)
+                    with metrics.span('cart_parse', source='api'):
+                        if await reader.wait(is_complete, timeout=self.api_timeout):
+                            api_pnk_qty = build_pnk_qty_map(reader.lines, pnks)
+                        else:
+                            logger.debug('购物车接口的响应中数据不全，改为解析购物车页')
+                            metrics.count('cart_api_incomplete')
+            else:
+                with metrics.span('cart_open'):
+                    await self._refresh(page)
+
+            rendered: Optional[bool] = None
+            if api_pnk_qty is not None and not self.verify_api:
+                # 接口的数据已经齐了，不用等页面渲染
+                result = apply_pnk_qty_map(products, api_pnk_qty)
+            else:
+                with metrics.span('cart_parse', source='dom'):
+                    rendered = await check_have_product(page, timeout=self.ready_timeout)
+                    if not rendered:
+                        logger.warning('刷新后购物车页检测不到产品')
+                    if api_pnk_qty is not None:
+                        try:
+                            dom_lines = await read_cart_qty(page)
+                        except PlaywrightError as pe:
+                            logger.warning(f'一次性读取购物车失败，只使用接口的数据\n{pe}')
+                            dom_lines = list()
+                        pnk_qty = reconcile_pnk_qty(api_pnk_qty, build_pnk_qty_map(dom_lines, pnks))
+                        result = apply_pnk_qty_map(products, pnk_qty)
+                    else:
+                        result = await parse_qty(page, products)
+
+            if need_clear_cart:
+                with metrics.span('cart_clear'):
+                    # 只用了接口的数据时页面可能还没渲染出产品，清空前要等到产品出现
+                    if rendered is None:
+                        await check_have_product(page, timeout=self.ready_timeout)
+                    if not await clear_cart(page):
+                        logger.error('购物车未能清空，残留的产品会占用下一批的购物车容量')
+            return result
+
+    async def close(self) -> None:
+        if self._page is not None and not self._page.is_closed():
+            await self._page.close()
+        self._page = None
+
+
+_cart_sessions: WeakKeyDictionary[BrowserContext, CartSession] = WeakKeyDictionary()
+
+
+def get_cart_session(context: BrowserContext, **kwargs: Any) -> CartSession:
+    """获取 `context` 的常驻购物车页，第一次获取时用 `kwargs` 创建（见 `CartSession`）"""
+    session = _cart_sessions.get(context)
+    if session is None:
+        session = _cart_sessions[context] = CartSession(context, **kwargs)
+    return session
+
+
 async def handle_cart(
-    context: BrowserContext, products: list[Product], need_clear_cart: bool
+    context: BrowserContext, products: list[Product], need_clear_cart: bool, warm: bool = True
 ) -> list[Product]:
     """处理购物车
 
@@ -131,11 +486,20 @@ async def handle_cart(
     1. 打开购物车页
     2. 解析购物车页内产品
     3. 清空购物车
+
+    ---
+
+    * `warm`: 是否使用该 context 常驻的购物车页（见 `CartSession`），否则每次新开页面并等待 `networkidle`
     """
+    if warm:
+        return await get_cart_session(context).handle(products, need_clear_cart)
 
-    cart_page = await goto_cart_page(context, wait_until='networkidle')
-    result = await parse_qty(cart_page, products)
+    with metrics.span('cart_open'):
+        cart_page = await goto_cart_page(context, wait_until='networkidle')
+    with metrics.span('cart_parse', source='dom'):
+        result = await parse_qty(cart_page, products)
     if need_clear_cart:
-        await clear_cart(cart_page)
+        with metrics.span('cart_clear'):
+            await clear_cart(cart_page)
     await cart_page.close()
     return result
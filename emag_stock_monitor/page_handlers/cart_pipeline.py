@@ -0,0 +1,78 @@
+"""分批加购与统计最大可加购数"""
+
+from __future__ import annotations
+
+from asyncio import Task, create_task, gather
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.page_handlers.cart_page import handle_cart
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Sequence
+
+    from playwright.async_api import BrowserContext
+
+    from emag_stock_monitor.models import Product
+
+    _AddBatch = Callable[[BrowserContext, list[Product]], Awaitable[list[Product]]]
+
+
+class CartPipeline:
+    """
+    购物车批处理流水线
+
+    ---
+
+    * `contexts`: 轮流使用的 context，每个对应一个购物车
+    * `capacity`: 每批加购的产品数（需小于购物车的产品种类上限 50）
+
+    ---
+
+    第 N 批加到 `contexts[N % len(contexts)]` 的购物车后，在后台打开购物车页统计并清空，
+    同时下一批加到另一个购物车；同一个购物车要等它上一批统计、清空完才会加购下一批。
+    只有一个 context 时即为依次执行。
+    """
+
+    def __init__(self, contexts: Sequence[BrowserContext], capacity: int = 40) -> None:
+        if len(contexts) == 0:
+            raise ValueError('contexts 不能为空')
+        if capacity < 1:
+            raise ValueError('capacity 需为正整数')
+        self.contexts = list(contexts)
+        self.capacity = capacity
+
+    async def run(self, products: list[Product], add_batch: _AddBatch) -> list[Product]:
+        """
+        分批加购 `products` 并统计最大可加购数
+
+        ---
+
+        * `add_batch`: 把一批产品加到指定 context 的购物车，返回加购成功的产品
+        """
+        batches = [products[i : i + self.capacity] for i in range(0, len(products), self.capacity)]
+        logger.debug('{} 个产品分成 {} 批，使用 {} 个购物车', len(products), len(batches), len(self.contexts))
+
+        cart_tasks: list[Task[list[Product]]] = list()
+        # 每个购物车正在统计、清空的那一批
+        busy: dict[int, Task[list[Product]]] = dict()
+        try:
+            for batch_index, batch in enumerate(batches):
+                slot = batch_index % len(self.contexts)
+                context = self.contexts[slot]
+                if slot in busy:
+                    await busy.pop(slot)
+
+                logger.debug('第 {} 批 {} 个产品加到购物车 #{}', batch_index + 1, len(batch), slot)
+                added_products = await add_batch(context, batch)
+                task = create_task(handle_cart(context, added_products, True))
+                busy[slot] = task
+                cart_tasks.append(task)
+
+            results = await gather(*cart_tasks)
+        except BaseException:
+            for task in cart_tasks:
+                task.cancel()
+            raise
+
+        return [p for r in results for p in r]
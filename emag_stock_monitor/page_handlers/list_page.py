@@ -4,210 +4,386 @@ from __future__ import annotations
 
 from asyncio.locks import Lock
 from asyncio.tasks import create_task
+from asyncio.threads import to_thread
+from contextlib import nullcontext
 from random import randint
 import re
 from time import perf_counter
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Literal, Optional, TypedDict
+from weakref import WeakKeyDictionary
 
 from scraper_utils.constants.time_constant import MS1000
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 
+from emag_stock_monitor.browser_util import is_page_guard_installed
 from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
 from emag_stock_monitor.models import Product
-from emag_stock_monitor.page_handlers.cart_page import handle_cart
+from emag_stock_monitor.page_handlers.add_cart_api import add_to_cart_by_api, extract_add_cart_forms
+from emag_stock_monitor.page_handlers.cart_pipeline import CartPipeline
+from emag_stock_monitor.retry import click_policy, get_rate_limiter
+from emag_stock_monitor.xpaths import (
+    ADD_CART_BUTTON,
+    CARD_ITEM_WITHOUT_PROMOVAT,
+    REVIEW_COUNT_FROM_BUTTON,
+    TOP_FAVORITE_FROM_BUTTON,
+)
 
 if TYPE_CHECKING:
-    from playwright.async_api import Page, Locator
+    from typing import Sequence
+
+    from playwright.async_api import BrowserContext, Page, Locator
+
+    from emag_stock_monitor.qty_cache import QtyCache
+
+    class _CardTypedDict(TypedDict):
+        pnk: str
+        top_favorite: bool
+        review_text: Optional[str]
+
+
+_EXTRACT_CARDS_JS = '''
+([buttonXPath, topFavoriteXPath, reviewCountXPath]) => {
+    const first = (xpath, node) => document.evaluate(
+        xpath, node, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+    const buttons = document.evaluate(
+        buttonXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const cards = [];
+    for (let i = 0; i < buttons.snapshotLength; i++) {
+        const button = buttons.snapshotItem(i);
+        const reviewSpan = first(reviewCountXPath, button);
+        cards.push({
+            pnk: button.getAttribute('data-pnk'),
+            top_favorite: first(topFavoriteXPath, button) !== null,
+            review_text: reviewSpan === null ? null : reviewSpan.innerText,
+        });
+    }
+    return cards;
+}
+'''
+"""在页面内一次性提取所有加购按钮对应卡片的 pnk、TOP 标、评论数文本"""
+
+
+_CARD_COUNT_READY_JS = '''
+([cardXPath, expectCount]) => {
+    const count = document.evaluate(
+        `count(${cardXPath})`, document, null, XPathResult.NUMBER_TYPE, null
+    ).numberValue;
+    return count >= expectCount ? {count} : false;
+}
+'''
+"""产品卡片数量达到期望时返回 `{count}`（数量可能为 0，包一层保证返回值为真），否则返回 false（配合 `wait_for_function(polling='mutation')` 由页面内的 MutationObserver 触发）"""
+
+_SCROLL_STATE_JS = '''
+(cardXPath) => ({
+    count: document.evaluate(
+        `count(${cardXPath})`, document, null, XPathResult.NUMBER_TYPE, null
+    ).numberValue,
+    atBottom: window.innerHeight + window.scrollY >= document.documentElement.scrollHeight - 2,
+})
+'''
+"""当前产品卡片数量、是否已滚动到底部"""
+
+
+class PageLoadResult:
+    """
+    等待产品列表页加载的结果
+
+    ---
+
+    * `ready`: 是否加载完成
+    * `card_count`: 非 Promovat 的产品卡片数量
+    * `expect_count`: 最终的期望数量（最后一页等不足一整页时会调整为实际数量）
+    * `elapsed`: 耗时（秒）
+    * `scroll_steps`: 滚动次数
+
+    ---
+
+    可以直接当作 `bool` 使用
+    """
 
+    def __init__(
+        self, ready: bool, card_count: int, expect_count: int, elapsed: float, scroll_steps: int
+    ) -> None:
+        self.ready = ready
+        self.card_count = card_count
+        self.expect_count = expect_count
+        self.elapsed = elapsed
+        self.scroll_steps = scroll_steps
+
+    def __bool__(self) -> bool:
+        return self.ready
+
+    def __repr__(self) -> str:
+        return (
+            f'{self.__class__.__name__}(ready={self.ready}, card_count={self.card_count}, '
+            f'expect_count={self.expect_count}, elapsed={self.elapsed:.3f}, scroll_steps={self.scroll_steps})'
+        )
 
-# TODO 需要检测验证码
-# /html/body[contains(@class,"captcha")]
-# CF 验证会有很多形式，是搞模拟点击？还是当出现验证码时暂停程序并发出提醒？
 
-# TODO 每个类目爬 5 页
+async def wait_page_load(
+    page: Page,
+    expect_count: int = 60,
+    timeout: float = 10,
+    step_timeout: int = 500,
+    stable_steps: int = 3,
+) -> PageLoadResult:
+    """
+    等待页面加载完成（等待加载出足够数量的产品卡片）
 
+    ---
+
+    * `expect_count`: 期望的产品卡片数量
+    * `timeout`: 总超时（秒）
+    * `step_timeout`: 每次滚动后等待卡片增加的时间（毫秒）
+    * `stable_steps`: 连续多少步都在底部且卡片数量不变，才认为这一页本来就不足 `expect_count` 个产品
+
+    ---
 
-async def wait_page_load(page: Page, expect_count: int = 60, timeout: float = 10) -> bool:
-    """等待页面加载完成（等待加载出足够数量的产品卡片）"""
+    1. 由页面内的 MutationObserver 在 DOM 变化时检查卡片数量，数量达标立即返回
+    2. 一步内没达标就向下滚动一次
+    3. 已经滚到底部且连续 `stable_steps` 步卡片数量不再增加时（如类目的最后一页、没有产品的空类目），把期望数量调整为实际数量并返回；
+    只停顿一步可能是懒加载的请求还没返回，不调整
+    """
     logger.info(f'等待页面 "{page.url}" 加载...')
     start_time = perf_counter()
+    scroll_steps = 0
+    last_count = -1
+    stable_count = 0
 
     while True:
-        # 统计产品卡片数量
-        card_item_without_promovat_divs = page.locator(
-            (
-                'xpath='
-                '//div[starts-with(@class, "card-item")]'
-                '[not(.//div[starts-with(@class, "card-v2-badge-cmp-holder")]/span[starts-with(@class, "card-v2-badge-cmp")])]'
-            ),
-        )
-        card_item_without_promovat_div_count = await card_item_without_promovat_divs.count()
-        # logger.debug(f'找到 {card_item_without_promovat_div_count} 个 card_item_without_promovat_div')
-
-        # 数量达标就退出
-        if card_item_without_promovat_div_count >= expect_count:
+        try:
+            ready_handle = await page.wait_for_function(
+                _CARD_COUNT_READY_JS,
+                arg=[CARD_ITEM_WITHOUT_PROMOVAT, expect_count],
+                polling='mutation',
+                timeout=step_timeout,
+            )
+        except PlaywrightError:
+            pass
+        else:
+            card_count = int((await ready_handle.json_value())['count'])
+            result = PageLoadResult(True, card_count, expect_count, perf_counter() - start_time, scroll_steps)
+            logger.debug('等待页面 "{}" 加载成功 {}', page.url, result)
+            return result
+
+        state = await page.evaluate(_SCROLL_STATE_JS, CARD_ITEM_WITHOUT_PROMOVAT)
+        card_count = int(state['count'])
+
+        # 已到底部且连续几步数量不再增加，说明这一页本来就不足 expect_count 个产品（可能一个都没有，如空类目）
+        if state['atBottom'] and card_count == last_count:
+            stable_count += 1
+        else:
+            stable_count = 0
+        if stable_count >= stable_steps:
+            result = PageLoadResult(True, card_count, card_count, perf_counter() - start_time, scroll_steps)
             logger.debug(
-                f'等待页面 "{page.url}" 加载成功，检测到 {card_item_without_promovat_div_count} 个产品'
+                '页面 "{}" 不足 {} 个产品，按实际数量 {} 视为加载成功 {}',
+                page.url,
+                expect_count,
+                card_count,
+                result,
             )
-            return True
+            return result
+        last_count = card_count
 
         # 时间超时就退出
         if perf_counter() - start_time > timeout:
+            result = PageLoadResult(
+                False, card_count, expect_count, perf_counter() - start_time, scroll_steps
+            )
             logger.warning(
-                f'等待页面 "{page.url}" 加载失败，检测到 {card_item_without_promovat_div_count} 个产品，期望 {expect_count}'
+                f'等待页面 "{page.url}" 加载失败，检测到 {card_count} 个产品，期望 {expect_count} {result}'
             )
-            return False
+            return result
 
         # 模拟鼠标滑动
-        await page.mouse.wheel(delta_x=0, delta_y=randint(200, 1000))
-        await page.wait_for_timeout(randint(0, 500))
+        await page.mouse.wheel(delta_x=0, delta_y=randint(600, 1000))
+        scroll_steps += 1
+
+
+# 点击加购按钮与点击加购弹窗关闭按钮的锁，每个 BrowserContext（即每个购物车）各一把
+_add_cart_locks: WeakKeyDictionary[BrowserContext, Lock] = WeakKeyDictionary()
 
 
-# 点击加购按钮与点击加购弹窗关闭按钮的锁
-_add_cart_lock = Lock()
+def get_add_cart_lock(context: BrowserContext) -> Lock:
+    """获取 `context` 的加购锁"""
+    lock = _add_cart_locks.get(context)
+    if lock is None:
+        lock = _add_cart_locks[context] = Lock()
+    return lock
 
 
 async def handle_cart_dialog(page: Page, interval: int = MS1000) -> None:
     """每间隔 `interval` 毫秒检测一次页面有无加购弹窗，有则点击关闭"""
     logger.info('启动检测加购弹窗任务...')
+    add_cart_lock = get_add_cart_lock(page.context)
     while True:
         if page.is_closed():
             logger.info('检测到页面关闭，检测加购弹窗任务即将关闭...')
             break
         dialog_close_button = page.locator('xpath=//button[@class="close gtm_6046yfqs"]')
-        async with _add_cart_lock:
+        async with add_cart_lock:
             try:
                 # logger.debug('正在寻找并尝试关闭加购弹窗')
                 await dialog_close_button.click(timeout=interval)
             except PlaywrightError:
                 pass
+            else:
+                metrics.count('dialog_closes', source='poll')
             # else:
             #     logger.debug('关闭了一个加购弹窗')
     logger.info('检测加购弹窗任务已关闭')
 
 
-async def handle_list_page(page: Page) -> list[Product]:
+async def handle_list_page(
+    page: Page,
+    add_cart_mode: Literal['click', 'api'] = 'click',
+    cart_capacity: int = 40,
+    extra_contexts: Sequence[BrowserContext] = (),
+    qty_cache: Optional[QtyCache] = None,
+) -> list[Product]:
     """
     处理产品列表页
 
     ---
 
-    1. 统计页面上非 Promovat、非 Vezi Detalii 的加购按钮总数
-    2. 启动处理加购弹窗的任务
-    3. 判断加购按钮总数
-        1. 如果小于等于 40，遍历点击所有加购按钮，每次加购时将已加购产品的 pnk、source_url、rank 放到 added_products 中，
-        然后统计最大可加购数
-        2. 如果超过 40，先遍历加购前 40 个产品，统计一边最大可加购数后再加购剩下产品
-        3. 加购时判断当前加购的产品是否与 rank_pnk 的排序相同
+    * `add_cart_mode`: `click` 逐个点击加购按钮；`api` 直接提交加购表单（见 `add_cart_api`）
+    * `cart_capacity`: 每批加购的产品数，每批加购后统计一次最大可加购数并清空购物车
+    * `extra_contexts`: 额外的购物车，与 `page.context` 轮流使用，一批在统计时下一批可同时加购（仅 `api` 模式）
+    * `qty_cache`: 按 pnk 缓存的最大可加购数，命中的产品不再加购，只记录本页的 rank、TOP 标和评论数
+
+    ---
 
+    1. 一次性提取页面上非 Promovat、非 Vezi Detalii 的产品卡片（rank、pnk、TOP 标、评论数）
+    2. 启动处理加购弹窗的任务
+    3. 按 `cart_capacity` 分批加购（见 `CartPipeline`），每批加购后统计最大可加购数并清空购物车
+    4. 点击加购时判断当前加购的产品是否与 rank_pnk 的排序相同
     """
     # NOTICE 一个产品列表页默认 60 个产品（不算 Promovat）
     # NOTICE 购物车一次最多放 50 种产品
 
-    # 启动检测加购弹窗作为后台任务
-    check_cart_dialog_task = create_task(handle_cart_dialog(page))
-
-    # 非 Promovat、非 Vezi Detalii 的加购按钮
-    add_cart_buttons = page.locator(
-        (
-            'xpath=//div[starts-with(@class, "card-item")]'
-            '[not(.//div[starts-with(@class, "card-v2-badge-cmp-holder")]/span[starts-with(@class, "card-v2-badge-cmp")])]'
-            '//form/button[@data-pnk]'
-        ),
-    )
-    # 页面上的加购按钮总数
-    add_cart_button_count = await add_cart_buttons.count()
-    logger.debug(f'找到 {add_cart_button_count} 个非 Promovat、非 Vezi Detalii 的加购按钮')
+    # 页面上的产品卡片（下标 + 1 即为 rank）
+    with metrics.span('extract_cards'):
+        products = await extract_products(page)
+    logger.debug('找到 {} 个非 Promovat、非 Vezi Detalii 的加购按钮', len(products))
 
     # 页面上产品与其序号
-    rank_pnk: dict[int, str] = {
-        _ + 1: await add_cart_buttons.nth(_).get_attribute('data-pnk', timeout=MS1000)
-        for _ in range(add_cart_button_count)
-    }  # type: ignore
-    logger.debug(
-        f'从加购按钮找到 {len(rank_pnk)} 个 data-pnk\n{{{', '.join(f'{r}: "{p}"' for r, p in rank_pnk.items())}}}'
+    rank_pnk: dict[int, str] = {p.rank: p.pnk for p in products}
+    # 只在输出 DEBUG 时才拼接
+    logger.opt(lazy=True).debug(
+        '从加购按钮找到 {} 个 data-pnk\n{{{}}}',
+        lambda: len(rank_pnk),
+        lambda: ', '.join(f'{r}: "{p}"' for r, p in rank_pnk.items()),
     )
 
+    # 缓存命中的产品直接用缓存的最大可加购数，不占用购物车
+    cached_products: list[Product] = list()
+    if qty_cache is not None:
+        # 多进程时是队列服务上的代理，读写都是阻塞的网络往返，放到线程里执行
+        cached_qty = await to_thread(qty_cache.get_many, list(rank_pnk.values()))
+        if len(cached_qty) > 0:
+            cached_products = [p for p in products if p.pnk in cached_qty]
+            for p in cached_products:
+                p.qty = cached_qty[p.pnk]
+            products = [p for p in products if p.pnk not in cached_qty]
+            metrics.count('qty_cache_hits', len(cached_products))
+            logger.debug('{} 个产品命中最大可加购数缓存，跳过加购', len(cached_products))
+
+    if add_cart_mode == 'api':
+        forms = await extract_add_cart_forms(page)
+        logger.debug('找到 {} 个加购表单', len(forms))
+
+        async def add_batch(context: BrowserContext, batch: list[Product]) -> list[Product]:
+            # 加购请求走 context.request，与该 context 共享 cookie，所以加购的是该 context 的购物车
+            return await add_to_cart_by_api(context.request, batch, forms, limiter=get_rate_limiter(context))
+
+        pipeline = CartPipeline([page.context, *extra_contexts], capacity=cart_capacity)
+        result = await pipeline.run(products, add_batch)
+        await page.close()
+        return await merge_cached_products(result, cached_products, qty_cache)
+
+    if len(extra_contexts) > 0:
+        logger.warning('点击加购只能加到页面所在 context 的购物车，忽略 extra_contexts')
+
+    # 装了页面守卫时加购弹窗由页面内自动关闭，不再需要轮询任务和加购锁
+    if await is_page_guard_installed(page):
+        logger.debug('页面已装上守卫，不启动检测加购弹窗任务')
+        add_cart_lock = nullcontext()
+        check_cart_dialog_task = None
+    else:
+        add_cart_lock = get_add_cart_lock(page.context)
+        # 启动检测加购弹窗作为后台任务
+        check_cart_dialog_task = create_task(handle_cart_dialog(page))
+
+    # 非 Promovat、非 Vezi Detalii 的加购按钮
+    add_cart_buttons = page.locator(f'xpath={ADD_CART_BUTTON}')
+
     ##### 加购产品 #####
     # BUG 理论上每个 pnk 只会被加购一次，但为什么购物车页有的产品的已加购数会大于一？
-    cur = 1
-    added_products: list[Product] = list()
-    # 如果加购按钮不超过 40 个
-    if add_cart_button_count <= 40:
-        while cur <= add_cart_button_count:
-            if page.is_closed():
-                break
-            async with _add_cart_lock:
-                try:
-                    logger.debug(f'尝试点击第 {cur} 个加购按钮...')
-                    await add_cart_buttons.nth(cur - 1).click(timeout=MS1000)
-                except PlaywrightError as pe_click:
-                    # logger.warning(f'尝试点击第 {cur} 个加购按钮失败\n{pe_click}')
-                    continue
-                else:
-                    try:
-                        pnk: str = await add_cart_buttons.nth(cur - 1).get_attribute('data-pnk', timeout=MS1000)  # type: ignore
-                    except PlaywrightError as pe_getattr:
-                        logger.error(f'尝试获取第 {cur} 个点击的加购按钮的 data-pnk 失败\n{pe_getattr}')
-                    else:
-                        if pnk == rank_pnk[cur]:
-                            logger.debug(f'第 {cur} 个产品加购成功 pnk="{pnk}"')
-                            current_product = await handle_top_review(
-                                add_cart_buttons.nth(cur - 1),
-                                Product(pnk=pnk, source_url=page.url, rank=cur),
-                            )
-                            added_products.append(current_product)
-                            cur += 1
-                        else:
-                            logger.error(
-                                f'当前点击的第 {cur} 个加购按钮的 pnk 应当是 "{rank_pnk[cur]}" 实际是 "{pnk}"'
-                            )
-
-        result = await handle_cart(page.context, added_products, False)
-
-    # 如果加购按钮超过 40 个
-    else:
-        while cur <= add_cart_button_count:
+    async def add_batch_by_click(context: BrowserContext, batch: list[Product]) -> list[Product]:
+        added_products: list[Product] = list()
+        # 点击不取令牌，但熔断期间要停下
+        limiter = get_rate_limiter(context)
+        for product in batch:
             if page.is_closed():
                 break
-            if cur % 40 == 0:
-                # 前 40 个产品的购物车数据
-                result_pre_40 = await handle_cart(page.context, added_products, True)
-                added_products.clear()
-            async with _add_cart_lock:
-                try:
-                    logger.debug(f'尝试点击第 {cur} 个加购按钮...')
-                    await add_cart_buttons.nth(cur - 1).click(timeout=MS1000)
-                except PlaywrightError as pe_click:
-                    # logger.warning(f'尝试点击第 {cur} 个加购按钮失败\n{pe_click}')
-                    continue
-                else:
-                    try:
-                        pnk: str = await add_cart_buttons.nth(cur - 1).get_attribute('data-pnk', timeout=MS1000)  # type: ignore
-                    except PlaywrightError as pe_getattr:
-                        logger.error(f'尝试获取第 {cur} 个点击的加购按钮的 data-pnk 失败\n{pe_getattr}')
-                    else:
-                        if pnk == rank_pnk[cur]:
-                            logger.debug(f'第 {cur} 个产品加购成功 pnk="{pnk}"')
-                            current_product = await handle_top_review(
-                                add_cart_buttons.nth(cur - 1),
-                                Product(pnk=pnk, source_url=page.url, rank=cur),
-                            )
-                            added_products.append(current_product)
-                            cur += 1
-                        else:
-                            logger.error(
-                                f'当前点击的第 {cur} 个加购按钮的 pnk 应当是 "{rank_pnk[cur]}" 实际是 "{pnk}"'
-                            )
-
-        # 从第 41 个开始的产品
-        result_past_40 = await handle_cart(page.context, added_products, False)
-        result: list[Product] = result_pre_40 + result_past_40 # type: ignore
+            cur = product.rank
+
+            async def click_once() -> None:
+                # 只在点击时持有加购锁，退避等待期间让出给其他页面
+                async with add_cart_lock:
+                    logger.debug('尝试点击第 {} 个加购按钮...', cur)
+                    with metrics.span('add_to_cart', mode='click'):
+                        await add_cart_buttons.nth(cur - 1).click(timeout=MS1000)
+
+            try:
+                await click_policy.call('add_to_cart', click_once, limiter=limiter)
+            except PlaywrightError:
+                # 卡住的产品跳过，不再拖住整个页面
+                logger.error(f'第 {cur} 个产品 pnk="{product.pnk}" 加购失败，跳过')
+                metrics.count('add_to_cart_failures', mode='click')
+                continue
+
+            # 点击已经发出，校验失败时不再重新点击，避免同一个产品被加购两次
+            try:
+                pnk = await add_cart_buttons.nth(cur - 1).get_attribute('data-pnk', timeout=MS1000)
+            except PlaywrightError as pe:
+                logger.error(f'点击第 {cur} 个加购按钮后读取 pnk 出错，跳过\n{pe}')
+                metrics.count('add_to_cart_failures', mode='click')
+                continue
+            if pnk != rank_pnk[cur]:
+                logger.error(
+                    f'当前点击的第 {cur} 个加购按钮的 pnk 应当是 "{rank_pnk[cur]}" 实际是 "{pnk}"，跳过'
+                )
+                metrics.count('add_to_cart_failures', mode='click')
+                continue
+            logger.debug('第 {} 个产品加购成功 pnk="{}"', cur, product.pnk)
+            added_products.append(product)
+        return added_products
+
+    pipeline = CartPipeline([page.context], capacity=cart_capacity)
+    result = await pipeline.run(products, add_batch_by_click)
 
     await page.close()
-    await check_cart_dialog_task
+    if check_cart_dialog_task is not None:
+        await check_cart_dialog_task
+
+    return await merge_cached_products(result, cached_products, qty_cache)
 
-    return result
+
+async def merge_cached_products(
+    result: list[Product], cached_products: list[Product], qty_cache: Optional[QtyCache]
+) -> list[Product]:
+    """把新统计到的最大可加购数写入缓存，再与命中缓存的产品按 rank 合并"""
+    if qty_cache is None:
+        return result
+    await to_thread(qty_cache.put_many, {p.pnk: p.qty for p in result if p.qty is not None})
+    if len(cached_products) == 0:
+        return result
+    return sorted([*result, *cached_products], key=lambda p: p.rank)
 
 
 async def handle_top_review(button_locator: Locator, product: Product) -> Product:
@@ -221,7 +397,7 @@ async def handle_top_review(button_locator: Locator, product: Product) -> Produc
     )
     top_flag = await top_span.count() > 0
     product.top_favorite = top_flag
-    logger.debug(f'pnk="{product.pnk}" 解析到 Top 标志 "{top_flag}"')
+    logger.debug('pnk="{}" 解析到 Top 标志 "{}"', product.pnk, top_flag)
 
     # 评论数
     # //div[starts-with(@class, "card-item")][not(.//div[starts-with(@class, "card-v2-badge-cmp-holder")]/span[starts-with(@class, "card-v2-badge-cmp")])]
@@ -232,13 +408,66 @@ async def handle_top_review(button_locator: Locator, product: Product) -> Produc
         'xpath=/ancestor::div[starts-with(@class,"card-v2-wrapper")]//div[@class="star-rating-text "]/span[@class="visible-xs-inline-block " and text()!=""]'
     )
     if await review_count_span.count() > 0:
-        review_count_text = await review_count_span.inner_text(timeout=MS1000)
-        review_count_text_match = re.search(r'\((\d+)\)', review_count_text)
-        if review_count_text_match is not None:
-            review_count = int(review_count_text_match.group(1))
+        review_count = parse_review_count(await review_count_span.inner_text(timeout=MS1000))
     else:
         logger.warning(f'pnk="{product.pnk}" 定位不到评论数标签')
     product.review_count = review_count
-    logger.debug(f'pnk="{product.pnk}" 解析到评论数 {review_count}')
+    logger.debug('pnk="{}" 解析到评论数 {}', product.pnk, review_count)
 
     return product
+
+
+def parse_review_count(review_count_text: Optional[str]) -> Optional[int]:
+    """从评论数文本（如 `"4.71 (123)"`）中解析出评论数"""
+    if review_count_text is None:
+        return None
+    review_count_text_match = re.search(r'\((\d+)\)', review_count_text)
+    if review_count_text_match is None:
+        return None
+    return int(review_count_text_match.group(1))
+
+
+async def extract_products(page: Page) -> list[Product]:
+    """
+    一次性提取页面上所有非 Promovat 产品卡片的 rank、pnk、TOP 标、评论数
+
+    ---
+
+    所有卡片在一次 `page.evaluate` 中读取完毕，出错时回退到逐个定位器读取（`extract_products_by_locator`）
+    """
+    try:
+        cards: list[_CardTypedDict] = await page.evaluate(
+            _EXTRACT_CARDS_JS, [ADD_CART_BUTTON, TOP_FAVORITE_FROM_BUTTON, REVIEW_COUNT_FROM_BUTTON]
+        )
+    except PlaywrightError as pe:
+        logger.warning(f'一次性提取产品卡片失败，回退到逐个定位\n{pe}')
+        return await extract_products_by_locator(page)
+
+    source_url = page.url
+    products = [
+        Product(
+            pnk=card['pnk'],
+            source_url=source_url,
+            rank=rank,
+            top_favorite=card['top_favorite'],
+            review_count=parse_review_count(card['review_text']),
+        )
+        for rank, card in enumerate(cards, 1)
+    ]
+    logger.debug('一次性提取到 {} 个产品卡片', len(products))
+    return products
+
+
+async def extract_products_by_locator(page: Page) -> list[Product]:
+    """逐个定位加购按钮，提取产品卡片的 rank、pnk、TOP 标、评论数"""
+    add_cart_buttons = page.locator(f'xpath={ADD_CART_BUTTON}')
+    products: list[Product] = list()
+    for i in range(await add_cart_buttons.count()):
+        pnk: str = await add_cart_buttons.nth(i).get_attribute('data-pnk', timeout=MS1000)  # type: ignore
+        products.append(
+            await handle_top_review(
+                add_cart_buttons.nth(i),
+                Product(pnk=pnk, source_url=page.url, rank=i + 1),
+            )
+        )
+    return products
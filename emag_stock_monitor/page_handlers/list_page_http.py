@@ -0,0 +1,65 @@
+"""不使用浏览器处理产品列表页"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from parsel import Selector
+
+from emag_stock_monitor.exceptions import CaptchaError, FetchListPageError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.models import Product
+from emag_stock_monitor.page_handlers.list_page import parse_review_count
+from emag_stock_monitor.xpaths import ADD_CART_BUTTON, REVIEW_COUNT_FROM_BUTTON, TOP_FAVORITE_FROM_BUTTON
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from playwright.async_api import APIRequestContext
+
+
+async def fetch_list_page(request: APIRequestContext, url: str, timeout: Optional[float] = None) -> str:
+    """
+    不使用浏览器请求产品列表页，返回 HTML
+
+    ---
+
+    * `request`: 可以是 `playwright.request.new_context()`，也可以是 `BrowserContext.request`（共享该 context 的 cookie）
+    """
+    logger.info(f'请求产品列表页 "{url}"...')
+    response = await request.get(url, timeout=timeout)
+    if response.status == 511:
+        raise CaptchaError(url, response.status, '请求产品列表页时遇到验证码')
+    if not response.ok:
+        raise FetchListPageError(url, response.status)
+    return await response.text()
+
+
+def parse_list_page(html: str, source_url: str) -> list[Product]:
+    """从产品列表页 HTML 中解析出所有非 Promovat 产品的 rank、pnk、TOP 标、评论数"""
+    selector = Selector(text=html)
+    products: list[Product] = list()
+    for rank, button in enumerate(selector.xpath(ADD_CART_BUTTON), 1):
+        review_span = button.xpath(REVIEW_COUNT_FROM_BUTTON)
+        products.append(
+            Product(
+                pnk=button.attrib['data-pnk'],
+                source_url=source_url,
+                rank=rank,
+                top_favorite=len(button.xpath(TOP_FAVORITE_FROM_BUTTON)) > 0,
+                review_count=(
+                    parse_review_count(review_span[0].xpath('string()').get()) if review_span else None
+                ),
+            )
+        )
+    if len(products) == 0 and selector.xpath('/html/body[contains(@class,"captcha")]'):
+        raise CaptchaError(source_url, 200, '产品列表页是验证码页')
+    logger.debug('从 "{}" 解析到 {} 个产品', source_url, len(products))
+    return products
+
+
+async def handle_list_page_http(
+    request: APIRequestContext, url: str, timeout: Optional[float] = None
+) -> list[Product]:
+    """不使用浏览器处理产品列表页（只有 rank、pnk、TOP 标、评论数，没有最大可加购数）"""
+    return parse_list_page(await fetch_list_page(request, url, timeout=timeout), source_url=url)
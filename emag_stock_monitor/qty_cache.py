@@ -0,0 +1,118 @@
+"""按 pnk 缓存最大可加购数"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+
+if TYPE_CHECKING:
+    from typing import Iterable, Mapping, Optional, Union
+
+
+class QtyCache:
+    """
+    pnk -> 最大可加购数 的缓存
+
+    ---
+
+    * `ttl`: 缓存有效的秒数，过期的不再命中
+    * `max_size`: 最多缓存的 pnk 数，超过后淘汰最久没用到的
+    * `path`: 持久化的 JSON 文件，指定时创建时读取、`save` 时写回，可在多次运行之间共用
+
+    ---
+
+    同一个 pnk 常出现在多个类目、多个产品列表页上，缓存命中的产品不用再加购，只记录新的 rank、TOP 标和评论数。
+    方法都是同步且线程安全的；多进程（`distributed`）时由队列服务持有一份，各 worker 通过代理访问，
+    所以按页批量读写（`get_many` / `put_many`），每页只有两次往返
+    """
+
+    def __init__(
+        self, ttl: float = 3600, max_size: int = 100_000, path: Optional[Union[str, Path]] = None
+    ) -> None:
+        if max_size < 1:
+            raise ValueError('max_size 需为正整数')
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = Path(path) if path is not None else None
+        self._entries: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.path.is_file():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_many(self, pnks: Iterable[str], now: Optional[float] = None) -> dict[str, int]:
+        """返回 `pnks` 中缓存未过期的 `{pnk: qty}`"""
+        now = now if now is not None else time()
+        result: dict[str, int] = dict()
+        with self._lock:
+            for pnk in pnks:
+                entry = self._entries.get(pnk)
+                if entry is None:
+                    self.misses += 1
+                    continue
+                qty, ts = entry
+                if now - ts > self.ttl:
+                    del self._entries[pnk]
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(pnk)
+                result[pnk] = qty
+                self.hits += 1
+        return result
+
+    def put_many(self, pnk_qty: Mapping[str, int], now: Optional[float] = None) -> None:
+        """写入 `{pnk: qty}`，超过 `max_size` 时淘汰最久没用到的"""
+        now = now if now is not None else time()
+        with self._lock:
+            for pnk, qty in pnk_qty.items():
+                self._entries[pnk] = (qty, now)
+                self._entries.move_to_end(pnk)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def load(self) -> None:
+        """从 `path` 读取未过期的缓存"""
+        if self.path is None:
+            return
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                data: dict[str, list] = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'读取最大可加购数缓存 "{self.path}" 失败\n{e}')
+            return
+        now = time()
+        # 按写入时间排序，保证淘汰顺序
+        entries = sorted(
+            ((pnk, (qty, ts)) for pnk, (qty, ts) in data.items() if now - ts <= self.ttl),
+            key=lambda e: e[1][1],
+        )
+        with self._lock:
+            self._entries = OrderedDict(entries[-self.max_size :])
+        logger.info(f'从 "{self.path}" 读取了 {len(self._entries)} 个最大可加购数缓存')
+
+    def save(self) -> None:
+        """写入 `path`（先写临时文件再替换）"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = {pnk: [qty, ts] for pnk, (qty, ts) in self._entries.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        logger.debug('已保存 {} 个最大可加购数缓存至 "{}"', len(data), self.path)
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,328 @@
+"""重试、退避与按域名限速"""
+
+from __future__ import annotations
+
+from asyncio import Lock, get_running_loop, sleep
+from random import uniform
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_stock_monitor.exceptions import ClearCartError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Optional, TypeVar
+
+    from playwright.async_api import BrowserContext, Response
+
+    from emag_stock_monitor.captcha import CircuitBreaker
+
+    _T = TypeVar('_T')
+
+
+THROTTLE_STATUSES = (429, 511)
+"""出现时降低该域名请求速率的状态码"""
+
+
+class Backoff:
+    """
+    带抖动的指数退避
+
+    ---
+
+    * `base`: 第一次重试前等待的秒数上限
+    * `factor`: 每次重试等待上限的倍数
+    * `max_delay`: 等待秒数上限
+
+    ---
+
+    第 `attempt` 次（从 0 开始）重试前等待 `0 ~ min(max_delay, base * factor ** attempt)` 秒（full jitter），
+    避免多个 context 在同一时刻一起重试
+    """
+
+    def __init__(self, base: float = 0.5, factor: float = 2, max_delay: float = 30) -> None:
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return uniform(0, min(self.max_delay, self.base * self.factor**attempt))
+
+
+class RetryBudget:
+    """
+    重试预算
+
+    ---
+
+    * `ratio`: 每次调用存入的重试额度，即重试次数最多约为调用次数的 `ratio` 倍
+    * `min_retries`: 初始（也是最少保留的）重试额度
+    * `max_retries`: 额度上限，避免长时间正常后积累过多额度
+
+    ---
+
+    站点出问题时所有调用都会失败，没有预算时每个调用都会重试到上限，请求量成倍增加；
+    有预算时额度用完后失败直接抛出，不再重试
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, max_retries: int = 100) -> None:
+        self.ratio = ratio
+        self.max_retries = max_retries
+        self._tokens = float(min_retries)
+        self.exhausted = 0
+        """额度不足而放弃重试的次数"""
+
+    def record_call(self) -> None:
+        self._tokens = min(self._tokens + self.ratio, self.max_retries)
+
+    def try_retry(self) -> bool:
+        """取出一次重试额度，额度不足时返回 `False`"""
+        if self._tokens < 1:
+            self.exhausted += 1
+            return False
+        self._tokens -= 1
+        return True
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    ---
+
+    * `rate`: 每秒补充的令牌数
+    * `burst`: 桶的容量
+    """
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated: Optional[float] = None
+        self._lock = Lock()
+
+    def _refill(self, now: float) -> None:
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """取出一个令牌，返回等待的秒数"""
+        loop = get_running_loop()
+        waited = 0.0
+        # 排队取令牌，先到先得
+        async with self._lock:
+            while True:
+                self._refill(loop.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+                waited += delay
+                await sleep(delay)
+
+
+class HostRateLimiter:
+    """
+    按域名限速
+
+    ---
+
+    * `rate`: 每个域名每秒的请求数
+    * `burst`: 每个域名允许的突发请求数
+    * `min_rate`: 降速后的最低速率
+    * `decrease`: 出现 429 / 511 时速率乘以的系数
+    * `increase`: 每个正常响应使速率增加的值（不超过 `rate`）
+    * `cooldown`: 两次降速之间至少间隔的秒数，避免同一波响应把速率连续压到最低
+    * `breaker`: 验证码熔断器，熔断期间 `acquire` / `pause` 等待恢复，不再恢复时抛出 `CaptchaError`；
+    `ContextPool` 同时有验证码检测时自动设为检测的熔断器
+
+    ---
+
+    由 `ContextPool` 创建时传入并 `attach` 到各 context，所有 context 共用同一个限速器；
+    根据响应的状态码自动调整速率（加性增、乘性减）。
+    只有真正发出请求的导航（打开、刷新页面）和接口加购会 `acquire`，页面内的点击不取令牌，只在熔断期间 `pause`，
+    所以熔断后已经在处理中的页面也会在下一次请求或点击前停下
+    """
+
+    def __init__(
+        self,
+        rate: float = 4,
+        burst: float = 8,
+        min_rate: float = 0.2,
+        decrease: float = 0.5,
+        increase: float = 0.05,
+        cooldown: float = 5,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.cooldown = cooldown
+        self.breaker = breaker
+        self._buckets: dict[str, TokenBucket] = dict()
+        self._slowed_at: dict[str, float] = dict()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).hostname or ''
+
+    def bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def pause(self) -> None:
+        """熔断期间等待恢复（不取令牌）"""
+        if self.breaker is not None:
+            await self.breaker.wait()
+
+    async def acquire(self, url: str) -> None:
+        await self.pause()
+        host = self.host_of(url)
+        waited = await self.bucket(host).acquire()
+        if waited > 0:
+            metrics.observe('rate_limit_wait', waited, host=host)
+
+    def observe(self, url: str, status: int) -> None:
+        """根据响应状态码调整域名的速率"""
+        host = self.host_of(url)
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            return
+        if status in THROTTLE_STATUSES:
+            now = get_running_loop().time()
+            if now - self._slowed_at.get(host, float('-inf')) < self.cooldown:
+                return
+            self._slowed_at[host] = now
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            metrics.count('rate_limit_slowdowns', host=host, status=status)
+            logger.warning(f'"{host}" 返回 {status}，降速至每秒 {bucket.rate:.2f} 个请求')
+        elif bucket.rate < self.rate and 200 <= status < 400:
+            bucket.rate = min(self.rate, bucket.rate + self.increase)
+
+    def attach(self, context: BrowserContext) -> None:
+        context.on('response', self._on_response)
+        _context_limiters[context] = self
+
+    def _on_response(self, response: Response) -> None:
+        self.observe(response.url, response.status)
+
+    def rates(self) -> dict[str, float]:
+        return {host: bucket.rate for host, bucket in self._buckets.items()}
+
+
+_context_limiters: WeakKeyDictionary[BrowserContext, HostRateLimiter] = WeakKeyDictionary()
+
+
+def get_rate_limiter(context: BrowserContext) -> Optional[HostRateLimiter]:
+    """获取 `attach` 到 `context` 上的限速器，没有时返回 `None`"""
+    return _context_limiters.get(context)
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    ---
+
+    * `attempts`: 最多尝试的次数（包括第一次）
+    * `backoff`: 重试前的退避
+    * `budget`: 重试预算，多个策略可共用一个
+    * `limiter`: 每次尝试前取令牌的限速器，可在 `call` 时按 context 另外指定
+    * `retry_on`: 需要重试的异常
+
+    ---
+
+    ```python
+    await navigation_policy.call('cart_open', lambda: page.goto(url), url=url, limiter=limiter)
+    ```
+
+    用完尝试次数或重试预算时抛出最后一次的异常
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: Optional[Backoff] = None,
+        budget: Optional[RetryBudget] = None,
+        limiter: Optional[HostRateLimiter] = None,
+        retry_on: tuple[type[BaseException], ...] = (PlaywrightError,),
+    ) -> None:
+        if attempts < 1:
+            raise ValueError('attempts 需为正整数')
+        self.attempts = attempts
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.budget = budget
+        self.limiter = limiter
+        self.retry_on = retry_on
+
+    async def call(
+        self,
+        stage: str,
+        fn: Callable[[], Awaitable[_T]],
+        url: Optional[str] = None,
+        limiter: Optional[HostRateLimiter] = None,
+    ) -> _T:
+        """
+        按策略调用 `fn`
+
+        ---
+
+        * `stage`: 阶段名，用于日志和指标
+        * `url`: 请求的链接，有限速器时按其域名取令牌；没有 `url` 时不取令牌，只在熔断期间等待
+        * `limiter`: 本次调用使用的限速器，默认为策略的 `limiter`
+        """
+        if self.budget is not None:
+            self.budget.record_call()
+        limiter = limiter if limiter is not None else self.limiter
+        attempt = 0
+        while True:
+            if limiter is not None:
+                if url is not None:
+                    await limiter.acquire(url)
+                else:
+                    await limiter.pause()
+            try:
+                return await fn()
+            except self.retry_on as e:
+                attempt += 1
+                if attempt >= self.attempts:
+                    logger.error(f'{stage} 尝试 {attempt} 次后仍失败\n{e}')
+                    metrics.count('retries_exhausted', stage=stage)
+                    raise
+                if self.budget is not None and not self.budget.try_retry():
+                    logger.error(f'{stage} 失败且重试预算已用完，不再重试\n{e}')
+                    metrics.count('retry_budget_exhausted', stage=stage)
+                    raise
+                delay = self.backoff.delay(attempt - 1)
+                logger.warning(f'{stage} 第 {attempt}/{self.attempts} 次尝试失败，{delay:.2f} 秒后重试\n{e}')
+                metrics.count('retries', stage=stage)
+                await sleep(delay)
+
+
+retry_budget = RetryBudget()
+"""全局的重试预算"""
+
+navigation_policy = RetryPolicy(attempts=4, backoff=Backoff(base=1, max_delay=20), budget=retry_budget)
+"""打开、刷新页面的重试策略（限速器由调用方按 context 传入）"""
+
+click_policy = RetryPolicy(
+    attempts=5, backoff=Backoff(base=0.2, max_delay=3), budget=retry_budget, retry_on=(PlaywrightError,)
+)
+"""点击加购的重试策略（只重试没点下去的点击，点击后的校验失败不重试，避免重复加购）"""
+
+cart_policy = RetryPolicy(
+    attempts=3,
+    backoff=Backoff(base=1, max_delay=10),
+    budget=retry_budget,
+    retry_on=(PlaywrightError, ClearCartError),
+)
+"""清空购物车的重试策略"""
@@ -0,0 +1,243 @@
+"""类目爬取调度"""
+
+from __future__ import annotations
+
+from asyncio import Event, Lock, PriorityQueue, gather
+from inspect import isawaitable
+from itertools import count
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.metrics import metrics
+from emag_stock_monitor.urls import BASE_URL, build_list_page_url
+
+if TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable, Iterable, Literal, Optional, Union
+
+    from emag_stock_monitor.captcha import CircuitBreaker
+    from emag_stock_monitor.context_pool import ContextPool, ListPageResult
+
+    _JobStatus = Literal['pending', 'done', 'failed']
+    _OnResult = Callable[['Job', ListPageResult], Union[Awaitable[None], None]]
+
+
+class Job:
+    """
+    一个产品列表页任务
+
+    ---
+
+    * `category`: 类目
+    * `page`: 页码（从 1 开始）
+    * `priority`: 优先级，越大越先处理
+    * `status`: `pending` / `done` / `failed`
+    * `attempts`: 已失败次数
+    """
+
+    def __init__(
+        self,
+        category: str,
+        page: int,
+        priority: int = 0,
+        status: _JobStatus = 'pending',
+        attempts: int = 0,
+    ) -> None:
+        self.category = category
+        self.page = page
+        self.priority = priority
+        self.status: _JobStatus = status
+        self.attempts = attempts
+
+    @property
+    def key(self) -> str:
+        return f'{self.category}/p{self.page}'
+
+    def url(self, base_url: str = BASE_URL) -> str:
+        return build_list_page_url(self.category, self.page, base_url=base_url)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(key="{self.key}", priority={self.priority}, status="{self.status}", attempts={self.attempts})'
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'category': self.category,
+            'page': self.page,
+            'priority': self.priority,
+            'status': self.status,
+            'attempts': self.attempts,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> Job:
+        return cls(
+            category=d['category'],
+            page=d['page'],
+            priority=d.get('priority', 0),
+            status=d.get('status', 'pending'),
+            attempts=d.get('attempts', 0),
+        )
+
+
+class Checkpoint:
+    """任务状态检查点（JSON 文件）"""
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+
+    def load(self) -> dict[str, Job]:
+        """读取检查点，文件不存在时返回空字典"""
+        if not self.path.exists():
+            return dict()
+        with self.path.open('r', encoding='utf-8') as f:
+            jobs = (Job.from_dict(d) for d in json.load(f)['jobs'])
+        return {j.key: j for j in jobs}
+
+    def save(self, jobs: Iterable[Job]) -> None:
+        """写入检查点（先写临时文件再替换，避免中途崩溃写坏检查点）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            json.dump({'jobs': [j.as_dict() for j in jobs]}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class CategoryJobs:
+    """
+    从检查点恢复、按类目展开的任务集合（`CrawlScheduler` 与 `distributed.Coordinator` 共用）
+
+    ---
+
+    * `checkpoint_path`: 检查点文件路径
+    """
+
+    def __init__(self, checkpoint_path: Union[str, Path]) -> None:
+        self._checkpoint = Checkpoint(checkpoint_path)
+        self._jobs: dict[str, Job] = self._checkpoint.load()
+        if len(self._jobs) > 0:
+            logger.info(f'从检查点 "{self._checkpoint.path}" 恢复了 {len(self._jobs)} 个任务')
+
+    @property
+    def jobs(self) -> list[Job]:
+        return list(self._jobs.values())
+
+    def add_categories(self, categories: Iterable[str], depth: int = 5, priority: int = 0) -> None:
+        """把每个类目展开成第 1 ~ `depth` 页的任务，检查点里已有的任务保留原状态"""
+        for category in categories:
+            for page in range(1, depth + 1):
+                job = Job(category=category, page=page, priority=priority)
+                if job.key not in self._jobs:
+                    self._jobs[job.key] = job
+
+
+class CrawlScheduler(CategoryJobs):
+    """
+    类目爬取调度器
+
+    ---
+
+    * `pool`: 处理产品列表页的 `ContextPool`
+    * `checkpoint_path`: 检查点文件路径，已完成的任务在重新运行时会被跳过
+    * `workers`: 同时处理的任务数，默认为 `pool` 能同时处理的页面数
+    * `max_attempts`: 每个任务最多尝试次数，超过后标记为 `failed`
+    * `on_result`: 每完成一个任务时的回调（可以是协程函数）
+    * `base_url`: 产品列表页的站点根链接
+    * `breaker`: 验证码熔断器，指定时遇到验证码的任务在恢复后重试，熔断器不再恢复时才停止
+
+    ---
+
+    1. `add_categories` 把类目按页数展开成任务
+    2. `run` 按优先级把任务交给有限个 worker 处理，每个任务的状态变化都会写入检查点
+    3. 遇到验证码且没有熔断器（或熔断器不再恢复）时停止派发任务，当前任务保持 `pending`，下次运行从断点继续
+    """
+
+    def __init__(
+        self,
+        pool: ContextPool,
+        checkpoint_path: Union[str, Path],
+        workers: Optional[int] = None,
+        max_attempts: int = 3,
+        on_result: Optional[_OnResult] = None,
+        base_url: str = BASE_URL,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        super().__init__(checkpoint_path)
+        self._pool = pool
+        self.workers = workers if workers is not None else pool.size // pool.carts_per_page
+        self.max_attempts = max_attempts
+        self._on_result = on_result
+        self.base_url = base_url
+        self._breaker = breaker
+        self._checkpoint_lock = Lock()
+        self._stop = Event()
+
+    def stop(self) -> None:
+        """停止派发新任务"""
+        self._stop.set()
+
+    async def _save_checkpoint(self) -> None:
+        async with self._checkpoint_lock:
+            self._checkpoint.save(self._jobs.values())
+
+    async def run(self) -> list[ListPageResult]:
+        """处理所有未完成的任务"""
+        queue: PriorityQueue[tuple[int, int, Job]] = PriorityQueue()
+        seq = count()
+        for job in self._jobs.values():
+            if job.status != 'done' and job.attempts < self.max_attempts:
+                job.status = 'pending'
+                queue.put_nowait((-job.priority, next(seq), job))
+        logger.info(f'共 {len(self._jobs)} 个任务，待处理 {queue.qsize()} 个')
+        await self._save_checkpoint()
+
+        results: list[ListPageResult] = list()
+
+        async def worker(worker_id: int) -> None:
+            while not self._stop.is_set() and not queue.empty():
+                _, _, job = queue.get_nowait()
+                url = job.url(self.base_url)
+                try:
+                    with metrics.tags(category=job.category, page=job.page):
+                        result = await self._pool.crawl_list_page(url)
+                except CaptchaError as ce:
+                    metrics.count('captcha', category=job.category)
+                    if self._breaker is None or self._breaker.exhausted:
+                        logger.error(f'worker #{worker_id} 处理 {job} 时遇到验证码，停止派发任务\n{ce}')
+                        self.stop()
+                        break
+                    # 熔断器会暂停所有 worker，恢复后重新处理该任务，不计入失败次数
+                    logger.warning(f'worker #{worker_id} 处理 {job} 时遇到验证码，等待恢复后重试')
+                    queue.put_nowait((-job.priority, next(seq), job))
+                    try:
+                        await self._breaker.wait()
+                    except CaptchaError:
+                        self.stop()
+                        break
+                    continue
+                except Exception as e:
+                    job.attempts += 1
+                    if job.attempts >= self.max_attempts:
+                        job.status = 'failed'
+                        logger.error(f'worker #{worker_id} 处理 {job} 失败，不再重试\n{e!r}')
+                    else:
+                        # 重试的任务排到同优先级的最后
+                        metrics.count('retries', stage='job')
+                        queue.put_nowait((-job.priority, next(seq), job))
+                        logger.warning(f'worker #{worker_id} 处理 {job} 失败，稍后重试\n{e!r}')
+                else:
+                    job.status = 'done'
+                    results.append(result)
+                    if self._on_result is not None:
+                        r = self._on_result(job, result)
+                        if isawaitable(r):
+                            await r
+                await self._save_checkpoint()
+
+        await gather(*(worker(i) for i in range(self.workers)))
+
+        pending_count = sum(1 for j in self._jobs.values() if j.status == 'pending')
+        logger.info(f'本次完成 {len(results)} 个任务，剩余 {pending_count} 个待处理')
+        return results
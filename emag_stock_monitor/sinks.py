@@ -0,0 +1,179 @@
+"""爬取结果的流式写入"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from asyncio import Lock, to_thread
+import csv
+from pathlib import Path
+import sqlite3
+from typing import TYPE_CHECKING
+
+from emag_stock_monitor.logger import logger
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Optional, TextIO, Union
+
+    from emag_stock_monitor.models import Product
+
+
+FIELDNAMES = ('pnk', 'source_url', 'rank', 'top_favorite', 'review_count', 'qty')
+"""写入的字段"""
+
+
+class ResultSink(ABC):
+    """
+    爬取结果写入的基类
+
+    ---
+
+    * `buffer_size`: 缓冲的记录数，达到后批量写入
+
+    ---
+
+    每批结果完成后就 `push` 进来，缓冲满了才真正写入（在线程中执行，不阻塞事件循环）；
+    多个 worker 可以同时 `push`。用完需 `close`（或用 `async with`）把剩余的缓冲写入
+    """
+
+    def __init__(self, buffer_size: int = 500) -> None:
+        if buffer_size < 1:
+            raise ValueError('buffer_size 需为正整数')
+        self.buffer_size = buffer_size
+        self._buffer: list[dict[str, Any]] = list()
+        self._lock = Lock()
+        self.written = 0
+        """已写入的记录数"""
+
+    async def push(self, products: Iterable[Product]) -> None:
+        """放入一批结果"""
+        rows = self._rows(products)
+        async with self._lock:
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.buffer_size:
+                await self._flush()
+
+    async def flush(self) -> None:
+        """立即写入缓冲中的结果"""
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if len(self._buffer) == 0:
+            return
+        rows, self._buffer = self._buffer, list()
+        await to_thread(self._write, rows)
+        self.written += len(rows)
+        logger.debug('{} 写入 {} 条结果，共 {} 条', self.__class__.__name__, len(rows), self.written)
+
+    async def close(self) -> None:
+        async with self._lock:
+            await self._flush()
+            await to_thread(self._close)
+
+    async def __aenter__(self) -> ResultSink:
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def _rows(self, products: Iterable[Product]) -> list[dict[str, Any]]:
+        """把一批结果转为待写入的记录"""
+        return [{k: getattr(p, k) for k in FIELDNAMES} for p in products]
+
+    @abstractmethod
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        """写入一批记录（在线程中执行）"""
+
+    def _close(self) -> None:
+        pass
+
+
+class CsvSink(ResultSink):
+    """写入 CSV 文件（追加写入，文件为空时先写表头）"""
+
+    def __init__(self, path: Union[str, Path], buffer_size: int = 500) -> None:
+        super().__init__(buffer_size=buffer_size)
+        self.path = Path(path)
+        self._file: Optional[TextIO] = None
+        self._writer: Optional[csv.DictWriter] = None
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            need_header = not self.path.exists() or self.path.stat().st_size == 0
+            self._file = self.path.open('a', newline='', encoding='utf-8')
+            self._writer = csv.DictWriter(self._file, fieldnames=FIELDNAMES)
+            if need_header:
+                self._writer.writeheader()
+        self._writer.writerows(rows)  # type: ignore
+        self._file.flush()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+
+class ParquetSink(ResultSink):
+    """
+    写入 Parquet 文件
+
+    ---
+
+    Parquet 不能追加，每次写入生成目录下的一个 `part-{n}.parquet`（`n` 接着目录中已有的最大编号递增），
+    读取时 `pandas.read_parquet(目录)` 即可；需要安装 `pyarrow`（`parquet` 可选依赖）或 `fastparquet`
+    """
+
+    def __init__(self, directory: Union[str, Path], buffer_size: int = 5000) -> None:
+        from pandas.io.parquet import get_engine
+
+        # 没装 parquet 引擎时尽早报错，而不是等到第一次写入
+        get_engine('auto')
+        super().__init__(buffer_size=buffer_size)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # 按已有的最大编号续写，中间删过文件时按数量计数会覆盖已有的文件
+        self._part = max(
+            (int(p.stem[5:]) + 1 for p in self.directory.glob('part-*.parquet') if p.stem[5:].isdigit()),
+            default=0,
+        )
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        from pandas import DataFrame
+
+        df = DataFrame.from_records(rows, columns=FIELDNAMES).astype(
+            {'rank': 'int32', 'top_favorite': 'bool', 'review_count': 'Int32', 'qty': 'Int32'}
+        )
+        df.to_parquet(self.directory.joinpath(f'part-{self._part:05d}.parquet'), index=False)
+        self._part += 1
+
+
+class SqliteSink(ResultSink):
+    """写入 SQLite 数据库的 `table` 表"""
+
+    def __init__(self, path: Union[str, Path], table: str = 'products', buffer_size: int = 500) -> None:
+        if not table.isidentifier():
+            raise ValueError(f'"{table}" 不是合法的表名')
+        super().__init__(buffer_size=buffer_size)
+        self.path = Path(path)
+        self.table = table
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 写入在线程池中执行，由 _lock 保证同一时间只有一个线程使用连接
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            'pnk TEXT NOT NULL, source_url TEXT NOT NULL, rank INTEGER NOT NULL, '
+            'top_favorite INTEGER NOT NULL, review_count INTEGER, qty INTEGER)'
+        )
+        self._conn.commit()
+
+    def _write(self, rows: list[dict[str, Any]]) -> None:
+        self._conn.executemany(
+            f'INSERT INTO {self.table} ({", ".join(FIELDNAMES)}) VALUES ({", ".join("?" * len(FIELDNAMES))})',
+            [tuple(r[k] for k in FIELDNAMES) for r in rows],
+        )
+        self._conn.commit()
+
+    def _close(self) -> None:
+        self._conn.close()
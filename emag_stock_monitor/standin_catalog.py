@@ -0,0 +1,240 @@
+"""替身服务器生成的模拟页面"""
+
+from __future__ import annotations
+
+from html import escape
+import json
+from typing import TYPE_CHECKING
+from zlib import crc32
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+
+_PNK_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+_LIST_PAGE_JS = '''
+(() => {
+    const dialogDelay = %(dialog_delay)d;
+    const showDialog = %(dialog)s;
+    const reuseDialog = %(reuse_dialog)s;
+    const createModal = () => {
+        const modal = document.createElement('div');
+        modal.className = 'modal fade';
+        modal.style.cssText = 'position:fixed;inset:0;z-index:1050;display:none';
+        modal.innerHTML = '<div class="modal-dialog"><button type="button" class="close gtm_6046yfqs">&times;</button>'
+            + '<p>Produsul a fost adaugat in cos</p></div>';
+        modal.querySelector('button.close').addEventListener('click', () => {
+            // 重复使用的弹窗关闭时只隐藏，否则删除
+            if (reuseDialog) {
+                modal.classList.remove('in');
+                modal.style.display = 'none';
+            } else {
+                modal.remove();
+            }
+            document.querySelectorAll('.modal-backdrop').forEach((b) => b.remove());
+            document.body.classList.remove('modal-open');
+        });
+        document.body.append(modal);
+        return modal;
+    };
+    // 重复使用时弹窗在页面加载时就渲染好（隐藏），之后每次加购都显示同一个
+    const sharedModal = reuseDialog ? createModal() : null;
+    const openDialog = () => {
+        const backdrop = document.createElement('div');
+        backdrop.className = 'modal-backdrop fade in';
+        backdrop.style.cssText = 'position:fixed;inset:0;z-index:1040;background:rgba(0,0,0,.3)';
+        document.body.classList.add('modal-open');
+        document.body.append(backdrop);
+        const modal = sharedModal || createModal();
+        modal.classList.add('in');
+        modal.style.display = 'block';
+    };
+    document.addEventListener('submit', (event) => {
+        const form = event.target;
+        event.preventDefault();
+        fetch(form.action, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+            body: new URLSearchParams(new FormData(form, event.submitter)),
+        }).then(() => {
+            if (showDialog) {
+                setTimeout(openDialog, dialogDelay);
+            }
+        });
+    });
+})();
+'''
+"""产品列表页脚本：点击加购按钮时提交表单，按设置弹出加购弹窗（遮住整个页面，关闭前点不到其他按钮）"""
+
+_CART_PAGE_JS = '''
+(() => {
+    const post = (path, data) => fetch(path, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'X-Requested-With': 'XMLHttpRequest'},
+        body: new URLSearchParams(data || {}),
+    }).then((r) => r.json());
+    const bind = (root) => {
+        root.querySelectorAll('button.remove-product').forEach((button) => {
+            button.addEventListener('click', () => {
+                const line = button.closest('.cart-line');
+                post('/cart/remove', {pnk: line.dataset.pnk}).then(() => line.remove());
+            });
+        });
+    };
+    post('/shopping/header-cart');
+    post('/cart/get-totals');
+    post('/cart/render-vendors').then((payload) => {
+        const container = document.getElementById('vendors');
+        container.innerHTML = payload.html;
+        bind(container);
+    });
+})();
+'''
+"""购物车页脚本：和真实站点一样，产品行由 `cart/render-vendors` 的响应渲染"""
+
+
+class SyntheticCatalog:
+    """
+    替身服务器的模拟类目
+
+    ---
+
+    * `products_per_page`: 每个产品列表页非 Promovat 的产品数
+    * `promovat_per_page`: 每个产品列表页的 Promovat 产品数（穿插在普通产品之间）
+    * `pages`: 每个类目的页数
+    * `dialog`: 加购后是否弹出加购弹窗
+    * `dialog_delay`: 加购请求返回后多少毫秒弹出弹窗
+    * `reuse_dialog`: 加购弹窗是否预先渲染好（隐藏）并重复使用，关闭时只隐藏不删除
+    * `max_qty`: 最大可加购数的上限，每个 pnk 的最大可加购数固定为 `1 ~ max_qty` 中的一个数
+
+    ---
+
+    任意类目名都能访问；pnk、TOP 标、评论数和最大可加购数都由类目、页码、序号决定，每次生成的结果相同
+    """
+
+    def __init__(
+        self,
+        products_per_page: int = 60,
+        promovat_per_page: int = 4,
+        pages: int = 5,
+        dialog: bool = True,
+        dialog_delay: int = 50,
+        reuse_dialog: bool = False,
+        max_qty: int = 50,
+    ) -> None:
+        self.products_per_page = products_per_page
+        self.promovat_per_page = promovat_per_page
+        self.pages = pages
+        self.dialog = dialog
+        self.dialog_delay = dialog_delay
+        self.reuse_dialog = reuse_dialog
+        self.max_qty = max_qty
+
+    @staticmethod
+    def pnk(category: str, page: int, index: int) -> str:
+        """第 `index` 个产品（从 0 开始，Promovat 为负数）的 pnk"""
+        n = crc32(f'{category}/{page}/{index}'.encode()) * 97 + page * 1000 + index
+        digits = list()
+        while n > 0:
+            n, r = divmod(n, len(_PNK_ALPHABET))
+            digits.append(_PNK_ALPHABET[r])
+        return ('D' + ''.join(reversed(digits))).rjust(9, 'D')[-9:]
+
+    def pnks(self, category: str, page: int) -> list[str]:
+        """产品列表页上非 Promovat 产品的 pnk（下标 + 1 即为 rank）"""
+        return [self.pnk(category, page, i) for i in range(self.products_per_page)]
+
+    def expected_qty(self, pnk: str) -> int:
+        return crc32(pnk.encode()) % self.max_qty + 1
+
+    def render_list_page(self, category: str, page: int, add_cart_path: str) -> Optional[bytes]:
+        if not 1 <= page <= self.pages:
+            return None
+
+        cards = list()
+        promovat_every = max(self.products_per_page // max(self.promovat_per_page, 1), 1)
+        promovat_index = 0
+        for i, pnk in enumerate(self.pnks(category, page)):
+            if promovat_index < self.promovat_per_page and i % promovat_every == 0:
+                promovat_index += 1
+                cards.append(
+                    self._card(self.pnk(category, page, -promovat_index), add_cart_path, promovat=True)
+                )
+            cards.append(self._card(pnk, add_cart_path))
+
+        script_vars = {
+            'dialog': json.dumps(self.dialog),
+            'dialog_delay': self.dialog_delay,
+            'reuse_dialog': json.dumps(self.reuse_dialog),
+        }
+        html = (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>{escape(category)} - p{page}</title></head><body>'
+            '<div class="gdpr-cookie-banner">Cookies</div>'
+            f'<div class="card-collection">{"".join(cards)}</div>'
+            f'<script>{_LIST_PAGE_JS % script_vars}</script>'
+            '</body></html>'
+        )
+        return html.encode()
+
+    def _card(self, pnk: str, add_cart_path: str, promovat: bool = False) -> str:
+        h = crc32(pnk.encode())
+        badge = (
+            '<div class="card-v2-badge-cmp-holder"><span class="card-v2-badge-cmp">Promovat</span></div>'
+            if promovat
+            else ''
+        )
+        top_favorite = '<span>Top Favorite</span>' if h % 5 == 0 else ''
+        review = (
+            f'<div class="star-rating-text "><span class="visible-xs-inline-block ">({h % 500})</span></div>'
+            if h % 3 != 0
+            else ''
+        )
+        return (
+            '<div class="card-item js-product-data"><div class="card-v2-wrapper">'
+            f'{badge}{top_favorite}<a href="/-/pd/{pnk}/">{pnk}</a>{review}'
+            f'<form action="{add_cart_path}" method="post">'
+            f'<input type="hidden" name="pnk" value="{pnk}">'
+            f'<button type="submit" class="btn yeahIWantThisProduct" data-pnk="{pnk}">Adauga in Cos</button>'
+            '</form></div></div>'
+        )
+
+    def render_cart_lines(self, cart: dict[str, int]) -> str:
+        return ''.join(
+            f'<div class="cart-widget cart-line" data-pnk="{pnk}">'
+            f'<a href="/-/pd/{pnk}/">{pnk}</a>'
+            f'<div data-phino="Qty"><input type="number" value="{count}" max="{self.expected_qty(pnk)}"></div>'
+            '<button type="button" class="remove-product">Sterge</button>'
+            '</div>'
+            for pnk, count in cart.items()
+        )
+
+    def render_cart_page(self) -> bytes:
+        html = (
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Cos</title></head><body>'
+            '<div id="vendors"></div>'
+            f'<script>{_CART_PAGE_JS}</script>'
+            '</body></html>'
+        )
+        return html.encode()
+
+    def cart_payload(self, name: str, cart: dict[str, int]) -> Optional[dict[str, Any]]:
+        """购物车接口 `name` 的响应"""
+        if name == 'cart/render-vendors':
+            return {'status': 'success', 'html': self.render_cart_lines(cart)}
+        if name == 'shopping/header-cart':
+            return {
+                'status': 'success',
+                'data': {
+                    'products': [
+                        {'url': f'/-/pd/{pnk}/', 'quantity': count, 'max_quantity': self.expected_qty(pnk)}
+                        for pnk, count in cart.items()
+                    ]
+                },
+            }
+        if name == 'cart/get-totals':
+            return {'status': 'success', 'data': {'count': sum(cart.values())}}
+        return None
@@ -0,0 +1,273 @@
+"""本地 eMAG 替身服务器（用于离线调试）"""
+
+from __future__ import annotations
+
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import re
+from threading import Lock, Thread
+from time import sleep
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl
+from uuid import uuid4
+
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.page_handlers.cart_api_reader import CART_QTY_ROUTES
+
+if TYPE_CHECKING:
+    from re import Pattern
+    from typing import Optional, Union
+
+    from emag_stock_monitor.standin_catalog import SyntheticCatalog
+
+
+_LIST_PAGE_PATH = re.compile(r'^/(?P<category>[^/]+)/(?:p(?P<page>\d+)/)?c/?$')
+"""产品列表页路径 /{category}/c 或 /{category}/p{page}/c"""
+
+_CART_PAGE_PATH = '/cart/products'
+"""购物车页路径"""
+
+_CART_REMOVE_PATH = '/cart/remove'
+"""模拟类目的删除购物车产品接口"""
+
+_SESSION_COOKIE = 'standin_session'
+"""替身服务器用来区分购物车的 cookie"""
+
+_PRODUCT_FIELDS = ('pnk', 'product[]', 'product_id')
+"""加购表单中表示产品的字段，按顺序取第一个存在的"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StandinServer
+
+    def log_message(self, format: str, *args) -> None:
+        logger.opt(lazy=True).debug('替身服务器 {} {}', self.address_string, lambda: format % args)
+
+    def send_body(
+        self, body: bytes, content_type: str, status: int = 200, headers: Optional[dict[str, str]] = None
+    ) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or dict()).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload: object, status: int = 200, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_body(json.dumps(payload).encode(), 'application/json', status=status, headers=headers)
+
+    def session_id(self) -> tuple[str, dict[str, str]]:
+        """从 cookie 中取出会话（购物车）id，没有则新建一个，并返回需要额外发送的响应头"""
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        if _SESSION_COOKIE in cookie:
+            return cookie[_SESSION_COOKIE].value, dict()
+        session_id = uuid4().hex
+        return session_id, {'Set-Cookie': f'{_SESSION_COOKIE}={session_id}; Path=/'}
+
+    def read_form(self) -> list[tuple[str, str]]:
+        length = int(self.headers.get('Content-Length', 0))
+        return parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True)
+
+    def do_GET(self) -> None:
+        if self.server.latency > 0:
+            sleep(self.server.latency)
+
+        path = self.path.split('?', 1)[0]
+        match = _LIST_PAGE_PATH.match(path)
+        if match is not None:
+            html = self.server.list_page_html(match['category'], int(match['page'] or 1))
+            if html is not None:
+                # 和真实站点一样，打开页面时就分配会话
+                _, headers = self.session_id()
+                self.send_body(html, 'text/html; charset=utf-8', headers=headers)
+                return
+
+        if path.rstrip('/') == _CART_PAGE_PATH:
+            html = self.server.cart_page_html()
+            if html is not None:
+                _, headers = self.session_id()
+                self.send_body(html, 'text/html; charset=utf-8', headers=headers)
+                return
+
+        if self.send_recorded(path) or self.send_cart_payload(path):
+            return
+
+        self.send_body(b'Not Found', 'text/plain; charset=utf-8', status=404)
+
+    def send_recorded(self, path: str) -> bool:
+        """返回录制下来的接口响应，没有录制时返回 `False`"""
+        payload = self.server.fixture_bytes(f'recorded/{path.strip("/")}.json')
+        if payload is None:
+            return False
+        self.send_body(payload, 'application/json')
+        return True
+
+    def send_cart_payload(self, path: str) -> bool:
+        """返回模拟类目的购物车接口响应，不是购物车接口或没有模拟类目时返回 `False`"""
+        catalog = self.server.catalog
+        if catalog is None:
+            return False
+        session_id, headers = self.session_id()
+        payload = catalog.cart_payload(path.strip('/'), self.server.cart_of(session_id))
+        if payload is None:
+            return False
+        self.send_json(payload, headers=headers)
+        return True
+
+    def do_POST(self) -> None:
+        if self.server.latency > 0:
+            sleep(self.server.latency)
+
+        path = self.path.split('?', 1)[0]
+        if path == self.server.add_cart_path:
+            session_id, headers = self.session_id()
+            fields = self.read_form()
+            key = self.server.add_to_cart(session_id, fields)
+            if key is None:
+                self.send_json({'status': 'error', 'message': 'missing product'}, status=400, headers=headers)
+            else:
+                self.send_json({'status': 'success', 'pnk': key}, headers=headers)
+            return
+
+        if path == _CART_REMOVE_PATH:
+            session_id, headers = self.session_id()
+            pnk = dict(self.read_form()).get('pnk', '')
+            self.server.remove_from_cart(session_id, pnk)
+            self.send_json({'status': 'success', 'pnk': pnk}, headers=headers)
+            return
+
+        # 购物车页的接口有的是 POST
+        self.read_form()
+        if self.send_recorded(path) or self.send_cart_payload(path):
+            return
+
+        self.send_body(b'Not Found', 'text/plain; charset=utf-8', status=404)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    本地 eMAG 替身服务器
+
+    ---
+
+    * `fixtures_dir`: 保存下来的页面所在目录
+        * 产品列表页放在 `{fixtures_dir}/{category}/p{page}.html`
+        * 购物车页放在 `{fixtures_dir}/cart/products.html`
+        * 录制的接口响应放在 `{fixtures_dir}/recorded/{接口路径}.json`，如 `recorded/cart/get-totals.json`
+    * `latency`: 每个请求额外延迟的秒数
+    * `host` / `port`: 监听地址，`port=0` 时随机选择空闲端口
+    * `add_cart_path`: 加购接口路径，按 cookie 区分购物车
+    * `catalog`: 模拟类目，没有对应的保存页面时由它生成产品列表页、购物车页和购物车接口的响应
+
+    ---
+
+    ```python
+    with StandinServer('fixtures') as server:
+        url = build_list_page_url('jocuri-societate', 2, base_url=server.base_url)
+    ```
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        fixtures_dir: Optional[Union[str, Path]] = None,
+        latency: float = 0,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        add_cart_path: str = '/newaddtocart',
+        catalog: Optional[SyntheticCatalog] = None,
+    ) -> None:
+        if fixtures_dir is None and catalog is None:
+            raise ValueError('fixtures_dir 和 catalog 至少指定一个')
+        super().__init__((host, port), _Handler)
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir is not None else None
+        self.latency = latency
+        self.add_cart_path = add_cart_path
+        self.catalog = catalog
+        self.carts: dict[str, dict[str, int]] = dict()
+        self._carts_lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def cart_url(self) -> str:
+        return f'{self.base_url}{_CART_PAGE_PATH}'
+
+    @property
+    def cart_api_routes(self) -> dict[str, Pattern[str]]:
+        """替身服务器上的购物车接口（不限域名），可传给 `CartResponseReader` / `CartSession`"""
+        return {
+            k: re.compile(rf'^{re.escape(self.base_url)}/{re.escape(k)}(?:[/?].*)?$') for k in CART_QTY_ROUTES
+        }
+
+    def fixture_bytes(self, relative_path: str) -> Optional[bytes]:
+        """读取 `fixtures_dir` 下的文件，不存在（或跳出 `fixtures_dir`）时返回 `None`"""
+        if self.fixtures_dir is None:
+            return None
+        path = self.fixtures_dir.joinpath(relative_path).resolve()
+        if not path.is_relative_to(self.fixtures_dir.resolve()) or not path.is_file():
+            return None
+        return path.read_bytes()
+
+    def list_page_html(self, category: str, page: int) -> Optional[bytes]:
+        """读取保存下来的产品列表页，没有时由模拟类目生成"""
+        html = self.fixture_bytes(f'{category}/p{page}.html')
+        if html is None and self.catalog is not None:
+            html = self.catalog.render_list_page(category, page, self.add_cart_path)
+        return html
+
+    def cart_page_html(self) -> Optional[bytes]:
+        """读取保存下来的购物车页，没有时由模拟类目生成"""
+        html = self.fixture_bytes('cart/products.html')
+        if html is None and self.catalog is not None:
+            html = self.catalog.render_cart_page()
+        return html
+
+    def cart_of(self, session_id: str) -> dict[str, int]:
+        """`session_id` 的购物车（副本）"""
+        with self._carts_lock:
+            return dict(self.carts.get(session_id, dict()))
+
+    def remove_from_cart(self, session_id: str, key: str) -> None:
+        with self._carts_lock:
+            self.carts.get(session_id, dict()).pop(key, None)
+
+    def add_to_cart(self, session_id: str, fields: list[tuple[str, str]]) -> Optional[str]:
+        """把表单中的产品加到 `session_id` 的购物车，返回产品标识"""
+        form = dict(fields)
+        key = next((form[f] for f in _PRODUCT_FIELDS if form.get(f)), None)
+        if key is None:
+            return None
+        with self._carts_lock:
+            cart = self.carts.setdefault(session_id, dict())
+            cart[key] = cart.get(key, 0) + 1
+        return key
+
+    def start(self) -> None:
+        """在后台线程中启动"""
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'替身服务器已启动 {self.base_url}')
+
+    def stop(self) -> None:
+        """停止并释放端口"""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> StandinServer:
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop()
@@ -0,0 +1,87 @@
+"""测试用的替身服务器客户端：代替 Playwright 的 `APIRequestContext` 和购物车页的响应事件"""
+
+import asyncio
+from http.cookiejar import CookieJar
+import json
+from urllib.error import HTTPError, URLError
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+
+class StandinResponse:
+    """只有加购和购物车接口用到的 `Response` 属性"""
+
+    def __init__(self, url: str, status: int, body: bytes) -> None:
+        self.url = url
+        self.status = status
+        self.body = body
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    async def text(self) -> str:
+        return self.body.decode('utf-8')
+
+    async def json(self):
+        return json.loads(self.body)
+
+
+class StandinRequest:
+    """
+    用 urllib 请求替身服务器，带 cookie（即同一个购物车）
+
+    ---
+
+    请求在线程中发出，多个请求可以同时进行；`fetch_count` 为发出的请求数，`max_in_flight` 为同时进行的最大请求数；
+    连接失败时和 Playwright 一样抛出 `PlaywrightError`
+    """
+
+    def __init__(self) -> None:
+        self._opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.fetch_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _fetch(self, url: str, method: str, headers: dict, data) -> StandinResponse:
+        body = data.encode() if isinstance(data, str) else data
+        try:
+            with self._opener.open(Request(url, data=body, headers=headers or dict(), method=method)) as r:
+                return StandinResponse(url, r.status, r.read())
+        except HTTPError as e:
+            return StandinResponse(url, e.code, e.read())
+        except URLError as e:
+            raise PlaywrightError(f'请求 "{url}" 失败 {e}')
+
+    async def fetch(self, url: str, method: str = 'GET', headers=None, data=None, timeout=None):
+        self.fetch_count += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await asyncio.to_thread(self._fetch, url, method.upper(), headers, data)
+        finally:
+            self.in_flight -= 1
+
+    async def get(self, url: str, **kwargs) -> StandinResponse:
+        return await self.fetch(url, 'GET', **kwargs)
+
+    async def post(self, url: str, **kwargs) -> StandinResponse:
+        return await self.fetch(url, 'POST', **kwargs)
+
+
+class StandinPage:
+    """只有 `on` / `remove_listener` 的页面，`emit` 把替身服务器的响应当作页面上的响应事件发出"""
+
+    def __init__(self) -> None:
+        self._listeners: dict[str, list] = dict()
+
+    def on(self, event: str, listener) -> None:
+        self._listeners.setdefault(event, list()).append(listener)
+
+    def remove_listener(self, event: str, listener) -> None:
+        self._listeners.get(event, list()).remove(listener)
+
+    def emit(self, event: str, *args) -> None:
+        for listener in list(self._listeners.get(event, ())):
+            listener(*args)
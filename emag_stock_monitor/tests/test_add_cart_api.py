@@ -0,0 +1,118 @@
+"""`page_handlers.add_cart_api` 的测试"""
+
+import asyncio
+
+import pytest
+
+from emag_stock_monitor.page_handlers.add_cart_api import (
+    AddCartForm,
+    add_to_cart_by_api,
+    is_add_cart_confirmed,
+    parse_add_cart_forms,
+)
+from emag_stock_monitor.page_handlers.list_page_http import parse_list_page
+from emag_stock_monitor.retry import HostRateLimiter
+from emag_stock_monitor.standin_catalog import SyntheticCatalog
+from emag_stock_monitor.standin_server import StandinServer
+from emag_stock_monitor.tests.standin_client import StandinRequest
+
+PNK = 'D5ABCDEFG'
+
+
+@pytest.mark.parametrize(
+    'payload',
+    [
+        {'status': 'success', 'pnk': PNK},
+        {'status': 'OK'},
+        {'success': True},
+        {'data': {'products': [{'url': f'/-/pd/{PNK}/'}]}},
+    ],
+)
+def test_confirmed(payload):
+    assert is_add_cart_confirmed(payload, PNK)
+
+
+@pytest.mark.parametrize(
+    'payload',
+    [
+        {'status': 'error', 'pnk': PNK},
+        {'status': 'failed', 'data': {'pnk': PNK}},
+        {'error': 'Stoc insuficient', 'pnk': PNK},
+        {'errors': ['limit'], 'pnk': PNK},
+        {'success': False, 'pnk': PNK},
+    ],
+)
+def test_error_payload_is_not_confirmed(payload):
+    assert not is_add_cart_confirmed(payload, PNK)
+
+
+@pytest.mark.parametrize(
+    'payload',
+    [
+        None,
+        [PNK],
+        'success',
+        {'status': 'true'},
+        {'data': {'products': [{'url': '/-/pd/D5ZZZZZZZ/'}]}},
+        {PNK: 1},
+    ],
+)
+def test_unrelated_payload_is_not_confirmed(payload):
+    assert not is_add_cart_confirmed(payload, PNK)
+
+
+def test_parse_add_cart_forms_from_standin_page():
+    catalog = SyntheticCatalog(products_per_page=6, promovat_per_page=2)
+    html = catalog.render_list_page('jocuri', 1, '/newaddtocart').decode()
+    forms = parse_add_cart_forms(html, 'http://127.0.0.1:8000/jocuri/p1/c')
+    assert list(forms) == catalog.pnks('jocuri', 1)
+    form = forms[catalog.pnk('jocuri', 1, 0)]
+    assert form.action == 'http://127.0.0.1:8000/newaddtocart'
+    assert form.method.lower() == 'post'
+    assert ('pnk', form.pnk) in form.fields
+
+
+class CountingLimiter(HostRateLimiter):
+    def __init__(self) -> None:
+        super().__init__(rate=1000, burst=1000)
+        self.urls: list[str] = list()
+
+    async def acquire(self, url: str) -> None:
+        self.urls.append(url)
+        await super().acquire(url)
+
+
+def test_add_to_cart_by_api_through_standin():
+    catalog = SyntheticCatalog(products_per_page=12, promovat_per_page=2)
+    with StandinServer(catalog=catalog, latency=0.02) as server:
+        request = StandinRequest()
+        limiter = CountingLimiter()
+        list_url = f'{server.base_url}/jocuri/c'
+
+        async def main():
+            # 先打开产品列表页拿到会话 cookie，与浏览器里一样
+            html = await (await request.get(list_url)).text()
+            products = parse_list_page(html, list_url)
+            forms = parse_add_cart_forms(html, list_url)
+            # 被拒绝的加购（替身服务器对缺少产品字段的表单返回 400）、没有表单的产品、请求失败的产品
+            rejected, missing, unreachable = products[-3:]
+            forms[rejected.pnk] = AddCartForm(
+                rejected.pnk, forms[rejected.pnk].action, fields=[('quantity', '1')]
+            )
+            del forms[missing.pnk]
+            forms[unreachable.pnk] = AddCartForm(unreachable.pnk, 'http://127.0.0.1:9/newaddtocart')
+            # 重复的产品只提交一次
+            added = await add_to_cart_by_api(
+                request, products + products[:2], forms, concurrency=3, limiter=limiter
+            )
+            return products, added
+
+        products, added = asyncio.run(main())
+        carts = list(server.carts.values())
+
+    assert [p.pnk for p in added] == [p.pnk for p in products[:-3]]
+    assert len(carts) == 1
+    assert carts[0] == {p.pnk: 1 for p in products[:-3]}
+    # 有表单的产品各取一次令牌，同时进行的请求不超过 concurrency
+    assert len(limiter.urls) == len(products) - 1
+    assert 1 < request.max_in_flight <= 3
@@ -0,0 +1,147 @@
+"""`asset_cache` 的缓存键、过期时间与 LRU 淘汰（不启动浏览器，直接调用读写方法）"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from emag_stock_monitor import asset_cache
+from emag_stock_monitor.asset_cache import AssetCache
+
+URL = 'https://s13emagst.akamaized.net/layout/ro/static-upload/app.js?v=1'
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(asset_cache, 'time', lambda: now[0])
+    return now
+
+
+def store(cache: AssetCache, url: str, body: bytes, expires=None) -> str:
+    key = cache.cache_key('GET', url)
+    cache._store(key, url, 200, {'content-type': 'text/javascript'}, body, expires)
+    return key
+
+
+def test_cache_key():
+    key = AssetCache.cache_key('GET', URL)
+    assert len(key) == 64
+    assert key == AssetCache.cache_key('GET', URL)
+    assert key != AssetCache.cache_key('HEAD', URL)
+    assert key != AssetCache.cache_key('GET', URL.replace('v=1', 'v=2'))
+
+
+@pytest.mark.parametrize(
+    'cache_control, expected',
+    [
+        ('public, max-age=3600', 1000 + 3600),
+        ('max-age=0', 1000),
+        ('public, max-age=31536000, immutable', None),
+        ('', None),
+    ],
+)
+def test_expires_at(cache_control, expected):
+    assert AssetCache.expires_at({'cache-control': cache_control}, 1000) == expected
+
+
+@pytest.mark.parametrize('cache_control', ['no-store', 'private, max-age=60', 'No-Cache'])
+def test_expires_at_not_cacheable(cache_control):
+    with pytest.raises(ValueError):
+        AssetCache.expires_at({'cache-control': cache_control}, 1000)
+
+
+def test_is_cacheable_request(tmp_path):
+    cache = AssetCache(tmp_path)
+    assert cache.is_cacheable_request('GET', URL, 'script')
+    assert cache.is_cacheable_request('GET', 'https://www.emag.ro/a.css', 'stylesheet')
+    assert not cache.is_cacheable_request('POST', URL, 'script')
+    assert not cache.is_cacheable_request('GET', URL, 'image')
+    assert not cache.is_cacheable_request('GET', 'https://notemag.ro/a.js', 'script')
+    cache.close()
+
+
+def test_store_and_load(tmp_path, clock):
+    cache = AssetCache(tmp_path)
+    key = store(cache, URL, b'console.log(1)')
+
+    meta, body = cache._load(key)
+    assert body == b'console.log(1)'
+    assert meta == {'url': URL, 'status': 200, 'headers': {'content-type': 'text/javascript'}}
+    assert cache.size == len(body)
+    # 临时文件都已改名
+    assert list(tmp_path.rglob('*.tmp')) == []
+
+    # 同一 key 再次写入时覆盖
+    store(cache, URL, b'console.log(2)')
+    assert cache._load(key)[1] == b'console.log(2)'
+    assert cache.size == len(b'console.log(2)')
+    cache.close()
+
+
+def test_expired_entry_is_deleted(tmp_path, clock):
+    cache = AssetCache(tmp_path)
+    key = store(cache, URL, b'x' * 10, expires=clock[0] + 60)
+
+    clock[0] += 60
+    assert cache._load(key) is not None
+    clock[0] += 1
+    assert cache._load(key) is None
+    assert cache.size == 0
+    assert [p for p in tmp_path.rglob('*') if p.is_file() and p.name != 'index.db'] == []
+    cache.close()
+
+
+def test_missing_files_are_dropped_from_index(tmp_path, clock):
+    cache = AssetCache(tmp_path)
+    key = store(cache, URL, b'x' * 10)
+    cache._paths(key)[0].unlink()
+
+    assert cache._load(key) is None
+    assert cache.size == 0
+    cache.close()
+
+
+def test_lru_eviction(tmp_path, clock):
+    cache = AssetCache(tmp_path, max_bytes=250)
+    a = store(cache, 'https://www.emag.ro/a.js', b'a' * 100)
+    clock[0] += 1
+    b = store(cache, 'https://www.emag.ro/b.js', b'b' * 100)
+    clock[0] += 1
+    # 访问 a 之后 b 成为最久未访问的
+    assert cache._load(a) is not None
+    clock[0] += 1
+    c = store(cache, 'https://www.emag.ro/c.js', b'c' * 100)
+
+    assert cache.evictions == 1
+    assert cache.size == 200
+    assert cache._load(b) is None
+    assert not any(p.exists() for p in cache._paths(b))
+    assert cache._load(a)[1] == b'a' * 100
+    assert cache._load(c)[1] == b'c' * 100
+
+    # 淘汰到上限的 90%
+    clock[0] += 1
+    store(cache, 'https://www.emag.ro/d.js', b'd' * 200)
+    assert cache.evictions == 3
+    assert cache.size == 200
+    cache.close()
+
+
+def test_concurrent_stores_of_same_key(tmp_path):
+    cache = AssetCache(tmp_path)
+    key = cache.cache_key('GET', URL)
+
+    def work(i: int) -> None:
+        body = str(i).encode() * 1000
+        cache._store(key, URL, 200, {'x-version': str(i)}, body, None)
+        cache._load(key)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(work, range(64)))
+
+    # body 与 meta 来自同一次写入，索引中的大小与文件一致
+    meta, body = cache._load(key)
+    assert body == meta['headers']['x-version'].encode() * 1000
+    assert cache.size == len(body)
+    assert list(tmp_path.rglob('*.tmp')) == []
+    cache.close()
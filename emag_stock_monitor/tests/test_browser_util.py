@@ -0,0 +1,92 @@
+"""`browser_util.RequestFilter` 的屏蔽规则"""
+
+import asyncio
+
+import pytest
+
+from emag_stock_monitor.browser_util import RequestFilter
+
+CART_URL = 'http://127.0.0.1:8000/cart/products'
+LIST_URL = 'http://127.0.0.1:8000/jocuri/c'
+
+
+class FakeFrame:
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+
+class FakeRequest:
+    def __init__(self, url: str, resource_type: str, frame_url: str, navigation: bool = False) -> None:
+        self.url = url
+        self.resource_type = resource_type
+        self.frame = FakeFrame(frame_url)
+        self._navigation = navigation
+
+    def is_navigation_request(self) -> bool:
+        return self._navigation
+
+
+class FakeRoute:
+    def __init__(self, request: FakeRequest) -> None:
+        self.request = request
+        self.action = None
+
+    async def fallback(self) -> None:
+        self.action = 'fallback'
+
+    async def abort(self) -> None:
+        self.action = 'abort'
+
+
+def handle(request_filter: RequestFilter, request: FakeRequest) -> str:
+    route = FakeRoute(request)
+    asyncio.run(request_filter._handle(route))
+    return route.action
+
+
+@pytest.mark.parametrize(
+    'url, expected',
+    [
+        ('https://www.googletagmanager.com/gtm.js', 'www.googletagmanager.com'),
+        ('https://sub.connect.facebook.net/en_US/fbevents.js', 'connect.facebook.net'),
+        ('https://www.emag.ro/jocuri/c', None),
+    ],
+)
+def test_match_track(url, expected):
+    assert RequestFilter().match_track(url) == expected
+
+
+def test_resource_types_by_page():
+    request_filter = RequestFilter(
+        list_page_resource_types=('image', 'stylesheet'),
+        cart_page_resource_types=('image',),
+        cart_url=CART_URL,
+    )
+    assert (
+        handle(request_filter, FakeRequest('http://127.0.0.1:8000/a.css', 'stylesheet', LIST_URL)) == 'abort'
+    )
+    assert (
+        handle(request_filter, FakeRequest('http://127.0.0.1:8000/a.css', 'stylesheet', CART_URL))
+        == 'fallback'
+    )
+    assert handle(request_filter, FakeRequest('http://127.0.0.1:8000/a.png', 'image', CART_URL)) == 'abort'
+    assert request_filter.stats() == {
+        'blocked_requests': 2,
+        'passed_requests': 1,
+        'blocked': {'stylesheet': 1, 'image': 1},
+        'blocked_by_type': {'stylesheet': 1, 'image': 1},
+    }
+
+
+def test_navigation_uses_request_url():
+    request_filter = RequestFilter(
+        list_page_resource_types=('document',), cart_page_resource_types=(), cart_url=CART_URL
+    )
+    # 从产品列表页导航到购物车页时 frame 还是产品列表页
+    navigation = FakeRequest(CART_URL, 'document', LIST_URL, navigation=True)
+    assert request_filter.is_cart_page_request(navigation)
+    assert handle(request_filter, navigation) == 'fallback'
+    # 反过来从购物车页导航到产品列表页
+    navigation = FakeRequest(LIST_URL, 'document', CART_URL, navigation=True)
+    assert not request_filter.is_cart_page_request(navigation)
+    assert handle(request_filter, navigation) == 'abort'
@@ -0,0 +1,129 @@
+"""`captcha` 的验证码判断与熔断器"""
+
+import asyncio
+
+import pytest
+
+from emag_stock_monitor.captcha import CircuitBreaker, is_captcha_response
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.retry import HostRateLimiter, RetryPolicy
+
+
+def error(n: int = 0) -> CaptchaError:
+    return CaptchaError(f'https://www.emag.ro/c{n}', 511, '验证码')
+
+
+@pytest.mark.parametrize(
+    'url, status, expected',
+    [
+        ('https://www.emag.ro/jocuri/c', 511, True),
+        ('https://emag.ro/cart/products', 511, True),
+        ('https://challenges.cloudflare.com/cdn-cgi/x', 401, True),
+        ('https://www.emag.ro/jocuri/c', 401, False),
+        ('https://notemag.ro/c', 511, False),
+        ('https://www.emag.ro/jocuri/c', 429, False),
+    ],
+)
+def test_is_captcha_response(url, status, expected):
+    assert is_captcha_response(url, status) is expected
+
+
+def test_trip_pauses_and_recovers():
+    async def run() -> None:
+        trips = list()
+        breaker = CircuitBreaker(base_delay=0.05, on_trip=trips.append)
+        assert not breaker.is_open
+        await breaker.wait()
+
+        breaker.trip(error(1))
+        # 暂停中再次熔断只记录错误
+        breaker.trip(error(2))
+        assert breaker.is_open
+        assert breaker.trips == 1 and len(trips) == 1
+        assert breaker.last_error.url.endswith('c2')
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await breaker.wait()
+        assert loop.time() - start >= 0.04
+        assert not breaker.is_open
+
+    asyncio.run(run())
+
+
+def test_half_open_trip_doubles_delay_until_success():
+    async def run() -> None:
+        breaker = CircuitBreaker(base_delay=0.05)
+        breaker.trip(error())
+        await breaker.wait()
+
+        # 恢复后还没有成功就再次熔断，连续次数累加，暂停时间翻倍
+        breaker.trip(error())
+        assert breaker.consecutive_trips == 2
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await breaker.wait()
+        assert loop.time() - start >= 0.09
+
+        # 恢复后处理成功，连续次数清零
+        breaker.record_success()
+        assert breaker.consecutive_trips == 0
+        breaker.trip(error())
+        assert breaker.consecutive_trips == 1
+        await breaker.wait()
+
+    asyncio.run(run())
+
+
+def test_record_success_while_open_is_ignored():
+    async def run() -> None:
+        breaker = CircuitBreaker(base_delay=0.05)
+        breaker.trip(error())
+        breaker.record_success()
+        assert breaker.consecutive_trips == 1
+        await breaker.wait()
+
+    asyncio.run(run())
+
+
+def test_wait_raises_when_exhausted():
+    async def run() -> None:
+        breaker = CircuitBreaker(base_delay=0.01, max_trips=1)
+        breaker.trip(error(1))
+        await breaker.wait()
+        # 恢复后没有成功就再次熔断，超过 max_trips，不再恢复
+        breaker.trip(error(2))
+        assert breaker.exhausted
+        with pytest.raises(CaptchaError) as e:
+            await asyncio.wait_for(breaker.wait(), timeout=1)
+        assert e.value.url.endswith('c2')
+
+    asyncio.run(run())
+
+
+def test_limiter_pauses_in_flight_calls():
+    async def run() -> list[str]:
+        breaker = CircuitBreaker(base_delay=0.1)
+        limiter = HostRateLimiter(rate=1000, burst=1000, breaker=breaker)
+        policy = RetryPolicy(attempts=1)
+        events: list[str] = list()
+
+        async def request() -> None:
+            events.append('request')
+
+        async def click() -> None:
+            events.append('click')
+
+        breaker.trip(error())
+        tasks = [
+            asyncio.create_task(
+                policy.call('page_load', request, url='https://www.emag.ro/c', limiter=limiter)
+            ),
+            asyncio.create_task(policy.call('add_to_cart', click, limiter=limiter)),
+        ]
+        await asyncio.sleep(0.05)
+        events.append('still paused')
+        await asyncio.gather(*tasks)
+        return events
+
+    assert asyncio.run(run()) == ['still paused', 'request', 'click']
@@ -0,0 +1,193 @@
+"""`page_handlers.cart_api_reader` 与购物车接口数据的核对"""
+
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from emag_stock_monitor.models import Product
+from emag_stock_monitor.page_handlers.cart_api_reader import (
+    CartResponseReader,
+    parse_cart_payload,
+    parse_max_qty,
+)
+from emag_stock_monitor.page_handlers.cart_page import CartSession, build_pnk_qty_map, reconcile_pnk_qty
+from emag_stock_monitor.standin_catalog import SyntheticCatalog
+from emag_stock_monitor.standin_server import StandinServer
+from emag_stock_monitor.tests.standin_client import StandinPage, StandinRequest
+
+RECORDED = Path(__file__).parent.joinpath('fixtures', 'recorded')
+PNKS = ['D5ABCDEFG', 'DGH2K7M8B', 'DZQ1W4R6T']
+EXPECTED = {'D5ABCDEFG': '3', 'DGH2K7M8B': '10', 'DZQ1W4R6T': '2'}
+
+
+def load(name: str):
+    return json.loads(RECORDED.joinpath(f'{name}.json').read_text(encoding='utf-8'))
+
+
+@pytest.mark.parametrize('name', ['cart/render-vendors', 'shopping/header-cart'])
+def test_recorded_payload(name):
+    lines = parse_cart_payload(name, load(name))
+    assert build_pnk_qty_map(lines, PNKS) == EXPECTED
+
+
+def test_get_totals_has_no_lines():
+    assert parse_cart_payload('cart/get-totals', load('cart/get-totals')) == []
+
+
+def test_standin_payloads_match_catalog():
+    catalog = SyntheticCatalog()
+    cart = {catalog.pnk('jocuri', 1, i): 1 for i in range(5)}
+    expected = {pnk: str(catalog.expected_qty(pnk)) for pnk in cart}
+    for name in ('cart/render-vendors', 'shopping/header-cart'):
+        lines = parse_cart_payload(name, catalog.cart_payload(name, cart))
+        assert build_pnk_qty_map(lines, list(cart)) == expected
+
+
+@pytest.mark.parametrize(
+    'name, payload',
+    [
+        # 只认固定路径上的字段，其他看起来像产品的对象不算
+        ('shopping/header-cart', {'data': {'items': [{'url': '/-/pd/D5ABCDEFG/', 'max_quantity': 3}]}}),
+        ('shopping/header-cart', {'data': {'products': [{'pnk': 'D5ABCDEFG', 'max': 3}]}}),
+        ('shopping/header-cart', {'products': [{'url': '/-/pd/D5ABCDEFG/', 'max_quantity': 3}]}),
+        ('cart/render-vendors', {'data': '<div class="cart-widget cart-line"></div>'}),
+        ('cart/get-notifications', {'html': '<div class="cart-widget cart-line"></div>'}),
+        ('shopping/header-cart', None),
+        ('shopping/header-cart', ['D5ABCDEFG']),
+    ],
+)
+def test_unknown_schema_has_no_lines(name, payload):
+    assert build_pnk_qty_map(parse_cart_payload(name, payload), PNKS) == {}
+
+
+@pytest.mark.parametrize(
+    'value, expected',
+    [(3, '3'), ('12', '12'), (0, None), (-1, None), ('', None), ('3.5', None), (True, None)],
+)
+def test_parse_max_qty(value, expected):
+    assert parse_max_qty(value) == expected
+
+
+def test_invalid_max_quantity_is_none():
+    payload = {'data': {'products': [{'url': '/-/pd/D5ABCDEFG/', 'max_quantity': 'n/a'}]}}
+    assert build_pnk_qty_map(parse_cart_payload('shopping/header-cart', payload), PNKS) == {'D5ABCDEFG': None}
+
+
+def test_reconcile_prefers_dom():
+    api_qty = {'D5ABCDEFG': '3', 'DGH2K7M8B': '10', 'DZQ1W4R6T': '2'}
+    dom_qty = {'D5ABCDEFG': '3', 'DGH2K7M8B': '7', 'DZQ1W4R6T': None}
+    assert reconcile_pnk_qty(api_qty, dom_qty) == {'D5ABCDEFG': '3', 'DGH2K7M8B': '7', 'DZQ1W4R6T': '2'}
+
+
+def test_build_pnk_qty_map_prefers_line_with_max():
+    lines = [
+        (['https://www.emag.ro/joc/pd/D5ABCDEFG/'], None),
+        (['/-/pd/D5ABCDEFG/'], '4'),
+        (['/-/pd/DGH2K7M8B/?ref=cart'], None),
+        (['/x/pd/DGH2K7M8B/?ref=cart'], '6'),
+    ]
+    assert build_pnk_qty_map(lines, ['D5ABCDEFG', 'DGH2K7M8B']) == {'D5ABCDEFG': '4', 'DGH2K7M8B': '6'}
+
+
+def test_cart_session_skips_empty_batch():
+    class Context:
+        def new_page(self):
+            raise AssertionError('空的一批不应打开购物车页')
+
+    assert asyncio.run(CartSession(Context()).handle([], True)) == []
+
+
+class StandinCartPage(StandinPage):
+    """打开或刷新时像购物车页的脚本一样请求替身服务器的购物车接口，并把响应作为页面的响应事件发出"""
+
+    def __init__(self, server: StandinServer, request: StandinRequest) -> None:
+        super().__init__()
+        self.server = server
+        self.request = request
+        self.url = 'about:blank'
+
+    def is_closed(self) -> bool:
+        return False
+
+    async def goto(self, url: str, **_) -> None:
+        self.url = url
+        for name in ('shopping/header-cart', 'cart/get-totals', 'cart/render-vendors'):
+            self.emit('response', await self.request.post(f'{self.server.base_url}/{name}'))
+
+    async def reload(self, **_) -> None:
+        await self.goto(self.url)
+
+
+class StandinContext:
+    def __init__(self, page: StandinCartPage) -> None:
+        self.page = page
+
+    async def new_page(self) -> StandinCartPage:
+        return self.page
+
+
+def add_to_standin_cart(server: StandinServer, request: StandinRequest, pnks: list[str]) -> None:
+    async def add() -> None:
+        for pnk in pnks:
+            await request.post(f'{server.base_url}/newaddtocart', data=f'pnk={pnk}')
+
+    asyncio.run(add())
+
+
+@pytest.mark.parametrize('name', ['cart/render-vendors', 'shopping/header-cart'])
+def test_reader_collects_standin_responses(name):
+    catalog = SyntheticCatalog()
+    pnks = catalog.pnks('jocuri', 1)[:4]
+    with StandinServer(catalog=catalog) as server:
+        request = StandinRequest()
+        add_to_standin_cart(server, request, pnks)
+        page = StandinCartPage(server, request)
+        # 只监听一个接口，确认每个接口单独都能读到全部产品
+        routes = {name: server.cart_api_routes[name]}
+
+        async def read() -> tuple[bool, CartResponseReader]:
+            async with CartResponseReader(page, routes=routes) as reader:
+                await page.goto(server.cart_url)
+                complete = await reader.wait(
+                    lambda lines: len(build_pnk_qty_map(lines, pnks)) == len(pnks), timeout=2000
+                )
+            return complete, reader
+
+        complete, reader = asyncio.run(read())
+
+    assert complete
+    assert list(reader.payloads) == [name]
+    assert build_pnk_qty_map(reader.lines, pnks) == {pnk: str(catalog.expected_qty(pnk)) for pnk in pnks}
+
+
+def test_reader_times_out_without_products():
+    with StandinServer(catalog=SyntheticCatalog()) as server:
+        page = StandinCartPage(server, StandinRequest())
+
+        async def read() -> bool:
+            async with CartResponseReader(page, routes=server.cart_api_routes) as reader:
+                await page.goto(server.cart_url)
+                return await reader.wait(lambda lines: len(lines) > 0, timeout=100)
+
+        assert asyncio.run(read()) is False
+
+
+def test_cart_session_uses_complete_api_data_without_dom():
+    catalog = SyntheticCatalog()
+    pnks = catalog.pnks('jocuri', 1)[:3]
+    products = [Product(pnk, 'http://standin/jocuri/c', rank) for rank, pnk in enumerate(pnks, 1)]
+    with StandinServer(catalog=catalog) as server:
+        request = StandinRequest()
+        add_to_standin_cart(server, request, pnks)
+        # 页面没有 DOM 相关的方法，接口数据齐了时不应再读取页面
+        session = CartSession(
+            StandinContext(StandinCartPage(server, request)),
+            api_timeout=2000,
+            cart_url=server.cart_url,
+            api_routes=server.cart_api_routes,
+        )
+        result = asyncio.run(session.handle(products, need_clear_cart=False))
+
+    assert [(p.pnk, p.qty) for p in result] == [(pnk, catalog.expected_qty(pnk)) for pnk in pnks]
@@ -0,0 +1,128 @@
+"""`distributed` 的任务租约与去重（不启动队列服务和 worker 进程）"""
+
+import pytest
+
+from emag_stock_monitor import distributed
+from emag_stock_monitor.distributed import Coordinator, JobBoard
+from emag_stock_monitor.scheduler import Job
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [0.0]
+    monkeypatch.setattr(distributed, 'monotonic', lambda: now[0])
+    return now
+
+
+def job(page: int) -> dict:
+    return Job('jocuri-societate', page).as_dict()
+
+
+def key(page: int) -> str:
+    return Job('jocuri-societate', page).key
+
+
+def test_claim_in_order_and_timeout(clock):
+    board = JobBoard(lease_timeout=10)
+    board.put(job(1))
+    board.put(job(2))
+
+    assert board.claim('w0', timeout=0) == job(1)
+    assert board.claim('w1', timeout=0) == job(2)
+    assert board.claim('w0', timeout=0) is None
+    assert board.stats() == {'queued': 0, 'leased': 2}
+
+
+def test_heartbeat_extends_only_own_leases(clock):
+    board = JobBoard(lease_timeout=10)
+    board.put(job(1))
+    board.put(job(2))
+    board.claim('w0', timeout=0)
+    board.claim('w1', timeout=0)
+
+    clock[0] = 8
+    # w0 不能为 w1 的任务续约
+    board.heartbeat('w0', [key(1), key(2)])
+    clock[0] = 11
+    assert board.expire() == [(key(2), 'w1')]
+    assert board.stats() == {'queued': 0, 'leased': 1}
+
+    clock[0] = 18
+    assert board.expire() == []
+    clock[0] = 18.1
+    assert board.expire() == [(key(1), 'w0')]
+    # 过期的任务不会自动放回队列
+    assert board.stats() == {'queued': 0, 'leased': 0}
+
+
+def test_expire_worker_regardless_of_deadline(clock):
+    board = JobBoard(lease_timeout=10)
+    for page in (1, 2, 3):
+        board.put(job(page))
+    board.claim('w0', timeout=0)
+    board.claim('w1', timeout=0)
+    board.claim('w0', timeout=0)
+
+    assert sorted(board.expire('w0')) == [(key(1), 'w0'), (key(3), 'w0')]
+    assert board.stats() == {'queued': 0, 'leased': 1}
+
+
+def test_release(clock):
+    board = JobBoard(lease_timeout=10)
+    board.put(job(1))
+    board.claim('w0', timeout=0)
+
+    assert not board.release(key(1), 'w1')
+    assert board.release(key(1), 'w0')
+    # 已结束的租约不能再结束一次
+    assert not board.release(key(1), 'w0')
+
+    # 过期后原 worker 交回结果时租约已不属于它
+    board.put(job(2))
+    board.claim('w0', timeout=0)
+    clock[0] = 11
+    board.expire()
+    assert not board.release(key(2), 'w0')
+
+
+def test_discard_requeued_job(clock):
+    board = JobBoard(lease_timeout=10)
+    board.put(job(1))
+    board.put(job(2))
+    board.claim('w0', timeout=0)
+    clock[0] = 11
+    board.expire()
+    # 协调进程把过期的任务放回队列后，原 worker 又完成了它
+    board.put(job(1))
+    board.discard(key(1))
+
+    assert board.stats() == {'queued': 1, 'leased': 0}
+    assert board.claim('w1', timeout=0) == job(2)
+
+
+def test_dedupe(tmp_path):
+    coordinator = Coordinator(tmp_path / 'checkpoint.json')
+    p1, p2 = 'https://www.emag.ro/c/p1', 'https://www.emag.ro/c/p2'
+
+    products = coordinator._dedupe(
+        [
+            ('DAAAAAAAA', p1, 1, True, 10, 3),
+            ('DBBBBBBBB', p1, 2, False, None, None),
+            # 同一页面重复的产品
+            ('DAAAAAAAA', p1, 5, False, 10, 3),
+            # 不同页面的同一产品单独保留
+            ('DAAAAAAAA', p2, 1, False, 10, 3),
+        ]
+    )
+    assert [(p.pnk, p.source_url, p.rank) for p in products] == [
+        ('DAAAAAAAA', p1, 1),
+        ('DBBBBBBBB', p1, 2),
+        ('DAAAAAAAA', p2, 1),
+    ]
+    assert products[0].top_favorite and products[0].review_count == 10 and products[0].qty == 3
+    assert products[1].review_count is None and products[1].qty is None
+    assert coordinator.duplicates == 1
+
+    # 跨任务（后续消息）也去重
+    assert coordinator._dedupe([('DBBBBBBBB', p1, 2, False, None, None)]) == []
+    assert coordinator.duplicates == 2
@@ -0,0 +1,110 @@
+"""`history` 的测试"""
+
+from asyncio import run
+
+from pandas import DataFrame
+
+from emag_stock_monitor.history import HistorySink, HistoryStore, compute_rank_movement, compute_velocity
+from emag_stock_monitor.models import Product
+
+
+def _row(pnk: str, ts: float, qty: int, source_url: str = 'https://www.emag.ro/c/p1') -> dict:
+    return {
+        'pnk': pnk,
+        'source_url': source_url,
+        'ts': ts,
+        'rank': 1,
+        'top_favorite': False,
+        'review_count': None,
+        'qty': qty,
+    }
+
+
+def _assert_same_velocity(store: HistoryStore) -> None:
+    incremental = store.top_velocity(100).set_index('pnk')
+    vectorized = compute_velocity(store.load())
+    assert sorted(incremental.index) == sorted(vectorized.index)
+    for pnk, row in vectorized.iterrows():
+        assert incremental.loc[pnk, 'first_ts'] == row['first_ts']
+        assert incremental.loc[pnk, 'ts'] == row['last_ts']
+        assert incremental.loc[pnk, 'qty'] == row['last_qty']
+        assert incremental.loc[pnk, 'depletion'] == row['depletion']
+        assert incremental.loc[pnk, 'restock'] == row['restock']
+        assert abs(incremental.loc[pnk, 'velocity'] - row['velocity']) < 1e-9
+
+
+def test_velocity_single_batch_with_several_snapshots(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db')
+    # 一次 flush 中同一 pnk 有三个时刻的快照（顺序打乱）
+    store.ingest_rows([_row('AAAAAAAA1', 7200, 18), _row('AAAAAAAA1', 0, 20), _row('AAAAAAAA1', 3600, 5)])
+
+    df = store.top_velocity(10)
+    assert df.loc[0, 'first_ts'] == 0
+    assert df.loc[0, 'depletion'] == 15
+    assert df.loc[0, 'restock'] == 13
+    assert df.loc[0, 'velocity'] == 7.5
+    _assert_same_velocity(store)
+    store.close()
+
+
+def test_velocity_incremental_matches_vectorized(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db')
+    batches = [
+        [
+            _row('AAAAAAAA1', 0, 30),
+            _row('BBBBBBBB2', 0, 10),
+            _row('BBBBBBBB2', 0, 12, 'https://www.emag.ro/c/p2'),
+        ],
+        [_row('AAAAAAAA1', 1800, 25), _row('AAAAAAAA1', 3600, 40), _row('BBBBBBBB2', 3600, 4)],
+        [_row('AAAAAAAA1', 7200, 31), _row('CCCCCCCC3', 7200, 9)],
+    ]
+    for rows in batches:
+        store.ingest_rows(rows)
+    _assert_same_velocity(store)
+    store.close()
+
+
+def test_history_sink_stamps_push_time(tmp_path):
+    store = HistoryStore(tmp_path / 'history.db')
+    products = [
+        Product(pnk='AAAAAAAA1', source_url='https://www.emag.ro/c/p1', rank=1, qty=5),
+        Product(pnk='BBBBBBBB2', source_url='https://www.emag.ro/c/p1', rank=2, qty=3),
+    ]
+
+    async def main() -> None:
+        async with HistorySink(store, buffer_size=10) as sink:
+            await sink.push(products[:1])
+            await sink.push(products[1:])
+
+    run(main())
+    df = store.load()
+    assert sorted(df['pnk']) == ['AAAAAAAA1', 'BBBBBBBB2']
+    assert df['ts'].notna().all()
+    assert sorted(store.top_velocity(10)['pnk']) == ['AAAAAAAA1', 'BBBBBBBB2']
+    store.close()
+
+
+def test_rank_movement():
+    p1, p2 = 'https://www.emag.ro/c/p1', 'https://www.emag.ro/c/p2'
+    snapshots = DataFrame(
+        [
+            # 乱序输入，按 ts 取首末
+            {'pnk': 'AAAAAAAA1', 'source_url': p1, 'ts': 3600, 'rank': 2, 'review_count': 15},
+            {'pnk': 'AAAAAAAA1', 'source_url': p1, 'ts': 0, 'rank': 10, 'review_count': 5},
+            {'pnk': 'AAAAAAAA1', 'source_url': p1, 'ts': 1800, 'rank': 6, 'review_count': 8},
+            # 同一 pnk 在另一页面单独计算
+            {'pnk': 'AAAAAAAA1', 'source_url': p2, 'ts': 0, 'rank': 1, 'review_count': 5},
+            {'pnk': 'AAAAAAAA1', 'source_url': p2, 'ts': 3600, 'rank': 4, 'review_count': 15},
+            {'pnk': 'BBBBBBBB2', 'source_url': p1, 'ts': 0, 'rank': 3, 'review_count': 0},
+        ]
+    )
+
+    df = compute_rank_movement(snapshots)
+    assert list(df.index) == [('AAAAAAAA1', p1), ('BBBBBBBB2', p1), ('AAAAAAAA1', p2)]
+    assert df.loc[('AAAAAAAA1', p1), 'first_rank'] == 10
+    assert df.loc[('AAAAAAAA1', p1), 'last_rank'] == 2
+    assert df.loc[('AAAAAAAA1', p1), 'rank_change'] == 8
+    assert df.loc[('AAAAAAAA1', p1), 'review_growth'] == 10
+    assert df.loc[('AAAAAAAA1', p2), 'rank_change'] == -3
+    assert df.loc[('BBBBBBBB2', p1), 'rank_change'] == 0
+    assert df.loc[('BBBBBBBB2', p1), 'review_growth'] == 0
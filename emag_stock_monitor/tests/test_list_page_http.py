@@ -0,0 +1,57 @@
+"""`page_handlers.list_page_http` 对产品列表页的解析"""
+
+from pathlib import Path
+from zlib import crc32
+
+import pytest
+
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.page_handlers.list_page_http import parse_list_page
+from emag_stock_monitor.standin_catalog import SyntheticCatalog
+from emag_stock_monitor.standin_server import StandinServer
+
+PAGES = Path(__file__).parent.joinpath('fixtures', 'pages')
+
+
+def test_recorded_list_page():
+    html = PAGES.joinpath('jocuri-societate', 'p1.html').read_text(encoding='utf-8')
+    products = parse_list_page(html, 'https://www.emag.ro/jocuri-societate/c')
+    # 24 个产品中 2 个 Promovat、1 个只有"Vezi detalii"
+    assert len(products) == 21
+    assert [p.rank for p in products] == list(range(1, 22))
+    assert len({p.pnk for p in products}) == 21
+    assert sum(p.top_favorite for p in products) == 4
+    assert products[0].review_count == 707
+    assert sum(p.review_count is None for p in products) == 6
+
+
+def test_server_prefers_recorded_list_page():
+    with StandinServer(fixtures_dir=PAGES, catalog=SyntheticCatalog()) as server:
+        recorded = server.list_page_html('jocuri-societate', 1)
+        generated = server.list_page_html('jocuri-societate', 2)
+    assert recorded == PAGES.joinpath('jocuri-societate', 'p1.html').read_bytes()
+    assert generated is not None and generated != recorded
+
+
+def test_synthetic_list_page():
+    catalog = SyntheticCatalog(products_per_page=20, promovat_per_page=3)
+    html = catalog.render_list_page('jocuri', 2, '/newaddtocart').decode('utf-8')
+    products = parse_list_page(html, 'https://www.emag.ro/jocuri/p2/c')
+
+    # Promovat 产品不计入，rank 按普通产品的顺序
+    assert [p.pnk for p in products] == catalog.pnks('jocuri', 2)
+    assert [p.rank for p in products] == list(range(1, 21))
+    for p in products:
+        h = crc32(p.pnk.encode())
+        assert p.top_favorite == (h % 5 == 0)
+        assert p.review_count == (h % 500 if h % 3 != 0 else None)
+        assert p.source_url == 'https://www.emag.ro/jocuri/p2/c'
+
+
+def test_empty_list_page():
+    assert parse_list_page('<html><body><div class="card-collection"></div></body></html>', 'u') == []
+
+
+def test_captcha_page():
+    with pytest.raises(CaptchaError):
+        parse_list_page('<html><body class="captcha"><form></form></body></html>', 'u')
@@ -0,0 +1,194 @@
+"""`metrics` 的 Prometheus 导出、进程间汇总与 trace"""
+
+from asyncio import create_task, run
+import json
+import os
+import pickle
+
+import pytest
+
+from emag_stock_monitor.metrics import BUCKETS, Metrics
+
+
+def prometheus_lines(m: Metrics) -> list[str]:
+    return [line for line in m.to_prometheus().splitlines() if not line.startswith('#')]
+
+
+def test_prometheus_counters_and_type_lines():
+    m = Metrics(prefix='t')
+    m.count('retries', stage='click')
+    m.count('retries', 2, stage='click')
+    m.count('retries', stage='page_load')
+    m.count('products', 60)
+
+    text = m.to_prometheus()
+    # 同一指标只有一行 TYPE
+    assert text.count('# TYPE t_retries_total counter') == 1
+    assert prometheus_lines(m) == [
+        't_products_total 60',
+        't_retries_total{stage="click"} 3',
+        't_retries_total{stage="page_load"} 1',
+    ]
+    assert text.endswith('\n')
+
+
+def test_prometheus_histogram_buckets():
+    m = Metrics(prefix='t')
+    # 正好落在桶边界上的值计入该桶（le 为小于等于）
+    for seconds in (0.01, 0.05, 0.3, 0.5, 7, 100):
+        m.observe('page_load', seconds)
+
+    lines = prometheus_lines(m)
+    buckets = {
+        line.split('le="')[1].split('"')[0]: int(line.rsplit(' ', 1)[1])
+        for line in lines
+        if line.startswith('t_page_load_seconds_bucket')
+    }
+    assert list(buckets) == [f'{b:g}' for b in BUCKETS] + ['+Inf']
+    assert buckets == {
+        '0.05': 2,
+        '0.1': 2,
+        '0.25': 2,
+        '0.5': 4,
+        '1': 4,
+        '2.5': 4,
+        '5': 4,
+        '10': 5,
+        '30': 5,
+        '60': 5,
+        '+Inf': 6,
+    }
+    assert 't_page_load_seconds_count 6' in lines
+    assert 't_page_load_seconds_sum 107.860000' in lines
+    assert '# TYPE t_page_load_seconds histogram' in m.to_prometheus()
+
+
+def test_prometheus_label_escaping():
+    m = Metrics(prefix='t')
+    m.count('errors', error='say "hi"\\\nbye')
+    m.observe('wait', 0.1, url='a"b')
+
+    lines = prometheus_lines(m)
+    assert 't_errors_total{error="say \\"hi\\"\\\\\\nbye"} 1' in lines
+    assert 't_wait_seconds_bucket{url="a\\"b",le="0.1"} 1' in lines
+    assert all('\n' not in line for line in lines)
+
+
+def test_tags_are_inherited_by_tasks():
+    m = Metrics(prefix='t')
+
+    async def child() -> None:
+        m.count('clicks', result='ok')
+
+    async def main() -> None:
+        with m.tags(category='jocuri', page=2):
+            await create_task(child())
+        m.count('clicks', result='ok')
+
+    run(main())
+    assert prometheus_lines(m) == [
+        't_clicks_total{category="jocuri",page="2",result="ok"} 1',
+        't_clicks_total{result="ok"} 1',
+    ]
+
+
+def test_export_merge_round_trip():
+    worker = Metrics(prefix='t')
+    with worker.tags(category='jocuri', page=1):
+        worker.count('products', 60)
+        worker.observe('page_load', 0.3)
+        worker.observe('page_load', 12)
+
+    # 导出的结果可以在进程之间传递
+    data = pickle.loads(pickle.dumps(worker.export()))
+
+    coordinator = Metrics(prefix='t')
+    coordinator.count('products', 1, category='jocuri', page=1)
+    coordinator.merge(data, worker='w0')
+    coordinator.merge(data, worker='w0')
+    coordinator.merge(data, worker='w1')
+
+    lines = prometheus_lines(coordinator)
+    assert 't_products_total{category="jocuri",page="1"} 1' in lines
+    assert 't_products_total{category="jocuri",page="1",worker="w0"} 120' in lines
+    assert 't_products_total{category="jocuri",page="1",worker="w1"} 60' in lines
+    assert 't_page_load_seconds_count{category="jocuri",page="1",worker="w0"} 4' in lines
+    assert 't_page_load_seconds_bucket{category="jocuri",page="1",worker="w0",le="0.5"} 2' in lines
+    assert 't_page_load_seconds_bucket{category="jocuri",page="1",worker="w0",le="30"} 4' in lines
+    assert 't_page_load_seconds_sum{category="jocuri",page="1",worker="w1"} 12.300000' in lines
+
+    # 不带标签时汇总结果与原进程相同，经过 JSON（标签变成列表）也一样
+    for exported in (data, json.loads(json.dumps(data))):
+        same = Metrics(prefix='t')
+        same.merge(exported)
+        assert same.to_prometheus() == worker.to_prometheus()
+
+
+def test_export_clear_only_exports_increments():
+    m = Metrics(prefix='t')
+    m.count('products', 5)
+    m.observe('page_load', 1)
+    with m.span('click'):
+        pass
+
+    first = m.export(clear=True)
+    assert first['counters'] == [['products', [], 5]]
+    assert sorted(h[0] for h in first['histograms']) == ['click', 'page_load']
+    assert m.export() == {'counters': [], 'histograms': []}
+    # trace 保留
+    assert len(m.to_trace()['traceEvents']) == 2
+
+    m.count('products', 2)
+    total = Metrics(prefix='t')
+    total.merge(first)
+    total.merge(m.export(clear=True))
+    assert 't_products_total 7' in prometheus_lines(total)
+
+
+def test_to_trace():
+    m = Metrics(prefix='t')
+    m.observe('page_load', 0.25, start=m._origin + 1, context=3, category='jocuri')
+    m.observe('click', 0.5, start=m._origin + 2, context='x')
+    with pytest.raises(RuntimeError):
+        with m.span('clear_cart'):
+            raise RuntimeError
+
+    trace = m.to_trace()
+    assert json.loads(json.dumps(trace)) == trace
+    assert trace['otherData']['started_at'] == m._started_at
+    page_load, click, clear_cart = trace['traceEvents']
+    assert page_load == {
+        'name': 'page_load',
+        'ph': 'X',
+        'ts': 1_000_000,
+        'dur': 250_000,
+        'pid': os.getpid(),
+        'tid': 3,
+        'args': {'category': 'jocuri', 'context': '3'},
+    }
+    # context 标签不是数字或没有时在第 0 行
+    assert click['tid'] == 0
+    assert clear_cart['tid'] == 0
+    assert clear_cart['args'] == {'error': 'RuntimeError'}
+    assert clear_cart['dur'] >= 0
+
+
+def test_trace_event_limit():
+    m = Metrics(prefix='t', max_trace_events=2)
+    for _ in range(5):
+        m.observe('click', 0.1)
+
+    assert len(m.to_trace()['traceEvents']) == 2
+    assert 't_click_seconds_count 5' in prometheus_lines(m)
+
+
+def test_write_files(tmp_path):
+    m = Metrics(prefix='t')
+    m.count('products', 3)
+    m.observe('click', 0.1)
+
+    m.write_prometheus(tmp_path / 'out' / 'metrics.prom')
+    m.write_trace(tmp_path / 'out' / 'trace.json')
+    assert (tmp_path / 'out' / 'metrics.prom').read_text(encoding='utf-8') == m.to_prometheus()
+    assert json.loads((tmp_path / 'out' / 'trace.json').read_text(encoding='utf-8')) == m.to_trace()
+    assert sorted(p.name for p in (tmp_path / 'out').iterdir()) == ['metrics.prom', 'trace.json']
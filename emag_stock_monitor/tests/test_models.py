@@ -0,0 +1,98 @@
+"""`models.ProductBatch` 的写入、校验与 DataFrame 转换"""
+
+import pytest
+
+from emag_stock_monitor.models import Product, ProductBatch
+
+URL_1 = 'https://www.emag.ro/jocuri/c'
+URL_2 = 'https://www.emag.ro/jocuri/p2/c'
+
+
+def make_products() -> list[Product]:
+    return [
+        Product('DAAAAAAAA', URL_1, 1, top_favorite=True, review_count=12, qty=3),
+        Product('DBBBBBBBB', URL_1, 2),
+        Product('DAAAAAAAA', URL_2, 1, review_count=0, qty=50),
+    ]
+
+
+def test_append_and_iterate():
+    products = make_products()
+    batch = ProductBatch(products)
+
+    assert len(batch) == 3
+    assert list(batch) == products
+    assert [(p.rank, p.top_favorite, p.review_count, p.qty) for p in batch] == [
+        (1, True, 12, 3),
+        (2, False, None, None),
+        (1, False, 0, 50),
+    ]
+    assert list(batch.keys()) == [('DAAAAAAAA', URL_1), ('DBBBBBBBB', URL_1), ('DAAAAAAAA', URL_2)]
+    assert products[1] in batch
+    assert Product('DBBBBBBBB', URL_2, 1) not in batch
+    batch.validate()
+
+
+def test_validate_reports_invalid_rows():
+    batch = ProductBatch()
+    batch.append_raw('DAAAAAAAA', URL_1, 1)
+    batch.append_raw('bad', URL_1, 0, review_count=-1, qty=0)
+
+    with pytest.raises(ValueError) as e:
+        batch.validate()
+    message = str(e.value)
+    assert '"bad"' in message
+    assert 'rank' in message and 'review' in message and 'qty' in message
+
+
+def test_append_while_exported_keeps_columns_aligned():
+    batch = ProductBatch(make_products())
+    df = batch.to_frame()
+
+    with pytest.raises(BufferError):
+        batch.append_raw('DCCCCCCCC', URL_1, 3)
+    assert len(batch) == 3
+    assert len(list(batch)) == 3
+
+    del df
+    batch.append_raw('DCCCCCCCC', URL_1, 3)
+    assert batch[3] == Product('DCCCCCCCC', URL_1, 3)
+
+
+def test_append_overflow_keeps_columns_aligned():
+    batch = ProductBatch(make_products())
+    with pytest.raises(OverflowError):
+        batch.append_raw('DCCCCCCCC', URL_1, 2**40)
+    assert len(list(batch)) == 3
+
+
+def test_frame_round_trip():
+    batch = ProductBatch(make_products())
+    df = batch.to_frame(with_url=True, copy=True)
+
+    assert df['pnk'].tolist() == ['DAAAAAAAA', 'DBBBBBBBB', 'DAAAAAAAA']
+    assert df['source_url'].tolist() == [URL_1, URL_1, URL_2]
+    assert df['qty'].isna().tolist() == [False, True, False]
+    assert df['url'].tolist() == [p.url for p in batch]
+
+    restored = ProductBatch.from_frame(df)
+    assert [p.as_dict() for p in restored] == [p.as_dict() for p in batch]
+
+
+def test_from_frame_optional_columns():
+    df = ProductBatch(make_products()).to_frame(copy=True)[['pnk', 'source_url', 'rank']]
+    restored = ProductBatch.from_frame(df)
+    assert [(p.top_favorite, p.review_count, p.qty) for p in restored] == [(False, None, None)] * 3
+
+
+def test_drop_duplicates_keeps_last():
+    batch = ProductBatch(make_products())
+    batch.append(Product('DAAAAAAAA', URL_1, 5, qty=7))
+
+    deduped = batch.drop_duplicates()
+    assert [(p.pnk, p.source_url, p.rank, p.qty) for p in deduped] == [
+        ('DBBBBBBBB', URL_1, 2, None),
+        ('DAAAAAAAA', URL_2, 1, 50),
+        ('DAAAAAAAA', URL_1, 5, 7),
+    ]
+    assert len(batch) == 4
@@ -0,0 +1,51 @@
+"""`qty_cache.QtyCache` 的过期、淘汰与持久化"""
+
+import pytest
+
+from emag_stock_monitor.qty_cache import QtyCache
+
+
+def test_ttl():
+    cache = QtyCache(ttl=60)
+    cache.put_many({'D5ABCDEFG': 3}, now=1000)
+
+    assert cache.get_many(['D5ABCDEFG'], now=1060) == {'D5ABCDEFG': 3}
+    # 过期的不再命中，并从缓存中删除
+    assert cache.get_many(['D5ABCDEFG'], now=1061) == {}
+    assert len(cache) == 0
+    assert cache.stats() == {'size': 0, 'hits': 1, 'misses': 1}
+
+
+def test_put_refreshes_timestamp():
+    cache = QtyCache(ttl=60)
+    cache.put_many({'D5ABCDEFG': 3}, now=1000)
+    cache.put_many({'D5ABCDEFG': 5}, now=1050)
+    assert cache.get_many(['D5ABCDEFG'], now=1100) == {'D5ABCDEFG': 5}
+
+
+def test_lru_eviction():
+    cache = QtyCache(max_size=2)
+    cache.put_many({'DAAAAAAAA': 1, 'DBBBBBBBB': 2}, now=0)
+    # 读取后 DAAAAAAAA 变为最近用到的，写入新 pnk 时淘汰 DBBBBBBBB
+    cache.get_many(['DAAAAAAAA'], now=1)
+    cache.put_many({'DCCCCCCCC': 3}, now=2)
+
+    assert cache.get_many(['DAAAAAAAA', 'DBBBBBBBB', 'DCCCCCCCC'], now=3) == {'DAAAAAAAA': 1, 'DCCCCCCCC': 3}
+
+
+def test_invalid_max_size():
+    with pytest.raises(ValueError):
+        QtyCache(max_size=0)
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path.joinpath('qty_cache.json')
+    cache = QtyCache(path=path)
+    cache.put_many({'DAAAAAAAA': 1, 'DBBBBBBBB': 2})
+    cache.save()
+
+    assert QtyCache(path=path).get_many(['DAAAAAAAA', 'DBBBBBBBB']) == {'DAAAAAAAA': 1, 'DBBBBBBBB': 2}
+    # 读取时按写入时间保留最新的 max_size 个
+    assert len(QtyCache(path=path, max_size=1)) == 1
+    # 读取时丢掉过期的
+    assert len(QtyCache(path=path, ttl=-1)) == 0
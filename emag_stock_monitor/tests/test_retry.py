@@ -0,0 +1,207 @@
+"""`retry` 的退避、重试预算、令牌桶与限速（注入时钟和随机数，结果确定）"""
+
+from asyncio import run
+
+import pytest
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_stock_monitor import retry
+from emag_stock_monitor.retry import Backoff, HostRateLimiter, RetryBudget, RetryPolicy, TokenBucket
+
+URL = 'https://www.emag.ro/c/p1'
+
+
+class FakeClock:
+    """代替事件循环的时钟，`sleep` 不真正等待，只把时间往前拨"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = list()
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(retry, 'get_running_loop', lambda: clock)
+    monkeypatch.setattr(retry, 'sleep', clock.sleep)
+    return clock
+
+
+@pytest.mark.parametrize('attempt, cap', [(0, 0.5), (1, 1), (2, 2), (3, 4), (4, 5), (10, 5)])
+def test_backoff_full_jitter_bounds(monkeypatch, attempt, cap):
+    backoff = Backoff(base=0.5, factor=2, max_delay=5)
+    monkeypatch.setattr(retry, 'uniform', lambda low, high: low)
+    assert backoff.delay(attempt) == 0
+    monkeypatch.setattr(retry, 'uniform', lambda low, high: high)
+    assert backoff.delay(attempt) == cap
+    monkeypatch.undo()
+    assert all(0 <= backoff.delay(attempt) <= cap for _ in range(200))
+
+
+def test_retry_budget_exhaustion_and_refill():
+    budget = RetryBudget(ratio=0.5, min_retries=2, max_retries=3)
+    assert budget.try_retry()
+    assert budget.try_retry()
+    assert not budget.try_retry()
+    assert budget.exhausted == 1
+
+    # 两次调用存入一次重试额度
+    budget.record_call()
+    assert not budget.try_retry()
+    budget.record_call()
+    assert budget.try_retry()
+    assert budget.exhausted == 2
+
+    # 额度不超过 max_retries
+    for _ in range(100):
+        budget.record_call()
+    assert [budget.try_retry() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+
+    async def main() -> list[float]:
+        return [await bucket.acquire() for _ in range(4)]
+
+    assert run(main()) == [0, 0, 0.5, 0.5]
+    assert clock.now == 1
+
+    # 空闲期间补充的令牌不超过 burst
+    clock.now += 10
+
+    async def after_idle() -> list[float]:
+        return [await bucket.acquire() for _ in range(3)]
+
+    assert run(after_idle()) == [0, 0, 0.5]
+
+
+def test_host_rate_limiter_aimd(clock):
+    limiter = HostRateLimiter(rate=4, burst=8, min_rate=0.5, decrease=0.5, increase=0.5, cooldown=5)
+
+    # 还没请求过的域名不调整
+    limiter.observe(URL, 429)
+    assert limiter.rates() == {}
+
+    run(limiter.acquire(URL))
+    assert limiter.rates() == {'www.emag.ro': 4}
+
+    # 乘性减，冷却期内的 429 / 511 不再降速
+    limiter.observe(URL, 429)
+    assert limiter.rates()['www.emag.ro'] == 2
+    clock.now += 4.9
+    limiter.observe(URL, 511)
+    assert limiter.rates()['www.emag.ro'] == 2
+    clock.now += 0.1
+    limiter.observe(URL, 511)
+    assert limiter.rates()['www.emag.ro'] == 1
+    clock.now += 5
+    limiter.observe(URL, 429)
+    clock.now += 5
+    limiter.observe(URL, 429)
+    assert limiter.rates()['www.emag.ro'] == 0.5
+
+    # 加性增，只有正常响应才加速，且不超过 rate
+    limiter.observe(URL, 404)
+    limiter.observe(URL, 500)
+    assert limiter.rates()['www.emag.ro'] == 0.5
+    limiter.observe(URL, 200)
+    limiter.observe(URL, 302)
+    assert limiter.rates()['www.emag.ro'] == 1.5
+    for _ in range(10):
+        limiter.observe(URL, 200)
+    assert limiter.rates()['www.emag.ro'] == 4
+
+    # 其他域名单独计算
+    run(limiter.acquire('https://auth.emag.ro/login'))
+    limiter.observe('https://auth.emag.ro/login', 429)
+    assert limiter.rates() == {'www.emag.ro': 4, 'auth.emag.ro': 2}
+
+
+class CountingLimiter(HostRateLimiter):
+    def __init__(self) -> None:
+        super().__init__()
+        self.acquired: list[str] = list()
+        self.paused = 0
+
+    async def acquire(self, url: str) -> None:
+        self.acquired.append(url)
+
+    async def pause(self) -> None:
+        self.paused += 1
+
+
+class Flaky:
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise PlaywrightError(f'第 {self.calls} 次失败')
+        return 'ok'
+
+
+def test_retry_policy_retries_with_backoff(clock, monkeypatch):
+    monkeypatch.setattr(retry, 'uniform', lambda low, high: high)
+    limiter = CountingLimiter()
+    policy = RetryPolicy(attempts=3, backoff=Backoff(base=1, factor=2, max_delay=10), limiter=limiter)
+    fn = Flaky(2)
+
+    assert run(policy.call('stage', fn, url=URL)) == 'ok'
+    assert fn.calls == 3
+    assert clock.sleeps == [1, 2]
+    # 每次尝试前都取令牌
+    assert limiter.acquired == [URL] * 3
+
+    # 没有 url 时不取令牌，只在熔断期间等待
+    run(policy.call('stage', Flaky(0)))
+    assert limiter.acquired == [URL] * 3
+    assert limiter.paused == 1
+
+
+def test_retry_policy_attempts_exhausted(clock):
+    policy = RetryPolicy(attempts=3)
+    fn = Flaky(5)
+    with pytest.raises(PlaywrightError, match='第 3 次失败'):
+        run(policy.call('stage', fn))
+    assert fn.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_retry_policy_does_not_retry_other_errors(clock):
+    async def fn() -> None:
+        raise ValueError('不重试')
+
+    with pytest.raises(ValueError):
+        run(RetryPolicy(attempts=3).call('stage', fn))
+    assert clock.sleeps == []
+
+
+def test_retry_policy_budget_exhausted(clock):
+    budget = RetryBudget(ratio=0, min_retries=1)
+    policy = RetryPolicy(attempts=5, budget=budget)
+
+    # 第一次调用用掉唯一的重试额度后成功
+    assert run(policy.call('stage', Flaky(1))) == 'ok'
+
+    # 之后的调用失败即抛出，不再重试
+    fn = Flaky(1)
+    with pytest.raises(PlaywrightError):
+        run(policy.call('stage', fn))
+    assert fn.calls == 1
+    assert budget.exhausted == 1
+    assert len(clock.sleeps) == 1
+
+
+def test_retry_policy_rejects_non_positive_attempts():
+    with pytest.raises(ValueError):
+        RetryPolicy(attempts=0)
@@ -0,0 +1,99 @@
+"""`scheduler.CrawlScheduler` 的重试与断点续爬"""
+
+import asyncio
+import json
+
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.scheduler import CrawlScheduler, Job
+
+BASE_URL = 'http://standin.test'
+
+
+class FakePool:
+    """记录处理过的链接，`failures` 为每个链接先失败的次数，`captcha` 中的链接遇到验证码"""
+
+    size = 2
+    carts_per_page = 1
+
+    def __init__(self, failures=None, captcha=()) -> None:
+        self.failures = dict(failures or dict())
+        self.captcha = set(captcha)
+        self.calls: list[str] = list()
+
+    async def crawl_list_page(self, url: str) -> str:
+        self.calls.append(url)
+        if url in self.captcha:
+            raise CaptchaError(url, 511, '验证码')
+        if self.failures.get(url, 0) > 0:
+            self.failures[url] -= 1
+            raise RuntimeError(f'处理 "{url}" 失败')
+        return url
+
+
+def page_url(category: str, page: int) -> str:
+    return Job(category, page).url(BASE_URL)
+
+
+def saved_jobs(path) -> dict[str, tuple[str, int]]:
+    jobs = json.loads(path.read_text(encoding='utf-8'))['jobs']
+    return {f'{j["category"]}/p{j["page"]}': (j['status'], j['attempts']) for j in jobs}
+
+
+def test_retry_then_done(tmp_path):
+    checkpoint = tmp_path.joinpath('checkpoint.json')
+    pool = FakePool(failures={page_url('jocuri', 2): 1})
+    scheduler = CrawlScheduler(pool, checkpoint, base_url=BASE_URL)
+    scheduler.add_categories(['jocuri'], depth=3)
+
+    results = asyncio.run(scheduler.run())
+
+    assert sorted(results) == sorted(page_url('jocuri', p) for p in (1, 2, 3))
+    assert pool.calls.count(page_url('jocuri', 2)) == 2
+    assert saved_jobs(checkpoint) == {
+        'jocuri/p1': ('done', 0),
+        'jocuri/p2': ('done', 1),
+        'jocuri/p3': ('done', 0),
+    }
+
+
+def test_failed_after_max_attempts(tmp_path):
+    checkpoint = tmp_path.joinpath('checkpoint.json')
+    pool = FakePool(failures={page_url('jocuri', 1): 10})
+    scheduler = CrawlScheduler(pool, checkpoint, max_attempts=3, base_url=BASE_URL)
+    scheduler.add_categories(['jocuri'], depth=1)
+
+    assert asyncio.run(scheduler.run()) == []
+    assert len(pool.calls) == 3
+    assert saved_jobs(checkpoint) == {'jocuri/p1': ('failed', 3)}
+
+    # 重新运行时不再处理已失败的任务
+    pool = FakePool()
+    scheduler = CrawlScheduler(pool, checkpoint, max_attempts=3, base_url=BASE_URL)
+    asyncio.run(scheduler.run())
+    assert pool.calls == []
+
+
+def test_resume_from_checkpoint(tmp_path):
+    checkpoint = tmp_path.joinpath('checkpoint.json')
+    # 第 2 页遇到验证码，没有熔断器时停止派发，任务保持 pending
+    pool = FakePool(captcha={page_url('jocuri', 2)})
+    scheduler = CrawlScheduler(pool, checkpoint, workers=1, base_url=BASE_URL)
+    scheduler.add_categories(['jocuri'], depth=3)
+    asyncio.run(scheduler.run())
+
+    assert pool.calls == [page_url('jocuri', 1), page_url('jocuri', 2)]
+    assert saved_jobs(checkpoint) == {
+        'jocuri/p1': ('done', 0),
+        'jocuri/p2': ('pending', 0),
+        'jocuri/p3': ('pending', 0),
+    }
+
+    # 从检查点继续，已完成的任务被跳过，重复添加类目不会重置状态
+    pool = FakePool()
+    scheduler = CrawlScheduler(pool, checkpoint, workers=1, base_url=BASE_URL)
+    scheduler.add_categories(['jocuri'], depth=3)
+    results = asyncio.run(scheduler.run())
+
+    assert pool.calls == [page_url('jocuri', 2), page_url('jocuri', 3)]
+    assert results == pool.calls
+    assert {status for status, _ in saved_jobs(checkpoint).values()} == {'done'}
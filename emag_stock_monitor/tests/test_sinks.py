@@ -0,0 +1,104 @@
+"""`sinks` 的测试"""
+
+import asyncio
+from contextlib import closing
+import csv
+import sqlite3
+
+import pytest
+
+from emag_stock_monitor.models import Product
+from emag_stock_monitor.sinks import CsvSink, ParquetSink, ResultSink, SqliteSink
+
+URL = 'https://www.emag.ro/jocuri/c'
+
+
+def test_csv_sink_flushes_on_close(tmp_path):
+    path = tmp_path.joinpath('result.csv')
+
+    async def main():
+        async with CsvSink(path, buffer_size=2) as sink:
+            await sink.push([Product('D5ABCDEFG', URL, 1, qty=3)])
+            await sink.push([Product('DGH2K7M8B', URL, 2, review_count=12, qty=10)])
+            await sink.push([Product('DZQ1W4R6T', URL, 3)])
+            assert sink.written == 2
+        return sink
+
+    sink = asyncio.run(main())
+    assert sink.written == 3
+    with path.open(encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [r['pnk'] for r in rows] == ['D5ABCDEFG', 'DGH2K7M8B', 'DZQ1W4R6T']
+    assert rows[1]['review_count'] == '12'
+
+
+def test_parquet_sink_continues_after_highest_part(tmp_path):
+    pytest.importorskip('pyarrow')
+    for n in (0, 3):
+        tmp_path.joinpath(f'part-{n:05d}.parquet').touch()
+    assert ParquetSink(tmp_path)._part == 4
+
+
+def test_parquet_sink_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    pandas = pytest.importorskip('pandas')
+
+    async def main():
+        async with ParquetSink(tmp_path, buffer_size=2) as sink:
+            await sink.push([Product('D5ABCDEFG', URL, 1, qty=3), Product('DGH2K7M8B', URL, 2)])
+            await sink.push([Product('DZQ1W4R6T', URL, 3, top_favorite=True, review_count=5)])
+
+    asyncio.run(main())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['part-00000.parquet', 'part-00001.parquet']
+    df = pandas.read_parquet(tmp_path).sort_values('rank')
+    assert df['pnk'].tolist() == ['D5ABCDEFG', 'DGH2K7M8B', 'DZQ1W4R6T']
+    assert df['qty'].isna().tolist() == [False, True, True]
+    assert df['top_favorite'].tolist() == [False, False, True]
+
+
+def test_sqlite_sink(tmp_path):
+    path = tmp_path.joinpath('result.db')
+
+    async def main():
+        async with SqliteSink(path, table='results', buffer_size=10) as sink:
+            await sink.push([Product('D5ABCDEFG', URL, 1, qty=3)])
+            await sink.push([Product('DGH2K7M8B', URL, 2, top_favorite=True, review_count=12)])
+
+    asyncio.run(main())
+    with closing(sqlite3.connect(path)) as conn:
+        rows = conn.execute(
+            'SELECT pnk, rank, top_favorite, review_count, qty FROM results ORDER BY rank'
+        ).fetchall()
+    assert rows == [('D5ABCDEFG', 1, 0, None, 3), ('DGH2K7M8B', 2, 1, 12, None)]
+
+
+def test_sqlite_sink_rejects_bad_table(tmp_path):
+    with pytest.raises(ValueError):
+        SqliteSink(tmp_path.joinpath('result.db'), table='products; DROP TABLE x')
+
+
+def test_concurrent_push(tmp_path):
+    path = tmp_path.joinpath('result.db')
+    pnks = [f'D{n:08d}' for n in range(200)]
+
+    async def worker(sink: SqliteSink, worker_id: int) -> None:
+        for n in range(worker_id, len(pnks), 8):
+            await sink.push([Product(pnks[n], URL, n + 1)])
+            await asyncio.sleep(0)
+
+    async def main():
+        async with SqliteSink(path, buffer_size=7) as sink:
+            await asyncio.gather(*(worker(sink, i) for i in range(8)))
+        return sink
+
+    sink = asyncio.run(main())
+    assert sink.written == len(pnks)
+    with closing(sqlite3.connect(path)) as conn:
+        written = [r[0] for r in conn.execute('SELECT pnk FROM products')]
+    # 每条记录只写入一次，没有丢失
+    assert sorted(written) == pnks
+
+
+def test_result_sink_is_abstract():
+    with pytest.raises(TypeError):
+        ResultSink()
@@ -0,0 +1,85 @@
+"""`wait_page_load` 的退出条件（不启动浏览器，用假页面模拟卡片数量与滚动位置）"""
+
+from asyncio import run
+
+from playwright.async_api import Error as PlaywrightError
+
+from emag_stock_monitor.page_handlers.list_page import wait_page_load
+
+
+class FakeHandle:
+    def __init__(self, value) -> None:
+        self.value = value
+
+    async def json_value(self):
+        return self.value
+
+
+class FakeMouse:
+    def __init__(self) -> None:
+        self.wheels = 0
+
+    async def wheel(self, delta_x: int, delta_y: int) -> None:
+        self.wheels += 1
+
+
+class FakePage:
+    """每滚动一次卡片数量按 `counts` 变化，滚动次数用完后视为到底部"""
+
+    url = 'https://www.emag.ro/c/p1'
+
+    def __init__(self, counts: list[int], expect_count: int) -> None:
+        self.counts = counts
+        self.expect_count = expect_count
+        self.mouse = FakeMouse()
+
+    @property
+    def count(self) -> int:
+        return self.counts[min(self.mouse.wheels, len(self.counts) - 1)]
+
+    async def wait_for_function(self, expression, arg, polling, timeout):
+        # 与 `_CARD_COUNT_READY_JS` 一致：达标时返回 `{count}`，否则等到超时
+        if self.count >= arg[1]:
+            return FakeHandle({'count': self.count})
+        raise PlaywrightError('Timeout')
+
+    async def evaluate(self, expression, arg):
+        return {'count': self.count, 'atBottom': self.mouse.wheels >= len(self.counts) - 1}
+
+
+def test_ready_when_expect_count_reached():
+    page = FakePage([20, 40, 60], 60)
+    result = run(wait_page_load(page, expect_count=60, timeout=5))
+    assert result.ready
+    assert result.card_count == 60
+    assert result.scroll_steps == 2
+
+
+def test_ready_with_zero_expected_cards():
+    page = FakePage([0], 0)
+    result = run(wait_page_load(page, expect_count=0, timeout=5))
+    assert result.ready
+    assert result.card_count == 0
+    assert result.scroll_steps == 0
+
+
+def test_short_last_page_adjusts_expect_count():
+    page = FakePage([10, 25], 60)
+    result = run(wait_page_load(page, expect_count=60, timeout=5, stable_steps=3))
+    assert result.ready
+    assert result.card_count == result.expect_count == 25
+
+
+def test_empty_page_loads_with_zero_cards():
+    page = FakePage([0], 60)
+    result = run(wait_page_load(page, expect_count=60, timeout=5, stable_steps=3))
+    assert result.ready
+    assert result.card_count == result.expect_count == 0
+    assert result.scroll_steps == 3
+
+
+def test_timeout_when_cards_keep_loading():
+    page = FakePage(list(range(1, 1000)), 2000)
+    result = run(wait_page_load(page, expect_count=2000, timeout=0))
+    assert not result.ready
+    assert result.expect_count == 2000
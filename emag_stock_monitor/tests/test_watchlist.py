@@ -0,0 +1,126 @@
+"""`watchlist` 的复查间隔、消耗速度与调度"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from emag_stock_monitor.models import Product
+from emag_stock_monitor.watchlist import Watchlist, WatchItem
+
+URL = 'https://www.emag.ro/jocuri/c'
+
+
+class FakePool:
+    size = 1
+    captcha_detector = None
+
+    @asynccontextmanager
+    async def acquire(self, count: int = 1):
+        yield [(0, object())]
+
+
+def make_watchlist(pnks, **kwargs) -> Watchlist:
+    products = [Product(pnk, URL, rank) for rank, pnk in enumerate(pnks, 1)]
+    return Watchlist(FakePool(), products, min_interval=60, max_interval=3600, **kwargs)
+
+
+def test_observe_velocity():
+    item = WatchItem(Product('DAAAAAAAA', URL, 1, qty=50))
+    # 第一次只记下库存，没有上一次的时间
+    item.observe(40, ts=0)
+    assert item.velocity == 0 and item.product.qty == 40
+
+    item.observe(30, ts=3600)
+    assert item.velocity == 5.0  # (0 + 10) / 2
+    item.observe(30, ts=7200)
+    item.observe(30, ts=10800)
+    assert item.unchanged == 2 and item.velocity == 5.0
+
+    # 补货时速度不变，不变计数清零
+    item.observe(100, ts=14400)
+    assert item.unchanged == 0 and item.velocity == 5.0
+
+    item.observe(None, ts=18000)
+    item.observe(None, ts=18060)
+    assert item.failures == 2 and item.product.qty == 100
+    item.observe(90, ts=21600)
+    assert item.failures == 0
+
+
+def test_next_interval():
+    watchlist = make_watchlist(['DAAAAAAAA'], low_stock=10, checks_before_sellout=4)
+    item = WatchItem(Product('DAAAAAAAA', URL, 1))
+
+    # 没有库存数据、库存低时按最短间隔
+    assert watchlist.next_interval(item) == 60
+    item.product.qty = 10
+    assert watchlist.next_interval(item) == 60
+
+    # 不卖的产品按最长间隔
+    item.product.qty = 100
+    assert watchlist.next_interval(item) == 3600
+
+    # 每小时卖 100 件，按 4 次复查卖完前的时间：100 / 100 * 3600 / 4
+    item.velocity = 100
+    assert watchlist.next_interval(item) == 900
+    item.unchanged = 1
+    assert watchlist.next_interval(item) == 1800
+    item.unchanged = 10
+    assert watchlist.next_interval(item) == 3600
+
+    # 卖得极快时不低于最短间隔
+    item.unchanged = 0
+    item.velocity = 100_000
+    assert watchlist.next_interval(item) == 60
+
+    # 连续失败时按最短间隔翻倍退避
+    item.failures = 3
+    assert watchlist.next_interval(item) == 240
+
+
+def test_pop_due_respects_capacity_and_due():
+    watchlist = make_watchlist(['DAAAAAAAA', 'DBBBBBBBB', 'DCCCCCCCC'], capacity=2)
+
+    first = watchlist._pop_due(now=0)
+    assert len(first) == 2
+    assert len(watchlist._pop_due(now=0)) == 1
+    assert watchlist._pop_due(now=0) == []
+
+    for item in first:
+        watchlist._reschedule(item, now=0)
+    assert watchlist._pop_due(now=59) == []
+    assert {i.pnk for i in watchlist._pop_due(now=60)} == {i.pnk for i in first}
+
+
+def test_pop_due_prefers_fast_sellers():
+    class Store:
+        def velocity_of(self, pnks):
+            return {'DCCCCCCCC': (None, 9.0), 'DBBBBBBBB': (None, 3.0)}
+
+    watchlist = make_watchlist(['DAAAAAAAA', 'DBBBBBBBB', 'DCCCCCCCC'], store=Store())
+    assert [i.pnk for i in watchlist._pop_due(now=0)] == ['DCCCCCCCC', 'DBBBBBBBB', 'DAAAAAAAA']
+
+
+@pytest.mark.parametrize('failing_callback', [False, True])
+def test_on_result_error_does_not_stop_worker(failing_callback):
+    results = list()
+
+    async def on_result(products):
+        results.append(products)
+        if failing_callback:
+            raise RuntimeError('写入失败')
+
+    class CheckedWatchlist(Watchlist):
+        async def check(self, context, items):
+            for item in items:
+                item.observe(5, 0)
+            return [i.product for i in items]
+
+    watchlist = CheckedWatchlist(
+        FakePool(), [Product('DAAAAAAAA', URL, 1)], on_result=on_result, min_interval=0.05, max_interval=0.05
+    )
+    asyncio.run(watchlist.run(duration=0.3))
+
+    # 回调出错后仍按间隔继续复查
+    assert len(results) >= 3
@@ -5,3 +5,19 @@ BASE_URL = 'https://www.emag.ro'
 
 CART_PAGE_URL = 'https://www.emag.ro/cart/products'
 """eMAG 购物车页面"""
+
+
+def build_list_page_url(category: str, page: int = 1, base_url: str = BASE_URL) -> str:
+    """
+    构建产品列表页链接
+
+    ---
+
+    * `category`: 类目，如 `"jocuri-societate"`
+    * `page`: 页码（从 1 开始），第 1 页为 `/{category}/c`，其余为 `/{category}/p{page}/c`
+    """
+    if page < 1:
+        raise ValueError('page 需为正整数')
+    if page == 1:
+        return f'{base_url}/{category}/c'
+    return f'{base_url}/{category}/p{page}/c'
@@ -0,0 +1,311 @@
+"""重点产品监控（按优先级直接复查已知 pnk）"""
+
+from __future__ import annotations
+
+from asyncio import Event, gather, sleep, wait_for
+from heapq import heappop, heappush
+from inspect import isawaitable
+from itertools import count
+from time import time
+from typing import TYPE_CHECKING
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.utils.emag_util import build_product_url
+
+from emag_stock_monitor.exceptions import CaptchaError
+from emag_stock_monitor.logger import logger
+from emag_stock_monitor.page_handlers.add_cart_api import (
+    add_to_cart_by_api,
+    extract_product_page_add_cart_form,
+)
+from emag_stock_monitor.page_handlers.cart_page import handle_cart
+from emag_stock_monitor.retry import get_rate_limiter, navigation_policy
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Iterable, Optional, Union
+
+    from playwright.async_api import BrowserContext
+
+    from emag_stock_monitor.context_pool import ContextPool
+    from emag_stock_monitor.history import HistoryStore
+    from emag_stock_monitor.models import Product
+    from emag_stock_monitor.page_handlers.add_cart_api import AddCartForm
+
+    _OnResult = Callable[[list['Product']], Union[Awaitable[None], None]]
+
+
+class WatchItem:
+    """
+    一个被监控的产品
+
+    ---
+
+    * `product`: 要监控的产品（`qty` 为上一次的最大可加购数）
+    * `velocity`: 消耗速度（件/小时）
+    * `due`: 下次复查的时间戳
+
+    ---
+
+    `unchanged` 为库存连续没有变化的次数，`failures` 为连续没取到库存的次数
+    """
+
+    def __init__(self, product: Product, velocity: float = 0.0, due: float = 0.0) -> None:
+        self.product = product
+        self.velocity = velocity
+        self.due = due
+        self.last_checked: Optional[float] = None
+        self.unchanged = 0
+        self.failures = 0
+
+    @property
+    def pnk(self) -> str:
+        return self.product.pnk
+
+    def observe(self, qty: Optional[int], ts: float) -> None:
+        """记录一次复查结果，更新消耗速度"""
+        if qty is None:
+            self.failures += 1
+            return
+        self.failures = 0
+        prev_qty, prev_ts = self.product.qty, self.last_checked
+        if prev_qty is not None and prev_ts is not None and ts > prev_ts:
+            if qty < prev_qty:
+                # 指数加权，新观测占一半
+                observed = (prev_qty - qty) / ((ts - prev_ts) / 3600)
+                self.velocity = (self.velocity + observed) / 2
+                self.unchanged = 0
+            elif qty == prev_qty:
+                self.unchanged += 1
+            else:
+                # 补货，速度保持不变
+                self.unchanged = 0
+        self.product.qty = qty
+        self.last_checked = ts
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(pnk="{self.pnk}", qty={self.product.qty}, velocity={self.velocity:.2f}, due={self.due:.0f})'
+
+
+class Watchlist:
+    """
+    重点产品监控
+
+    ---
+
+    * `pool`: 用来加购和读取购物车的 `ContextPool`，每个 worker 每轮占用一个 context
+    * `products`: 要监控的产品
+    * `store`: 历史库存数据，指定时用它的消耗速度作为初始优先级
+    * `on_result`: 每轮复查完成时的回调（可以是协程函数），参数为取到库存的产品
+    * `capacity`: 每轮加购的产品数（需小于购物车的产品种类上限 50）
+    * `min_interval` / `max_interval`: 同一产品两次复查的最短、最长间隔（秒）
+    * `low_stock`: 库存不高于该值时按最短间隔复查
+    * `checks_before_sellout`: 按当前速度卖完之前至少复查的次数
+
+    ---
+
+    不打开产品列表页，直接把到期的产品加到购物车里读取最大可加购数：
+    1. 第一次复查某个产品时打开其详情页（`build_product_url`）取加购表单，之后只通过接口加购
+    2. 库存少、卖得快的产品复查间隔短，库存长期不变的产品间隔逐渐变长
+
+    打开详情页和接口加购与产品列表页一样使用 `navigation_policy` 和 context 上的限速器；
+    `pool` 有验证码检测时，熔断期间暂停复查，期间的结果丢弃，熔断器不再恢复时停止
+    """
+
+    def __init__(
+        self,
+        pool: ContextPool,
+        products: Iterable[Product],
+        store: Optional[HistoryStore] = None,
+        on_result: Optional[_OnResult] = None,
+        capacity: int = 40,
+        min_interval: float = 10 * 60,
+        max_interval: float = 6 * 60 * 60,
+        low_stock: int = 10,
+        checks_before_sellout: int = 4,
+    ) -> None:
+        if capacity < 1:
+            raise ValueError('capacity 需为正整数')
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('需满足 0 < min_interval <= max_interval')
+        self._pool = pool
+        self._on_result = on_result
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.low_stock = low_stock
+        self.checks_before_sellout = checks_before_sellout
+        self.forms: dict[str, AddCartForm] = dict()
+        """pnk -> 加购表单，可以预先放入产品列表页上取到的表单"""
+
+        self._items: dict[str, WatchItem] = dict()
+        for p in products:
+            self._items.setdefault(p.pnk, WatchItem(p))
+        if store is not None:
+            for pnk, (_, velocity) in store.velocity_of(self._items).items():
+                self._items[pnk].velocity = velocity
+
+        # 按 (到期时间, 序号) 排序的堆，一开始全部到期，速度快的排前面
+        self._seq = count()
+        self._heap: list[tuple[float, int, WatchItem]] = list()
+        for item in sorted(self._items.values(), key=lambda i: -i.velocity):
+            heappush(self._heap, (item.due, next(self._seq), item))
+        self._stop = Event()
+
+    @property
+    def items(self) -> list[WatchItem]:
+        return list(self._items.values())
+
+    def stop(self) -> None:
+        """停止复查（当前这一轮会做完）"""
+        self._stop.set()
+
+    def next_interval(self, item: WatchItem) -> float:
+        """根据库存、消耗速度和库存变化情况计算下次复查的间隔"""
+        qty = item.product.qty
+        if item.failures > 0:
+            interval = self.min_interval * 2 ** (item.failures - 1)
+        elif qty is None or qty <= self.low_stock:
+            interval = self.min_interval
+        else:
+            interval = self.max_interval
+            if item.velocity > 0:
+                interval = min(interval, qty / item.velocity * 3600 / self.checks_before_sellout)
+            # 库存长期不变的产品放慢复查
+            interval *= 1 + item.unchanged
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _pop_due(self, now: float) -> list[WatchItem]:
+        batch: list[WatchItem] = list()
+        while len(self._heap) > 0 and len(batch) < self.capacity and self._heap[0][0] <= now:
+            batch.append(heappop(self._heap)[2])
+        return batch
+
+    def _reschedule(self, item: WatchItem, now: float) -> None:
+        item.due = now + self.next_interval(item)
+        heappush(self._heap, (item.due, next(self._seq), item))
+
+    async def _ensure_forms(self, context: BrowserContext, items: list[WatchItem]) -> None:
+        """打开还没有加购表单的产品的详情页，取加购表单"""
+        missing = [i for i in items if i.pnk not in self.forms]
+        if len(missing) == 0:
+            return
+        logger.debug('打开 {} 个产品的详情页获取加购表单', len(missing))
+        detector = self._pool.captcha_detector
+        limiter = get_rate_limiter(context)
+        page = await context.new_page()
+        try:
+            for item in missing:
+                url = build_product_url(pnk=item.pnk)
+                try:
+                    await navigation_policy.call(
+                        'product_page_load',
+                        lambda: page.goto(url, wait_until='domcontentloaded'),
+                        url=url,
+                        limiter=limiter,
+                    )
+                    if detector is not None:
+                        await detector.check_page(page)
+                    form = await extract_product_page_add_cart_form(page, item.pnk)
+                except PlaywrightError as pe:
+                    logger.error(f'获取 "{item.pnk}" 的加购表单时出错\n{pe}')
+                    continue
+                if form is None:
+                    logger.warning(f'"{item.pnk}" 的详情页上找不到加购按钮')
+                    continue
+                self.forms[item.pnk] = form
+        finally:
+            await page.close()
+
+    async def check(self, context: BrowserContext, items: list[WatchItem]) -> list[Product]:
+        """
+        用 `context` 的购物车复查一批产品，返回取到库存的产品
+
+        ---
+
+        期间遇到验证码时抛出 `CaptchaError`（这一批的结果不可信）
+        """
+        detector = self._pool.captcha_detector
+        trips_before = detector.breaker.trips if detector is not None else 0
+        await self._ensure_forms(context, items)
+        products = [i.product for i in items]
+        added = await add_to_cart_by_api(
+            context.request, products, self.forms, limiter=get_rate_limiter(context)
+        )
+        result = await handle_cart(context, added, True) if len(added) > 0 else list()
+        if detector is not None:
+            detector.check_tripped(trips_before)
+            detector.breaker.record_success()
+
+        now = time()
+        qty_map = {p.pnk: p.qty for p in result}
+        for item in items:
+            item.observe(qty_map.get(item.pnk), now)
+        return result
+
+    async def _worker(self, worker_id: int, until: Optional[float]) -> None:
+        while not self._stop.is_set():
+            now = time()
+            if until is not None and now >= until:
+                break
+            batch = self._pop_due(now)
+            if len(batch) == 0:
+                # 等到最早到期的产品，或被 stop 唤醒
+                wake = self._heap[0][0] if len(self._heap) > 0 else now + self.min_interval
+                if until is not None:
+                    wake = min(wake, until)
+                try:
+                    await wait_for(self._stop.wait(), timeout=max(wake - now, 0))
+                except TimeoutError:
+                    pass
+                continue
+
+            detector = self._pool.captcha_detector
+            try:
+                if detector is not None:
+                    await detector.breaker.wait()
+                async with self._pool.acquire() as acquired:
+                    index, context = acquired[0]
+                    logger.info(f'worker #{worker_id} 使用 context #{index} 复查 {len(batch)} 个产品')
+                    result = await self.check(context, batch)
+            except CaptchaError as ce:
+                # 不计入失败次数，按原来的间隔重新排队，下一轮在 wait 中等熔断器恢复
+                if detector is None or detector.breaker.exhausted:
+                    logger.error(f'worker #{worker_id} 复查时遇到验证码，停止监控\n{ce}')
+                    self.stop()
+                else:
+                    logger.warning(f'worker #{worker_id} 复查时遇到验证码，等待恢复后继续')
+            except Exception as e:
+                logger.error(f'worker #{worker_id} 复查 {len(batch)} 个产品时出错\n{e!r}')
+                now = time()
+                for item in batch:
+                    item.observe(None, now)
+            else:
+                logger.info(f'worker #{worker_id} 复查完成，取到 {len(result)}/{len(batch)} 个产品的库存')
+                if self._on_result is not None and len(result) > 0:
+                    try:
+                        r = self._on_result(result)
+                        if isawaitable(r):
+                            await r
+                    except Exception as e:
+                        # 回调出错不影响监控，库存已经记录在产品上
+                        logger.error(f'worker #{worker_id} 处理复查结果的回调出错\n{e!r}')
+            finally:
+                now = time()
+                for item in batch:
+                    self._reschedule(item, now)
+
+            # 让出事件循环，避免某个 worker 连续占用
+            await sleep(0)
+
+    async def run(self, duration: Optional[float] = None, workers: Optional[int] = None) -> None:
+        """
+        循环复查到期的产品，直到 `stop` 或经过 `duration` 秒
+
+        ---
+
+        * `workers`: 同时复查的批数，默认为 context 数量
+        """
+        until = time() + duration if duration is not None else None
+        workers = workers if workers is not None else self._pool.size
+        logger.info(f'开始监控 {len(self._items)} 个产品，{workers} 个 worker')
+        await gather(*(self._worker(i, until) for i in range(workers)))
@@ -0,0 +1,25 @@
+"""XPath"""
+
+CARD_ITEM_WITHOUT_PROMOVAT = (
+    '//div[starts-with(@class, "card-item")]'
+    '[not(.//div[starts-with(@class, "card-v2-badge-cmp-holder")]/span[starts-with(@class, "card-v2-badge-cmp")])]'
+)
+"""产品列表页上非 Promovat 的产品卡片"""
+
+ADD_CART_BUTTON = CARD_ITEM_WITHOUT_PROMOVAT + '//form/button[@data-pnk]'
+"""产品列表页上非 Promovat、非 Vezi Detalii 的加购按钮"""
+
+TOP_FAVORITE_FROM_BUTTON = 'ancestor::div[starts-with(@class,"card-v2-wrapper")]//span[text()="Top Favorite"]'
+"""相对加购按钮的 TOP 标"""
+
+REVIEW_COUNT_FROM_BUTTON = (
+    'ancestor::div[starts-with(@class,"card-v2-wrapper")]'
+    '//div[@class="star-rating-text "]/span[@class="visible-xs-inline-block " and text()!=""]'
+)
+"""相对加购按钮的评论数"""
+
+CAPTCHA_BODY = '/html/body[contains(@class,"captcha")]'
+"""验证码页"""
+
+PRODUCT_PAGE_ADD_CART_BUTTON = '//form//button[contains(@class,"yeahIWantThisProduct")]'
+"""产品详情页上的加购按钮"""
@@ -0,0 +1,78 @@
+// 页面守卫：自动关闭加购弹窗、去除页面遮罩、隐藏 cookie 提示
+// 每处理一次就通过 window.emagGuardReport(kind) 通知 Python（需先 expose_binding）
+(() => {
+    if (window.__emagPageGuard) {
+        return;
+    }
+    window.__emagPageGuard = true;
+
+    const report = (kind) => {
+        if (typeof window.emagGuardReport === 'function') {
+            window.emagGuardReport(kind).catch(() => {});
+        }
+    };
+
+    const first = (xpath) => document.evaluate(
+        xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+    ).singleNodeValue;
+
+    const all = (xpath) => {
+        const snapshot = document.evaluate(
+            xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+        );
+        return Array.from({ length: snapshot.snapshotLength }, (_, i) => snapshot.snapshotItem(i));
+    };
+
+    // 弹窗可能预先渲染好、关闭后只是隐藏再重复使用，所以按是否可见判断，而不是只点一次
+    const isVisible = (el) => el.getClientRects().length > 0 && getComputedStyle(el).visibility !== 'hidden';
+
+    const sweep = () => {
+        // 加购弹窗：点击可见的关闭按钮，让页面自己的脚本复位弹窗状态
+        for (const closeBtn of all('//button[@class="close gtm_6046yfqs"]')) {
+            if (isVisible(closeBtn)) {
+                closeBtn.click();
+                report('cart-dialog');
+            }
+        }
+
+        // 弹窗关闭后残留的遮罩
+        for (const backdrop of document.querySelectorAll('.modal-backdrop')) {
+            backdrop.remove();
+            report('overlay');
+        }
+        if (document.body && document.body.classList.contains('modal-open')) {
+            document.body.classList.remove('modal-open');
+            document.body.style.removeProperty('overflow');
+            document.body.style.removeProperty('padding-right');
+        }
+
+        // cookie 提示
+        const banner = first('//div[starts-with(@class, "gdpr-cookie-banner")]');
+        if (banner && banner.style.visibility !== 'hidden') {
+            banner.style.visibility = 'hidden';
+            report('cookie-banner');
+        }
+    };
+
+    // 只在 DOM 变化时检查，代替定时轮询；重复使用的弹窗只改 class / style，也要监听
+    const observer = new MutationObserver(sweep);
+    const start = () => {
+        sweep();
+        observer.observe(document.documentElement, {
+            childList: true,
+            subtree: true,
+            attributes: true,
+            attributeFilter: ['class', 'style'],
+        });
+    };
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+
+    window.addEventListener('beforeunload', () => {
+        observer.disconnect();
+    });
+})();